@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+# Find the build configuration of GCC which produces the fastest compiler:
+# build candidate configurations (in parallel, within a job budget), benchmark
+# the resulting compilers on a corpus and report compile-speed gains against
+# build cost. Optionally install the winning configuration.
+
+from __future__ import print_function, division
+
+# System
+import sys
+import argparse
+import multiprocessing
+import os, os.path
+import shutil
+import subprocess
+
+# Local
+from gcc.common import run_logged
+from gcc.env import Environment
+from gcc.autotune import TuningStore, load_candidates, recommend, split_jobs
+from gcc.bench import CPU, WALL, BenchmarkStore, compare
+
+env = Environment()
+con = env
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+def get_config():
+    try:
+        from config import cfg
+        return cfg
+    except ImportError:
+        return None
+
+def get_work_dir(args):
+    if args.work_dir is not None:
+        return os.path.abspath(args.work_dir)
+    cfg = get_config()
+    if cfg is None:
+        env.fatal_error('Work directory is not specified')
+    return os.path.abspath(os.path.join(cfg.build_dir, '..', 'autotune'))
+
+def get_source_dir(args):
+    if args.source_dir is not None:
+        return args.source_dir
+    cfg = get_config()
+    if cfg is None:
+        env.fatal_error('Source directory is not specified')
+    return cfg.source_dir
+
+def build_command(args, store, cand, jobs):
+    return [sys.executable, os.path.join(script_dir, 'build.py'),
+            '-s', get_source_dir(args), '-b', store.build_dir(cand.name),
+            '--dest', os.path.dirname(store.prefix(cand.name)),
+            '--prefix', cand.name, '-j', str(jobs), '--install'] + \
+           cand.build_args(store.work_dir) + args.build_args.split()
+
+def run_build(job):
+    (name, cmd, log_path) = job
+    (status, wall, cpu) = run_logged(cmd, log_path)
+    return (name, status, wall, cpu)
+
+def build_candidates(args, store, candidates):
+    """Builds candidates which are not built yet, returns the number of
+    builds"""
+    todo = [cand for cand in candidates
+            if args.rebuild or not store.is_built(cand)]
+    for cand in candidates:
+        if cand not in todo:
+            con.info('{}: already built'.format(cand.name))
+    if not todo:
+        return 0
+    for subdir in ['build', 'install', 'logs']:
+        path = os.path.join(store.work_dir, subdir)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    parallel = min(args.parallel, len(todo))
+    jobs = split_jobs(args.jobs, parallel)
+    con.info('Building {} configuration(s), {} at a time, {} job(s) '
+             'each'.format(len(todo), parallel, jobs))
+    by_name = dict((cand.name, cand) for cand in todo)
+    build_jobs = [(cand.name, build_command(args, store, cand, jobs),
+                   store.log_path(cand.name)) for cand in todo]
+    pool = multiprocessing.Pool(parallel)
+    try:
+        for (name, status, wall, cpu) in pool.imap_unordered(run_build,
+                                                             build_jobs):
+            store.add_build(by_name[name], status, wall, cpu, jobs)
+            if status == 0:
+                con.ok('{}: built in {:.0f} min ({:.1f} CPU hours)'.format(
+                        name, wall / 60, cpu / 3600))
+            else:
+                con.warn('{}: build failed, see {}'.format(
+                        name, store.log_path(name)))
+    finally:
+        pool.terminate()
+        pool.join()
+    return len(todo)
+
+def run_benchmark(args, store, names):
+    path = os.path.join(store.work_dir, 'benchmark.json')
+    cmd = [sys.executable, os.path.join(script_dir, 'benchmark.py'), 'run',
+           args.corpus, '-O', args.levels, '--flags=' + args.flags,
+           '-r', str(args.repeat), '-o', path]
+    if args.cpus is not None:
+        cmd += ['--cpus', args.cpus]
+    for name in names:
+        cmd += ['-c', store.prefix(name)]
+    con.info('Benchmarking {}'.format(', '.join(names)))
+    if subprocess.call(cmd) not in [0, 1]:
+        env.fatal_error('Benchmark failed')
+    store.benchmark = path
+    store.save()
+
+def report(args, store, candidates):
+    """Prints gains and build costs of candidates relative to the baseline,
+    returns the recommended candidate name or None"""
+    bench = BenchmarkStore.load(store.benchmark)
+    names = [cand.name for cand in candidates if cand.name in bench.compilers]
+    if not names:
+        env.fatal_error('None of the candidates was benchmarked (benchmark '
+                        'results: {})'.format(store.benchmark))
+    base = args.baseline or names[0]
+    if base not in bench.compilers:
+        env.fatal_error('Baseline {} was not benchmarked'.format(base))
+    metric = CPU if args.metric == 'cpu' else WALL
+    base_build = store.builds[base]
+    print('\nBaseline: {} (build: {:.0f} min, {:.1f} CPU hours)'.format(
+            base, base_build['wall'] / 60, base_build['cpu'] / 3600))
+    print('{:<20} {:<6} {:>9} {:>10} {:>8} {:>17} {:>10} {:>10}'.format(
+            'Configuration', 'Level', 'build min', 'build cost', 'change',
+            'CI', 'speedup', 'CPUh/1%'))
+    comparisons = []
+    for name in names:
+        if name == base:
+            continue
+        build = store.builds[name]
+        extra = (build['cpu'] - base_build['cpu']) / 3600
+        for level in bench.levels:
+            comp = compare(bench, base, name, level, metric, args.confidence)
+            if comp is None:
+                continue
+            comparisons.append(comp)
+            gain = -comp.percent
+            print('{:<20} -O{:<4} {:>9.0f} {:>9.2f}x {:>+7.1f}% '
+                  '[{:>+6.1f},{:>+6.1f}] {:>9.3f}x {:>10}{}'.format(
+                    name[:20], level, build['wall'] / 60,
+                    build['cpu'] / base_build['cpu']
+                    if base_build['cpu'] else 0, comp.percent,
+                    100 * (comp.low - 1), 100 * (comp.high - 1),
+                    comp.speedup,
+                    '{:.2f}'.format(extra / gain) if gain > 0 else '-',
+                    ' *' if comp.is_significant(args.threshold) else ''))
+    # The gain must hold at all levels: candidates are compared by their
+    # worst level
+    worst = []
+    for name in names:
+        comps = [comp for comp in comparisons if comp.new == name]
+        if comps:
+            worst.append(max(comps, key=lambda comp: comp.ratio))
+    best = recommend(worst, args.threshold)
+    if best is None:
+        con.ok('No configuration is significantly faster than {}'.format(base))
+        return None
+    con.ok('Recommended configuration: {} ({:.1f}% faster than {} at '
+           '-O{})'.format(best.new, -best.percent, base, best.level))
+    return best.new
+
+def get_install_dir(args):
+    if args.install_dir is not None:
+        return os.path.abspath(args.install_dir)
+    cfg = get_config()
+    if cfg is None:
+        env.fatal_error('Installation directory is not specified')
+    return cfg.install_dir
+
+def install(args, store, name):
+    """Copies the installation of an already built candidate into the
+    installation directory (GCC installations are relocatable)"""
+    src = store.prefix(name)
+    if not os.path.isdir(src):
+        env.fatal_error('Installation of {} not found: {}'.format(name, src))
+    dest = os.path.join(get_install_dir(args), name)
+    if os.path.exists(dest):
+        con.info('Install directory already exists. Cleaning up.')
+        shutil.rmtree(dest)
+    con.info('Installing {} into {}'.format(name, dest))
+    try:
+        shutil.copytree(src, dest, symlinks=True)
+    except (IOError, OSError, shutil.Error) as ex:
+        env.fatal_error('Installation failed: {}'.format(ex))
+    con.ok('Installed successfully')
+
+def get_candidates(args):
+    try:
+        return load_candidates(args.candidates)
+    except (IOError, ValueError) as ex:
+        env.fatal_error('Invalid candidates file: {}'.format(ex))
+
+def cmd_run(args):
+    candidates = get_candidates(args)
+    work_dir = get_work_dir(args)
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    store = TuningStore(work_dir)
+    num_built = build_candidates(args, store, candidates)
+    names = [cand.name for cand in candidates if store.is_built(cand)]
+    if args.baseline is not None and args.baseline not in names:
+        env.fatal_error('Baseline {} was not built'.format(args.baseline))
+    if len(names) < 2:
+        env.fatal_error('At least two configurations must be built for '
+                        'comparison')
+    benchmarked = []
+    if store.benchmark is not None and os.path.isfile(store.benchmark):
+        benchmarked = list(BenchmarkStore.load(store.benchmark).compilers)
+    if num_built or set(benchmarked) != set(names):
+        run_benchmark(args, store, names)
+    name = report(args, store, candidates)
+    if args.install and name is not None:
+        install(args, store, name)
+
+def cmd_report(args):
+    candidates = get_candidates(args)
+    store = TuningStore(get_work_dir(args))
+    if store.benchmark is None or not os.path.isfile(store.benchmark):
+        env.fatal_error('No benchmark results (use "autotune.py run")')
+    name = report(args, store, candidates)
+    if args.install and name is not None:
+        install(args, store, name)
+
+def add_common_args(parser):
+    parser.add_argument('-C', '--candidates', metavar='FILE',
+                        help='JSON file with the list of candidate '
+                        'configurations: objects with keys name, build_type '
+                        '(e.g., fdo or bootstrap), build_config (list of '
+                        'build config scripts, e.g., ["bootstrap-O3"]), '
+                        'boot_flags (BOOT_CFLAGS) and config_options '
+                        '(default: FDO with -O3, LTO and -march=native '
+                        'variants)')
+    parser.add_argument('-w', '--work-dir', dest='work_dir',
+                        help='directory for builds, installations and results '
+                        '(default: "autotune" next to the build directory)')
+    parser.add_argument('-s', '--source', dest='source_dir',
+                        help='source directory (default: from config.py)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='total number of make jobs (default: '
+                        '%(default)s)')
+    parser.add_argument('--build-args', dest='build_args', default='',
+                        help='additional build.py arguments for all '
+                        'configurations, e.g., "--release"')
+    parser.add_argument('-b', '--baseline',
+                        help='baseline configuration (default: the first '
+                        'one)')
+    parser.add_argument('-m', '--metric', choices=['cpu', 'wall'],
+                        default='cpu',
+                        help='compared metric (default: %(default)s)')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='confidence level (default: %(default)s)')
+    parser.add_argument('--threshold', type=float, default=1.0,
+                        help='minimal gain considered significant, percent '
+                        '(default: %(default)s)')
+    parser.add_argument('--install', action='store_true',
+                        help='install the recommended configuration into the '
+                        'installation directory (copies the candidate\'s '
+                        'installation, no rebuild)')
+    parser.add_argument('--dest', dest='install_dir',
+                        help='installation top directory for --install '
+                        '(default: from config.py)')
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the fastest build '
+                                     'configuration of GCC')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    p = sub.add_parser('run', help='build and benchmark configurations')
+    p.add_argument('corpus', metavar='DIR',
+                   help='benchmark corpus (see benchmark.py)')
+    add_common_args(p)
+    p.add_argument('-p', '--parallel', type=int, default=2,
+                   help='number of simultaneous builds (default: '
+                   '%(default)s)')
+    p.add_argument('--rebuild', action='store_true',
+                   help='rebuild configurations which are already built')
+    p.add_argument('-O', '--levels', default='2',
+                   help='comma-separated optimization levels (default: '
+                   '%(default)s)')
+    p.add_argument('-f', '--flags', default='-c',
+                   help='other compiler flags (default: %(default)s)')
+    p.add_argument('-r', '--repeat', type=int, default=5,
+                   help='number of repetitions (default: %(default)s)')
+    p.add_argument('--cpus',
+                   help='comma-separated list of CPUs for the benchmark '
+                   '(default: the last available CPU)')
+    p.set_defaults(func=cmd_run)
+    p = sub.add_parser('report', help='report results of a previous run')
+    add_common_args(p)
+    p.set_defaults(func=cmd_report)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
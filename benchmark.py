@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+
+# Compile-time benchmark: compile a fixed (versioned) corpus of translation
+# units with several installed compilers at several optimization levels,
+# measure wall time, CPU time and peak RSS and compare the compilers.
+
+from __future__ import print_function, division
+
+# System
+import sys
+import argparse
+import fnmatch
+import json
+import multiprocessing
+import os, os.path
+import platform
+import shlex
+import time
+
+# Local
+from gcc.common import collect_sources, sha1_file
+from gcc.env import Environment
+from gcc.invoke import (GCCInvoker, CompilerList, resolve_compiler,
+                        compiler_label)
+from gcc.bench import (METRICS, RSS, BenchmarkStore, available_cpus, compare,
+                       corpus_version, make_manifest, measure, median,
+                       pin_to_cpu, read_manifest, write_manifest)
+
+env = Environment()
+con = env
+
+def get_install_dir(args):
+    if args.install_dir is not None:
+        return args.install_dir
+    try:
+        from config import cfg
+        return cfg.install_dir
+    except ImportError:
+        return None
+
+def init_worker(cpus):
+    cpu = cpus.get()
+    if cpu is not None and not pin_to_cpu(cpu):
+        con.warn('Failed to bind process to CPU {}'.format(cpu))
+
+def run_job(job):
+    (rep, idx, path, level, root, fname, flags, timeout) = job
+    cmd = [path] + flags + ['-O' + level, os.path.join(root, fname), '-o',
+                            os.devnull]
+    (sample, error) = measure(cmd, timeout)
+    return (rep, idx, level, fname, sample, error)
+
+def load_corpus(root):
+    """Returns the corpus description: path, version and files (with
+    SHA-1). If the corpus has a manifest, the files are verified against
+    it"""
+    manifest = read_manifest(root)
+    if manifest is None:
+        con.warn('{} has no manifest, results will be comparable only with '
+                 'runs on identical files (use "benchmark.py corpus" to '
+                 'create one)'.format(root))
+        manifest = make_manifest(root, collect_sources([root]))
+    else:
+        for (name, digest) in manifest.items():
+            path = os.path.join(root, name)
+            if not os.path.isfile(path):
+                env.fatal_error('Corpus file {} is missing'.format(path))
+            if sha1_file(path) != digest:
+                env.fatal_error('Corpus file {} does not match the '
+                                'manifest'.format(path))
+    return { 'path': os.path.abspath(root),
+             'version': corpus_version(manifest), 'files': manifest }
+
+def find_compilers(args):
+    """Returns the list of (label, path). Labels of installed compilers are
+    names of their installation directories (e.g., gcc-6-latest-fdo)"""
+    result = []
+    install_dir = get_install_dir(args)
+    if args.patterns:
+        if install_dir is None:
+            env.fatal_error('Installation directory is not specified (use '
+                            '--install-dir or config.py)')
+        comp_list = CompilerList()
+        comp_list.discover_versions(env, install_dir)
+        for (name, compiler) in comp_list.get_drivers().items():
+            if any(fnmatch.fnmatch(name, pattern)
+                   for pattern in args.patterns):
+                result.append((name, compiler.path))
+    for spec in args.compilers or []:
+        path = resolve_compiler(spec, install_dir)
+        if path is None:
+            env.fatal_error('Compiler {} not found'.format(spec))
+        if path == os.path.abspath(spec):
+            label = compiler_label(GCCInvoker(path))
+        else:
+            label = os.path.basename(os.path.normpath(spec))
+        result.append((label, path))
+    if not result:
+        env.fatal_error('No compilers found')
+    labels = []
+    for (n, (label, path)) in enumerate(result):
+        if label in labels:
+            label += '-{}'.format(n + 1)
+        labels.append(label)
+    return [(label, path) for (label, (_, path)) in zip(labels, result)]
+
+def format_value(metric, value):
+    if metric == RSS:
+        return '{:.1f}M'.format(value / 1024)
+    return '{:.2f}s'.format(value)
+
+def get_comparisons(args, store):
+    labels = list(store.compilers)
+    base = args.baseline or labels[0]
+    if base not in store.compilers:
+        env.fatal_error('Unknown compiler {}'.format(base))
+    others = args.new or [label for label in labels if label != base]
+    result = []
+    for new in others:
+        if new not in store.compilers:
+            env.fatal_error('Unknown compiler {}'.format(new))
+        for level in store.levels:
+            for metric in METRICS:
+                comp = compare(store, base, new, level, metric,
+                               args.confidence, args.iterations)
+                if comp is not None:
+                    result.append(comp)
+    return result
+
+def print_comparisons(args, store):
+    """Prints comparisons of compilers against the baseline, returns True if
+    any of them is significant"""
+    comparisons = get_comparisons(args, store)
+    any_significant = False
+    header = None
+    for comp in comparisons:
+        if header != (comp.old, comp.new):
+            header = (comp.old, comp.new)
+            print('\n{} vs {} ({:.0f}% confidence)'.format(
+                    comp.new, comp.old, 100 * args.confidence))
+            print('{:<6} {:<5} {:>5} {:>10} {:>10} {:>8} {:>17} {:>8}'.format(
+                    'Level', 'Metr.', 'Files', 'old', 'new', 'change',
+                    'CI', 'speedup'))
+        significant = comp.is_significant(args.threshold)
+        any_significant = any_significant or significant
+        print('-O{:<4} {:<5} {:>5} {:>10} {:>10} {:>+7.1f}% '
+              '[{:>+6.1f},{:>+6.1f}] {:>7.3f}x{}'.format(
+                comp.level, comp.metric, comp.num_files,
+                format_value(comp.metric, comp.old_value),
+                format_value(comp.metric, comp.new_value), comp.percent,
+                100 * (comp.low - 1), 100 * (comp.high - 1), comp.speedup,
+                ' *' if significant else ''))
+    if args.json:
+        data = { 'corpus_version': store.corpus.get('version'),
+                 'confidence': args.confidence,
+                 'comparisons': [dict(comp.to_json(), significant=
+                                      comp.is_significant(args.threshold))
+                                 for comp in comparisons] }
+        with open(args.json, 'w') as f:
+            json.dump(data, f, indent=1)
+        con.ok('Saved {}'.format(args.json))
+    return any_significant
+
+def cmd_corpus(args):
+    files = collect_sources([args.corpus])
+    if not files:
+        env.fatal_error('No source files found in {}'.format(args.corpus))
+    manifest = make_manifest(args.corpus, files)
+    write_manifest(args.corpus, manifest)
+    con.ok('Corpus version {}: {} file(s)'.format(corpus_version(manifest),
+                                                 len(manifest)))
+
+def cmd_run(args):
+    corpus = load_corpus(args.corpus)
+    if not corpus['files']:
+        env.fatal_error('Corpus is empty')
+    compilers = find_compilers(args)
+    levels = [level.strip() for level in args.levels.split(',')]
+    flags = shlex.split(args.flags)
+    if args.cpus is not None:
+        cpus = [int(cpu) for cpu in args.cpus.split(',')]
+    else:
+        # The last CPU usually handles fewer interrupts than the first one
+        cpus = available_cpus()[-1:]
+    store = BenchmarkStore(corpus, flags)
+    store.settings = { 'levels': levels, 'repeat': args.repeat,
+                       'warmup': args.warmup, 'cpus': cpus,
+                       'host': platform.node(),
+                       'date': time.strftime('%Y-%m-%d %H:%M:%S') }
+    for (label, path) in compilers:
+        compiler = GCCInvoker(path)
+        con.info('{}: {} ({})'.format(label, compiler, path))
+        store.add_compiler(label, path, compiler.full_version_str)
+    files = list(corpus['files'])
+    # Compilers are the innermost loop, so that slow drift of machine state
+    # affects all compilers equally
+    jobs = [(rep, idx, path, level, corpus['path'], fname, flags,
+             args.timeout)
+            for rep in range(args.warmup + args.repeat)
+            for level in levels
+            for fname in files
+            for (idx, (_, path)) in enumerate(compilers)]
+    con.info('Corpus {} ({} file(s)), levels: {}, {} warmup + {} '
+             'repetition(s), CPUs: {}'.format(
+                corpus['version'], len(files),
+                ', '.join('-O' + level for level in levels), args.warmup,
+                args.repeat, ', '.join(str(cpu) for cpu in cpus)))
+    queue = multiprocessing.Queue()
+    for cpu in cpus:
+        queue.put(cpu)
+    pool = multiprocessing.Pool(len(cpus), init_worker, (queue,))
+    try:
+        for (rep, idx, level, fname, sample, error) in \
+                pool.imap_unordered(run_job, jobs):
+            label = compilers[idx][0]
+            if error is not None:
+                store.add_failure(label, level, fname, error)
+            elif rep >= args.warmup:
+                store.add(label, level, fname, sample)
+    finally:
+        pool.terminate()
+        pool.join()
+    for label in store.compilers:
+        num_failed = sum(len(failed)
+                         for failed in store.failed[label].values())
+        if num_failed:
+            con.warn('{}: {} compilation(s) failed'.format(label, num_failed))
+    store.save(args.output)
+    con.ok('Saved {}'.format(args.output))
+    if len(store.compilers) > 1:
+        print_comparisons(args, store)
+
+def load_stores(paths):
+    store = BenchmarkStore.load(paths[0])
+    for path in paths[1:]:
+        other = BenchmarkStore.load(path)
+        if other.corpus['version'] != store.corpus['version']:
+            env.fatal_error('{} uses a different corpus version ({} vs '
+                            '{})'.format(path, other.corpus['version'],
+                                         store.corpus['version']))
+        if other.flags != store.flags:
+            con.warn('{}: flags differ: "{}" vs "{}"'.format(
+                        path, ' '.join(other.flags), ' '.join(store.flags)))
+        if other.settings.get('host') != store.settings.get('host'):
+            con.warn('{}: results were obtained on a different '
+                     'host'.format(path))
+        store.merge(other)
+    return store
+
+def cmd_show(args):
+    store = load_stores(args.stores)
+    print('Corpus {} ({} file(s)), flags: {}'.format(
+            store.corpus['version'], len(store.corpus['files']),
+            ' '.join(store.flags)))
+    print('{:<30} {:<6} {:>5} {:>10} {:>10} {:>10}'.format(
+            'Compiler', 'Level', 'Files', 'wall', 'cpu', 'peak rss'))
+    for label in store.compilers:
+        for level in store.levels:
+            files = store.files(label, level)
+            if not files:
+                continue
+            totals = []
+            for metric in METRICS:
+                medians = [median(store.samples(label, level, fname, metric))
+                           for fname in files]
+                totals.append(max(medians) if metric == RSS else sum(medians))
+            print('{:<30} -O{:<4} {:>5} {:>10} {:>10} {:>10}'.format(
+                    label[:30], level, len(files),
+                    *[format_value(metric, value)
+                      for (metric, value) in zip(METRICS, totals)]))
+
+def cmd_compare(args):
+    store = load_stores(args.stores)
+    sys.exit(1 if print_comparisons(args, store) else 0)
+
+def add_compare_args(parser):
+    parser.add_argument('-b', '--baseline',
+                        help='baseline compiler (label, e.g., '
+                        'gcc-6-latest-rel; default: the first one)')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='confidence level (default: %(default)s)')
+    parser.add_argument('--iterations', type=int, default=1000,
+                        help='number of bootstrap iterations (default: '
+                        '%(default)s)')
+    parser.add_argument('--threshold', type=float, default=1.0,
+                        help='minimal relative change considered significant, '
+                        'percent (default: %(default)s)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='save comparisons to FILE (JSON)')
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile-time benchmark of '
+                                     'installed compilers')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    p = sub.add_parser('corpus', help='create (or update) corpus manifest')
+    p.add_argument('corpus', metavar='DIR', help='corpus directory')
+    p.set_defaults(func=cmd_corpus)
+    p = sub.add_parser('run', help='run the benchmark')
+    p.add_argument('corpus', metavar='DIR', help='corpus directory')
+    p.add_argument('-c', '--compiler', dest='compilers', action='append',
+                   help='compiler: path to the driver, installation prefix or '
+                   'name of installation directory; can be specified '
+                   'multiple times')
+    p.add_argument('-d', '--discover', dest='patterns', action='append',
+                   metavar='PATTERN',
+                   help='use compilers installed in the installation '
+                   'directory whose names match PATTERN (e.g., '
+                   "'gcc-6-latest-*'); can be specified multiple times")
+    p.add_argument('--install-dir', dest='install_dir',
+                   help='installation directory (default: from config.py)')
+    p.add_argument('-O', '--levels', default='0,2,3',
+                   help='comma-separated optimization levels (default: '
+                   '%(default)s)')
+    p.add_argument('-f', '--flags', default='-c',
+                   help='other compiler flags (default: %(default)s)')
+    p.add_argument('-r', '--repeat', type=int, default=5,
+                   help='number of repetitions (default: %(default)s)')
+    p.add_argument('-w', '--warmup', type=int, default=1,
+                   help='number of discarded warmup runs (default: '
+                   '%(default)s)')
+    p.add_argument('--cpus',
+                   help='comma-separated list of CPUs to use, one job per CPU '
+                   '(default: the last available CPU)')
+    p.add_argument('--timeout', type=float, default=600,
+                   help='kill the compiler after TIMEOUT seconds '
+                   '(default: %(default)s)')
+    p.add_argument('-o', '--output', default='benchmark.json',
+                   help='output file (default: %(default)s)')
+    add_compare_args(p)
+    p.set_defaults(func=cmd_run, new=None)
+    p = sub.add_parser('show', help='show totals')
+    p.add_argument('stores', metavar='RESULT', nargs='+',
+                   help='results of run (JSON)')
+    p.set_defaults(func=cmd_show)
+    p = sub.add_parser('compare', help='compare compilers')
+    p.add_argument('stores', metavar='RESULT', nargs='+',
+                   help='results of run (JSON) on the same corpus')
+    p.add_argument('-n', '--new', action='append',
+                   help='compiler to compare with the baseline (default: all '
+                   'others); can be specified multiple times')
+    add_compare_args(p)
+    p.set_defaults(func=cmd_compare)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ import sys
 import argparse
 import multiprocessing
 import os.path
+import json
 
 # Local
 import gcc.build as bld
@@ -37,6 +38,16 @@ def main():
                         help='number of jobs for make')
     parser.add_argument('--isl', help='path to libisl (one dir above)',
                         dest='isl', default=cfg.libs_dir)
+    parser.add_argument('--prereqs', action='store_true',
+                        default=bool(cfg.prereq_cache_enabled),
+                        help='use gmp, mpfr, mpc and isl from the '
+                        'prerequisite cache (libraries are built with the '
+                        'stage 0 compiler when needed) instead of building '
+                        'them with GCC')
+    parser.add_argument('--prereq-cache', dest='prereq_cache',
+                        default=cfg.prereq_cache or os.path.join(
+                            cfg.build_dir, '..', 'prereqs'),
+                        help='prerequisite cache directory')
     parser.add_argument('--languages', help='comma-separated list of enabled frontends'
                         ' (default: {}, also available: {})'.format(', '.join(DEFAULT_LANG),
                                                                     ', '.join(EXTRA_LANG)),
@@ -81,17 +92,41 @@ def main():
                         dest='target')
     parser.add_argument('--config-options', help='addittional options for'
                         ' configure script', dest='config_options')
-    parser.add_argument('--config-script', help='additional script which'
-                        ' configure will run', dest='config_script')
+    parser.add_argument('--config-script', help='additional build config'
+                        ' scripts (--with-build-config): comma-separated list'
+                        ' of names (e.g., bootstrap-O3,bootstrap-lto) or paths'
+                        ' to .mk files', dest='config_script')
     parser.add_argument('--no-make', '--nomake', '--configure',
                         action='store_true', dest='nomake',
                         help='only run "configure" script (do not run "make")')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='incremental rebuild in an existing build '
+                        'directory: remake only the compilers proper of the '
+                        'selected languages in the gcc subdirectory (e.g., '
+                        'with --cc1 or --cc1plus); changes outside of gcc/ '
+                        'require a full build')
     parser.add_argument('--cc', help='C compiler (stage 0).'
                         ' By default use system compiler')
     parser.add_argument('--cxx', help='C++ compiler (stage 0).'
                         ' By default use system compiler')
     parser.add_argument('--gcc', help='C/C++ compiler (stage 0) bin directory.'
                         ' If specified, gcc and g++ found in that directory will be used')
+    stage0 = parser.add_mutually_exclusive_group()
+    stage0.add_argument('--auto-stage0', action='store_true',
+                        dest='auto_stage0',
+                        help='use the fastest installed compiler as stage 0 '
+                        'compiler (installed compilers are benchmarked using '
+                        'the existing build directory, the ranking is '
+                        'cached). Default if stage0_gcc in config.py is '
+                        '"auto"')
+    stage0.add_argument('--rank-stage0', action='store_true',
+                        dest='rank_stage0',
+                        help='like --auto-stage0, but benchmark compilers '
+                        'even if a ranking is cached')
+    parser.add_argument('--stage0-ranking', dest='stage0_ranking',
+                        default=cfg.stage0_ranking or os.path.join(
+                            cfg.build_dir, '..', 'stage0_ranking.json'),
+                        help='file with the ranking of stage 0 compilers')
     parser.add_argument('--as', help='assembler to use',
                         default=cfg.assembler, dest='assembler') # Argh, 'as' is a keyword
     parser.add_argument('--flags', help='Flags for stage0 (C and C++), by default will use '
@@ -99,6 +134,60 @@ def main():
                         '"-pipe -Og -ggdb3" for debug build (-g)')
     parser.add_argument('--mem-stats', help='Enable memory statistics',
                         action='store_true', dest='mem_stats')
+    parser.add_argument('--dist', default=cfg.dist_workers,
+                        help='distribute compilation (minimal and stage1 '
+                        'builds) to workers: comma-separated list of '
+                        'HOST[:PORT] running dist_worker.py, or "local:N" '
+                        'for N local worker processes (for testing)')
+    parser.add_argument('--dist-stats', dest='dist_stats',
+                        default=cfg.dist_stats or os.path.join(
+                            cfg.build_dir, '..', 'build_times.json'),
+                        help='file with durations of local and distributed '
+                        'builds, used to report the speedup')
+    parser.add_argument('--checkpoints', action='store_true',
+                        default=bool(cfg.checkpoints_enabled),
+                        help='start the build from a checkpoint of a '
+                        'configured build directory with the same '
+                        'configuration (cloned with reflinks or hardlinks '
+                        'when possible), save a checkpoint after configure '
+                        'otherwise')
+    parser.add_argument('--checkpoint-dir', dest='checkpoint_dir',
+                        default=cfg.checkpoint_dir or os.path.join(
+                            cfg.build_dir, '..', 'checkpoints'),
+                        help='directory with checkpoints of configured build '
+                        'directories')
+    parser.add_argument('--cache', action='store_true',
+                        default=bool(cfg.compile_cache_enabled),
+                        help='use the compile cache (non-bootstrap builds): '
+                        'object files are looked up by the preprocessed '
+                        'source, flags and identity of the stage 0 compiler')
+    parser.add_argument('--cache-dir', dest='cache_dir',
+                        default=cfg.compile_cache or os.path.join(
+                            cfg.build_dir, '..', 'compile_cache'),
+                        help='compile cache directory')
+    parser.add_argument('--cache-size', dest='cache_size',
+                        default=cfg.compile_cache_size or '10G',
+                        help='maximal size of the compile cache, least '
+                        'recently used entries are removed (default: '
+                        '%(default)s)')
+    check = parser.add_mutually_exclusive_group()
+    check.add_argument('--check', action='store_true',
+                        help='run the testsuite after build (in parallel, '
+                        'sharded by .exp files)')
+    check.add_argument('--check-only', action='store_true', dest='check_only',
+                        help='only run the testsuite in an existing build '
+                        'directory')
+    parser.add_argument('--check-flags', dest='check_flags',
+                        help='additional RUNTESTFLAGS for the testsuite, e.g., '
+                        '"--target_board=unix/-m32"')
+    parser.add_argument('--check-history', dest='check_history',
+                        default=cfg.check_history or os.path.join(
+                            cfg.build_dir, '..', 'check_history.json'),
+                        help='file with durations of testsuite parts, used '
+                        'for scheduling')
+    parser.add_argument('--fingerprint', action='store_true',
+                        help='print the fingerprint of the build (used by '
+                        'build_queue.py to merge identical builds) and exit')
     parser.add_argument('-q', '--quiet', dest='quiet', action='store_true',
                         help='Do not copy configure/make output to stdout')
     args = parser.parse_args()
@@ -135,12 +224,21 @@ def main():
         args.build_type = bld.MINIMAL # Override default value
 
     # Stage 0 compiler
+    explicit_stage0 = args.gcc is not None or args.cc is not None or \
+                      args.cxx is not None
+    if args.rank_stage0:
+        args.auto_stage0 = True
+    if args.auto_stage0 and explicit_stage0:
+        parser.error('--auto-stage0 and --rank-stage0 options are '
+                     'incompatible with --gcc, --cc and --cxx')
+    if cfg.stage0_gcc == 'auto' and not explicit_stage0:
+        args.auto_stage0 = True
     if args.gcc is not None:
         if args.cc is not None or args.cxx is not None:
             parser.error('--gcc option is incompatible with --cc and --cxx')
         args.cc = os.path.join(args.gcc, 'gcc')
         args.cxx = os.path.join(args.gcc, 'g++')
-    elif cfg.stage0_gcc is not None:
+    elif cfg.stage0_gcc is not None and cfg.stage0_gcc != 'auto':
         if args.cc is None:
             args.cc = os.path.join(cfg.stage0_gcc, 'gcc')
         if args.cxx is None:
@@ -150,8 +248,26 @@ def main():
     if args.cxx is not None and not os.path.exists(args.cxx):
         parser.error('C++ compiler "{}" not found'.format(args.cxx))
 
+    if args.rebuild and (args.nomake or args.check_only):
+        parser.error('--rebuild is incompatible with --no-make and '
+                     '--check-only')
+
     builder = bld.GCCBuilder(env)
-    builder.build(args)
+    if args.fingerprint:
+        print(json.dumps(builder.fingerprint(args)))
+        return
+    if args.check_only:
+        builder.check(args)
+        return
+    # The stage 0 compiler of a rebuild is the one of the build directory
+    if args.auto_stage0 and not args.rebuild:
+        builder.select_stage0(args)
+    if args.rebuild:
+        builder.rebuild(args)
+    else:
+        builder.build(args)
+    if args.check:
+        builder.check(args)
     if args.install:
         builder.install(args)
 
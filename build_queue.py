@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+# Local build queue: run "build_queue.py serve" once per host, then submit
+# builds instead of running build.py or tarball_build.py directly:
+#   build_queue.py submit build -- --bootstrap --install
+#   build_queue.py submit -p 10 tarball -- -b 6
+# Identical builds are merged, jobs are scheduled by priority within the CPU
+# and memory limits of the service and each job gets its own build directory.
+
+from __future__ import print_function, division
+
+# System
+import sys
+import argparse
+import getpass
+import multiprocessing
+import os, os.path
+import signal
+import socket
+import time
+
+# Local
+from gcc.env import Environment
+from gcc.buildqueue import (DEFAULT_MEMORY_PER_CPU, DEFAULT_PRIORITY, DONE,
+                            QUEUED, RUNNING, SCRIPTS, BuildQueue, QueueServer,
+                            request, total_memory)
+from gcc.common import format_size, parse_size
+from gcc.netmsg import recv_msg
+
+env = Environment()
+con = env
+
+def get_queue_dir(args):
+    if args.queue_dir is not None:
+        return os.path.abspath(args.queue_dir)
+    try:
+        from config import cfg
+    except ImportError:
+        env.fatal_error('Queue directory is not specified')
+    return os.path.abspath(cfg.build_queue or
+                           os.path.join(cfg.build_dir, '..', 'build_queue'))
+
+def call(args, req):
+    """Sends a request, returns the reply"""
+    try:
+        sock = request(get_queue_dir(args), req)
+    except socket.error as ex:
+        env.fatal_error('Cannot connect to the build queue service ({}), is '
+                        '"build_queue.py serve" running?'.format(ex))
+    try:
+        (reply, _, _) = recv_msg(sock)
+    finally:
+        sock.close()
+    if reply['status'] != 'ok':
+        env.fatal_error(reply['error'])
+    return reply
+
+def follow_log(args, job_id, follow):
+    """Prints the log of a job, returns its exit status"""
+    try:
+        sock = request(get_queue_dir(args), { 'type': 'log', 'id': job_id,
+                                              'follow': follow })
+    except socket.error as ex:
+        env.fatal_error('Cannot connect to the build queue service: ' +
+                        str(ex))
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    try:
+        while True:
+            (reply, data, _) = recv_msg(sock)
+            if reply['status'] == 'data':
+                out.write(data)
+                out.flush()
+                continue
+            if reply['status'] != 'ok':
+                env.fatal_error(reply['error'])
+            job = reply['job']
+            break
+    finally:
+        sock.close()
+    if follow:
+        con.info('Job {}: {}'.format(job_id, job['state']))
+    return 0 if job['state'] == DONE else 1
+
+def format_time(timestamp):
+    if timestamp is None:
+        return '-'
+    return time.strftime('%m-%d %H:%M', time.localtime(timestamp))
+
+def cmd_serve(args):
+    queue_dir = get_queue_dir(args)
+    try:
+        max_memory = parse_size(args.memory) if args.memory else \
+                     total_memory()
+    except ValueError:
+        env.fatal_error('Invalid memory size: ' + args.memory)
+    queue = BuildQueue(queue_dir, args.cpus, max_memory)
+    server = QueueServer(queue)
+    con.ok('Build queue in {}: {} CPU(s), {} of memory, {} job(s) '
+           'queued'.format(queue_dir, args.cpus, format_size(max_memory),
+                           len([job for job in queue.jobs.values()
+                                if job['state'] == QUEUED])))
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+    # Running jobs are stopped and requeued when the service is stopped
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+def cmd_submit(args):
+    build_args = args.args
+    if build_args and build_args[0] == '--':
+        build_args = build_args[1:]
+    try:
+        memory = parse_size(args.memory) if args.memory else \
+                 args.cpus * DEFAULT_MEMORY_PER_CPU
+    except ValueError:
+        env.fatal_error('Invalid memory size: ' + args.memory)
+    reply = call(args, { 'type': 'submit', 'script': args.script,
+                         'args': build_args, 'cwd': os.getcwd(),
+                         'priority': args.priority, 'cpus': args.cpus,
+                         'memory': memory, 'keep': args.keep,
+                         'force': args.force, 'user': getpass.getuser() })
+    job = reply['job']
+    if reply['duplicate']:
+        con.ok('Identical to job {} ({}, {}), not queued again'.format(
+                    job['id'], job['description'], job['state']))
+    else:
+        con.ok('Queued job {}: {}'.format(job['id'], job['description']))
+    if args.follow:
+        sys.exit(follow_log(args, job['id'], True))
+
+def cmd_list(args):
+    reply = call(args, { 'type': 'list' })
+    jobs = reply['jobs']
+    if not args.all:
+        jobs = [job for job in jobs if job['state'] in [QUEUED, RUNNING]]
+    print('CPUs: {} of {}, memory: {} of {}'.format(
+            reply['cpus'][0], reply['cpus'][1],
+            format_size(reply['memory'][0]), format_size(reply['memory'][1])))
+    print('{:>5} {:<9} {:>4} {:>4} {:>7} {:<11} {:<11} {:<12} {}'.format(
+            'ID', 'State', 'Prio', 'CPUs', 'Memory', 'Submitted', 'Started',
+            'Users', 'Build'))
+    for job in jobs:
+        print('{:>5} {:<9} {:>4} {:>4} {:>7} {:<11} {:<11} {:<12} {}'.format(
+                job['id'], job['state'], job['priority'], job['cpus'],
+                format_size(job['memory']), format_time(job['submitted']),
+                format_time(job['started']), ','.join(job['users'])[:12],
+                '{}: {}'.format(SCRIPTS[job['script']], job['description'])))
+
+def cmd_log(args):
+    sys.exit(follow_log(args, args.id, args.follow))
+
+def cmd_cancel(args):
+    call(args, { 'type': 'cancel', 'id': args.id })
+    con.ok('Canceled job {}'.format(args.id))
+
+def main():
+    parser = argparse.ArgumentParser(description='Local build queue service '
+                                     'and client')
+    parser.add_argument('-d', '--queue-dir', dest='queue_dir',
+                        help='queue directory: state, logs, build '
+                        'directories and the socket (default: "build_queue" '
+                        'next to the build directory)')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    p = sub.add_parser('serve', help='run the service')
+    p.add_argument('-c', '--cpus', type=int,
+                   default=multiprocessing.cpu_count(),
+                   help='CPUs available to jobs (default: %(default)s)')
+    p.add_argument('-m', '--memory',
+                   help='memory available to jobs, e.g., 64G (default: '
+                   'physical memory)')
+    p.set_defaults(func=cmd_serve)
+    p = sub.add_parser('submit', help='submit a build')
+    p.add_argument('script', choices=sorted(SCRIPTS),
+                   help='build (build.py) or tarball (tarball_build.py)')
+    p.add_argument('args', nargs=argparse.REMAINDER,
+                   help='arguments of the script (after "--"); the build '
+                   'directory and, for build.py, the number of jobs are set '
+                   'by the queue')
+    p.add_argument('-p', '--priority', type=int, default=DEFAULT_PRIORITY,
+                   help='priority, jobs with higher priority start first '
+                   '(default: %(default)s)')
+    p.add_argument('-c', '--cpus', type=int,
+                   default=multiprocessing.cpu_count(),
+                   help='CPUs used by the job (make jobs of build.py; '
+                   'default: %(default)s)')
+    p.add_argument('-m', '--memory',
+                   help='memory used by the job (default: {} per '
+                   'CPU)'.format(format_size(DEFAULT_MEMORY_PER_CPU)))
+    p.add_argument('-f', '--follow', action='store_true',
+                   help='print the log of the job until it finishes')
+    p.add_argument('--force', action='store_true',
+                   help='build again even if an identical build succeeded')
+    p.add_argument('--keep', action='store_true',
+                   help='keep the build directory after the job finishes')
+    p.set_defaults(func=cmd_submit)
+    p = sub.add_parser('list', help='list jobs')
+    p.add_argument('-a', '--all', action='store_true',
+                   help='include finished jobs')
+    p.set_defaults(func=cmd_list)
+    p = sub.add_parser('log', help='print the log of a job')
+    p.add_argument('id', type=int, help='job ID')
+    p.add_argument('-f', '--follow', action='store_true',
+                   help='wait for new output until the job finishes')
+    p.set_defaults(func=cmd_log)
+    p = sub.add_parser('cancel', help='cancel a job')
+    p.add_argument('id', type=int, help='job ID')
+    p.set_defaults(func=cmd_cancel)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# Compare dejagnu .sum files of two builds (a faster replacement for
+# contrib/compare_tests): report new failures, fixed tests, new and removed
+# tests and flaky-looking changes, grouped by .exp file.
+
+from __future__ import print_function
+
+# System
+import sys
+import argparse
+import json
+import multiprocessing
+import os.path
+import re
+
+# Local
+from gcc.env import Environment
+from gcc.sumfile import (compare_sums, default_flaky_patterns, find_sum_files,
+                         parse_sum)
+
+env = Environment()
+con = env
+
+def compare_files(job):
+    (name, old_path, new_path, patterns) = job
+    old = parse_sum(old_path)
+    new = parse_sum(new_path)
+    flaky = [re.compile(p) for p in patterns]
+    return (name, old.num_results, new.num_results,
+            compare_sums(old, new, flaky))
+
+def pair_sum_files(old_path, new_path):
+    """Returns the list of (name, old, new) of corresponding .sum files and
+    the lists of unpaired files"""
+    old = find_sum_files(old_path)
+    new = find_sum_files(new_path)
+    if len(old) == 1 and len(new) == 1:
+        return ([(list(new)[0], list(old.values())[0],
+                  list(new.values())[0])], [], [])
+    # Build directories can have different layouts, fall back to base names
+    # if they are unique (otherwise, e.g. with multilibs, the files are
+    # reported as unpaired)
+    if not set(old) & set(new):
+        old_base = dict((os.path.basename(k), v) for (k, v) in old.items())
+        new_base = dict((os.path.basename(k), v) for (k, v) in new.items())
+        if len(old_base) == len(old) and len(new_base) == len(new):
+            (old, new) = (old_base, new_base)
+    pairs = [(name, old[name], new[name]) for name in sorted(old)
+             if name in new]
+    return (pairs, sorted(set(old) - set(new)), sorted(set(new) - set(old)))
+
+def print_changes(title, changes, verbose, limit):
+    if not changes:
+        return
+    print('    {} ({}):'.format(title, len(changes)))
+    shown = changes if verbose else changes[:limit]
+    for (name, old_status, new_status) in shown:
+        if new_status is None:
+            print('      {}: {}'.format(old_status, name))
+        elif old_status is None:
+            print('      {}: {} (new)'.format(new_status, name))
+        else:
+            print('      {}: {} (was {})'.format(new_status, name, old_status))
+    if len(shown) < len(changes):
+        print('      ... {} more'.format(len(changes) - len(shown)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare dejagnu .sum files '
+                                     'of two builds')
+    parser.add_argument('old', metavar='OLD',
+                        help='baseline: .sum file or a directory (searched '
+                        'recursively)')
+    parser.add_argument('new', metavar='NEW', help='new .sum file or directory')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of parallel jobs (default: %(default)s)')
+    parser.add_argument('--flaky', metavar='REGEX', action='append',
+                        help='report changes of matching tests as flaky; can '
+                        'be specified multiple times (default: guality and '
+                        'tsan tests)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='list all new and removed tests (by default only '
+                        'the first --limit are shown)')
+    parser.add_argument('--limit', type=int, default=10,
+                        help='maximal number of new or removed tests listed '
+                        'per .exp (default: %(default)s)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='save the comparison to FILE (JSON)')
+    args = parser.parse_args()
+
+    (pairs, only_old, only_new) = pair_sum_files(args.old, args.new)
+    for name in only_old:
+        con.warn('{}: only in {}'.format(name, args.old))
+    for name in only_new:
+        con.warn('{}: only in {}'.format(name, args.new))
+    if not pairs:
+        env.fatal_error('No .sum files to compare')
+    patterns = args.flaky if args.flaky is not None else default_flaky_patterns
+    jobs = [(name, old, new, patterns) for (name, old, new) in pairs]
+    pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+    try:
+        results = pool.map(compare_files, jobs)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    totals = dict((kind, 0) for kind in ['new_failures', 'fixed', 'new_tests',
+                                         'removed', 'flaky'])
+    data = []
+    for (name, num_old, num_new, diffs) in results:
+        print('{}: {} -> {} results'.format(name, num_old, num_new))
+        for diff in diffs:
+            print('  {}:'.format(diff.name))
+            print_changes('New failures', diff.new_failures, True, 0)
+            print_changes('Fixed', diff.fixed, True, 0)
+            print_changes('Flaky', diff.flaky, True, 0)
+            print_changes('New tests', diff.new_tests, args.verbose,
+                          args.limit)
+            print_changes('Removed tests', diff.removed, args.verbose,
+                          args.limit)
+            for kind in totals:
+                totals[kind] += len(getattr(diff, kind))
+        data.append({ 'file': name, 'old_results': num_old,
+                      'new_results': num_new,
+                      'groups': [dict([('target', diff.group[0]),
+                                       ('exp', diff.group[1])] +
+                                      [(kind, getattr(diff, kind))
+                                       for kind in sorted(totals)])
+                                 for diff in diffs] })
+    print('\n{new_failures} new failure(s), {fixed} fixed, {flaky} flaky, '
+          '{new_tests} new test(s), {removed} removed test(s)'.format(**totals))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(data, f, indent=1)
+        con.ok('Saved {}'.format(args.json))
+    sys.exit(1 if totals['new_failures'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+# Compiler wrapper for distributed and cached builds (see "build.py --dist"
+# and "build.py --cache"):
+#   dist_cc.py COMPILER ARGS...
+# Compilations of C and C++ sources to object files are preprocessed locally,
+# looked up in the compile cache and sent to the dispatcher of build.py, all
+# other invocations (and all invocations outside of a distributed or cached
+# build) run COMPILER locally.
+
+import sys
+
+from gcc.distbuild import wrapper_main
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stderr.write('Usage: dist_cc.py COMPILER [ARGS...]\n')
+        sys.exit(2)
+    sys.exit(wrapper_main(sys.argv[1:]))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Worker daemon for distributed builds (see "build.py --dist"): compiles
+# preprocessed sources sent by the dispatcher of build.py. Run it on each
+# build node with the same stage 0 compilers as the build machine (e.g.,
+# the same installation of GCC); compilers are matched by their contents,
+# not by their paths.
+
+from __future__ import print_function
+
+# System
+import argparse
+import multiprocessing
+import socket
+
+# Local
+from gcc.env import Environment
+from gcc.distbuild import DEFAULT_PORT, WorkerServer
+from gcc.invoke import resolve_compiler
+
+env = Environment()
+con = env
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker for distributed '
+                                     'builds')
+    parser.add_argument('-c', '--compiler', dest='compilers', action='append',
+                        help='compiler: path to the driver, installation '
+                        'prefix or name of installation directory; can be '
+                        'specified multiple times (default: gcc and g++ from '
+                        'PATH)')
+    parser.add_argument('--bind', default='127.0.0.1',
+                        help='address to listen on (default: %(default)s)')
+    parser.add_argument('-a', '--allow', action='append',
+                        help='IPv4 network (ADDRESS[/BITS]) of the clients '
+                        'which are served; can be specified multiple times '
+                        '(default: 127.0.0.0/8)')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT,
+                        help='port (default: %(default)s)')
+    parser.add_argument('-s', '--slots', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of simultaneous compilations (default: '
+                        '%(default)s)')
+    args = parser.parse_args()
+
+    try:
+        from config import cfg
+        install_dir = cfg.install_dir
+    except ImportError:
+        install_dir = None
+    paths = []
+    # Installation prefixes provide both the C and the C++ driver
+    for spec in args.compilers or ['gcc', 'g++']:
+        found = [resolve_compiler(spec, install_dir, driver)
+                 for driver in ['gcc', 'g++']]
+        if not any(found):
+            env.fatal_error('Compiler {} not found'.format(spec))
+        paths += [path for path in found if path and path not in paths]
+    allow = args.allow or ['127.0.0.0/8']
+    try:
+        server = WorkerServer((args.bind, args.port), paths, args.slots,
+                              allow)
+    except (socket.error, ValueError) as ex:
+        env.fatal_error(str(ex))
+    for (identity, version) in sorted(server.versions.items()):
+        con.info('{} {} ({})'.format(identity[:12], server.compilers[identity],
+                                     version))
+    con.ok('Listening on {}:{}, {} slot(s)'.format(args.bind, args.port,
+                                                  args.slots))
+    con.info('Allowed clients: {}'.format(', '.join(allow)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
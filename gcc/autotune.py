@@ -0,0 +1,150 @@
+# Autotuning of the GCC build configuration: several candidate configurations
+# (build type, build config scripts such as bootstrap-O3 or bootstrap-lto,
+# flags of bootstrap stages 2 and 3) are built and installed by build.py, the
+# resulting compilers are benchmarked on a corpus (benchmark.py) and the
+# compile time gain of each configuration is weighed against its build cost.
+
+from __future__ import print_function, division
+
+import os, os.path
+import json
+import time
+from collections import OrderedDict
+
+pjoin = os.path.join
+
+
+DEFAULT_CANDIDATES = [
+    { 'name': 'fdo', 'build_type': 'fdo' },
+    { 'name': 'fdo-O3', 'build_type': 'fdo', 'build_config': ['bootstrap-O3'] },
+    { 'name': 'fdo-lto', 'build_type': 'fdo',
+      'build_config': ['bootstrap-lto'] },
+    { 'name': 'fdo-O3-lto', 'build_type': 'fdo',
+      'build_config': ['bootstrap-O3', 'bootstrap-lto'] },
+    { 'name': 'fdo-native', 'build_type': 'fdo',
+      'boot_flags': '-O2 -g -march=native' },
+]
+
+
+class Candidate(object):
+    """A build configuration: build type (build.py option), list of build
+    config scripts, BOOT_CFLAGS (flags of stages 2 and later) and additional
+    configure options"""
+
+    _keys = ['name', 'build_type', 'build_config', 'boot_flags',
+             'config_options']
+
+    def __init__(self, name, build_type='fdo', build_config=None,
+                 boot_flags=None, config_options=None):
+        self.name = name
+        self.build_type = build_type
+        self.build_config = build_config or []
+        self.boot_flags = boot_flags
+        self.config_options = config_options
+
+    @staticmethod
+    def from_json(data):
+        unknown = set(data) - set(Candidate._keys)
+        if unknown:
+            raise ValueError('Unknown keys in candidate {}: {}'.format(
+                                data.get('name'), ', '.join(sorted(unknown))))
+        if 'name' not in data:
+            raise ValueError('Candidate without name')
+        return Candidate(**data)
+
+    def to_json(self):
+        return OrderedDict((key, getattr(self, key)) for key in self._keys
+                           if getattr(self, key))
+
+    def build_args(self, work_dir):
+        """Returns build.py arguments of the configuration. BOOT_CFLAGS are
+        set by a generated build config script placed into work_dir"""
+        args = ['--' + self.build_type]
+        scripts = list(self.build_config)
+        if self.boot_flags:
+            path = pjoin(work_dir, 'autotune-{}.mk'.format(self.name))
+            with open(path, 'w') as f:
+                f.write('# Generated by autotune.py\n')
+                f.write('BOOT_CFLAGS := {}\n'.format(self.boot_flags))
+            scripts.append(path)
+        if scripts:
+            args += ['--config-script', ','.join(scripts)]
+        if self.config_options:
+            args += ['--config-options', self.config_options]
+        return args
+
+
+def load_candidates(path):
+    """Reads candidates from a JSON file (a list of objects), returns the
+    built-in list if path is None"""
+    data = DEFAULT_CANDIDATES
+    if path is not None:
+        with open(path, 'r') as f:
+            data = json.load(f, object_pairs_hook=OrderedDict)
+    candidates = [Candidate.from_json(item) for item in data]
+    names = [cand.name for cand in candidates]
+    if len(set(names)) != len(names):
+        raise ValueError('Candidate names must be unique')
+    return candidates
+
+def split_jobs(total, parallel):
+    """Divides the job budget between parallel builds"""
+    return max(1, total // max(1, parallel))
+
+
+class TuningStore(object):
+    """State of an autotuning session (in its work directory): configuration
+    and build results of each candidate and the benchmark results file"""
+
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+        self._path = pjoin(work_dir, 'autotune.json')
+        self.builds = OrderedDict()
+        self.benchmark = None
+        if os.path.isfile(self._path):
+            with open(self._path, 'r') as f:
+                data = json.load(f, object_pairs_hook=OrderedDict)
+            self.builds = data['builds']
+            self.benchmark = data.get('benchmark')
+
+    def prefix(self, name):
+        return pjoin(self.work_dir, 'install', name)
+
+    def build_dir(self, name):
+        return pjoin(self.work_dir, 'build', name)
+
+    def log_path(self, name):
+        return pjoin(self.work_dir, 'logs', name + '.log')
+
+    def is_built(self, cand):
+        """True if the candidate was built successfully with the same
+        configuration and its installation still exists"""
+        build = self.builds.get(cand.name)
+        return build is not None and build['status'] == 0 and \
+               build['config'] == cand.to_json() and \
+               os.path.isdir(self.prefix(cand.name))
+
+    def add_build(self, cand, status, wall, cpu, jobs):
+        self.builds[cand.name] = OrderedDict([
+            ('config', cand.to_json()), ('status', status), ('wall', wall),
+            ('cpu', cpu), ('jobs', jobs),
+            ('date', time.strftime('%Y-%m-%d %H:%M:%S'))])
+        self.save()
+
+    def save(self):
+        data = OrderedDict([('builds', self.builds),
+                            ('benchmark', self.benchmark)])
+        with open(self._path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=1)
+        os.rename(self._path + '.tmp', self._path)
+
+
+def recommend(comparisons, threshold):
+    """Returns the comparison (candidate vs baseline) with the largest
+    significant gain or None, if no candidate is significantly faster"""
+    best = None
+    for comp in comparisons:
+        if comp.ratio < 1 and comp.is_significant(threshold) and \
+                (best is None or comp.ratio < best.ratio):
+            best = comp
+    return best
@@ -0,0 +1,318 @@
+# Compile-time benchmarking: measurement of compiler runs (wall time, CPU time
+# and peak RSS), corpus manifests and statistical comparison of results
+
+from __future__ import print_function, division
+
+import os
+import json
+import hashlib
+import math
+import random
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from .common import sha1_file
+
+WALL, CPU, RSS = ('wall', 'cpu', 'rss')
+METRICS = [WALL, CPU, RSS]
+
+MANIFEST = 'MANIFEST'
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+def pin_to_cpu(cpu):
+    """Binds the current process (and hence all processes spawned by it) to
+    the given CPU. Uses taskset if os.sched_setaffinity is not available
+    (Python 2). Returns True on success"""
+    if hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, [cpu])
+            return True
+        except (OSError, ValueError):
+            return False
+    try:
+        with open(os.devnull, 'w') as null:
+            return subprocess.call(['taskset', '-p', '-c', str(cpu),
+                                    str(os.getpid())], stdout=null,
+                                   stderr=null) == 0
+    except OSError:
+        return False
+
+def available_cpus():
+    """Returns the sorted list of CPUs the current process can run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    import multiprocessing
+    return list(range(multiprocessing.cpu_count()))
+
+
+class Sample(object):
+    """Resource usage of a single compiler run. wall and cpu (user + system
+    time of the driver and all its subprocesses) are in seconds, rss (the
+    maximal resident set size of the driver and its subprocesses) is in kB"""
+
+    def __init__(self, wall, cpu, rss):
+        self.wall = wall
+        self.cpu = cpu
+        self.rss = rss
+
+
+def measure(cmd, timeout=None, cwd=None):
+    """Runs cmd (in directory cwd), returns (Sample, None) on success or (None, error message).
+    Resource usage is obtained from wait4, so it includes the compiler proper
+    and the assembler invoked by the driver"""
+    with open(os.devnull, 'w') as null:
+        start = _timer()
+        # A new session: on timeout the compiler proper is killed together
+        # with the driver
+        proc = subprocess.Popen(cmd, stdout=null, stderr=subprocess.PIPE,
+                                cwd=cwd, preexec_fn=os.setsid)
+        timed_out = []
+        timer = None
+        if timeout is not None:
+            def kill():
+                timed_out.append(True)
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        if hasattr(os, 'waitid'):
+            # Wait for the exit without reaping the process
+            os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+        # The timer must not fire once the PID is reaped (and can be reused)
+        if timer is not None:
+            timer.cancel()
+            timer.join()
+        (_, status, usage) = os.wait4(proc.pid, 0)
+        wall = _timer() - start
+        # Prevent Popen from waiting for (or killing) the reaped process
+        proc.returncode = status
+    if timed_out:
+        return (None, 'timeout')
+    if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+        lines = stderr.decode('utf-8', 'replace').strip().splitlines()
+        return (None, lines[-1] if lines else 'exit status {}'.format(status))
+    return (Sample(wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss),
+            None)
+
+def corpus_version(files):
+    """Returns the version of a corpus: a short hash of its contents.
+    files is a dictionary {relative path: SHA-1}"""
+    h = hashlib.sha1()
+    for name in sorted(files):
+        h.update('{} {}\n'.format(files[name], name).encode('utf-8'))
+    return h.hexdigest()[:12]
+
+def make_manifest(root, paths):
+    """Returns {relative path: SHA-1} for files in paths (relative to the
+    corpus root)"""
+    return OrderedDict((os.path.relpath(path, root), sha1_file(path))
+                       for path in sorted(paths))
+
+def read_manifest(root):
+    """Reads the corpus manifest (lines "SHA-1 relative path"), returns
+    {relative path: SHA-1} or None, if the corpus has no manifest"""
+    path = os.path.join(root, MANIFEST)
+    if not os.path.isfile(path):
+        return None
+    files = OrderedDict()
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                (digest, name) = line.split(None, 1)
+                files[name] = digest
+    return files
+
+def write_manifest(root, files):
+    path = os.path.join(root, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        f.write('# Corpus version {}\n'.format(corpus_version(files)))
+        for (name, digest) in files.items():
+            f.write('{} {}\n'.format(digest, name))
+    os.rename(path + '.tmp', path)
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n == 0:
+        return 0.0
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+
+class BenchmarkStore(object):
+    """Results of a benchmark run: samples for each compiler, optimization
+    level and file of the corpus: {label: {level: {file: {metric: [values]}}}}"""
+
+    def __init__(self, corpus=None, flags=None):
+        self.corpus = corpus or {}
+        self.flags = flags or []
+        self.settings = {}
+        self.compilers = OrderedDict()  # label -> {'path', 'version'}
+        self.results = OrderedDict()
+        self.failed = OrderedDict()     # label -> {level: {file: message}}
+
+    def add_compiler(self, label, path, version):
+        self.compilers[label] = { 'path': path, 'version': version }
+        self.results[label] = OrderedDict()
+        self.failed[label] = OrderedDict()
+
+    def add(self, label, level, fname, sample):
+        data = self.results[label].setdefault(level, OrderedDict()) \
+                                  .setdefault(fname, OrderedDict(
+                                        (metric, []) for metric in METRICS))
+        for metric in METRICS:
+            data[metric].append(getattr(sample, metric))
+
+    def add_failure(self, label, level, fname, message):
+        self.failed[label].setdefault(level, {})[fname] = message
+
+    @property
+    def levels(self):
+        levels = []
+        for per_level in self.results.values():
+            levels += [level for level in per_level if level not in levels]
+        return levels
+
+    def files(self, label, level):
+        """Returns the set of files successfully compiled by label at level"""
+        failed = self.failed.get(label, {}).get(level, {})
+        return set(fname for fname in self.results[label].get(level, {})
+                   if fname not in failed)
+
+    def samples(self, label, level, fname, metric):
+        return self.results[label][level][fname][metric]
+
+    def save(self, path):
+        data = { 'corpus': self.corpus, 'flags': self.flags,
+                 'settings': self.settings, 'compilers': self.compilers,
+                 'results': self.results, 'failed': self.failed }
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=1)
+        os.rename(path + '.tmp', path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'r') as f:
+            data = json.load(f, object_pairs_hook=OrderedDict)
+        store = BenchmarkStore(data['corpus'], data['flags'])
+        store.settings = data['settings']
+        store.compilers = data['compilers']
+        store.results = data['results']
+        store.failed = data['failed']
+        return store
+
+    def merge(self, other):
+        """Adds compilers from other (results of another run on the same
+        corpus). Compilers already present in self are skipped. Returns the
+        list of added labels"""
+        added = []
+        for (label, info) in other.compilers.items():
+            if label in self.compilers:
+                continue
+            self.compilers[label] = info
+            self.results[label] = other.results[label]
+            self.failed[label] = other.failed[label]
+            added.append(label)
+        return added
+
+
+class Comparison(object):
+    """Comparison of a metric between two compilers at one optimization
+    level. old_value and new_value are total times (or peak RSS) over files,
+    ratio is the geometric mean over files of per-file ratios of medians
+    (new / old), [low, high] is its bootstrap confidence interval"""
+
+    def __init__(self, old, new, level, metric, num_files, old_value,
+                 new_value, ratio, low, high):
+        self.old = old
+        self.new = new
+        self.level = level
+        self.metric = metric
+        self.num_files = num_files
+        self.old_value = old_value
+        self.new_value = new_value
+        self.ratio = ratio
+        self.low = low
+        self.high = high
+
+    @property
+    def percent(self):
+        return 100.0 * (self.ratio - 1.0)
+
+    @property
+    def speedup(self):
+        """How many times new is faster (or smaller, for RSS) than old"""
+        return 1.0 / self.ratio if self.ratio else float('inf')
+
+    def is_significant(self, threshold=0.0):
+        """The change is significant if the confidence interval does not
+        contain 1 and the change exceeds threshold percent"""
+        return (self.low > 1.0 or self.high < 1.0) and \
+                abs(self.percent) > threshold
+
+    def to_json(self):
+        return OrderedDict([('old', self.old), ('new', self.new),
+                            ('level', self.level), ('metric', self.metric),
+                            ('files', self.num_files),
+                            ('old_value', self.old_value),
+                            ('new_value', self.new_value),
+                            ('ratio', self.ratio), ('ci_low', self.low),
+                            ('ci_high', self.high)])
+
+
+def _geomean_ratio(pairs):
+    return math.exp(sum(math.log(new / old) for (old, new) in pairs) /
+                    len(pairs))
+
+def compare(store, old, new, level, metric, confidence=0.95,
+            iterations=1000, seed=0):
+    """Compares metric of compilers old and new (labels) at the given level
+    over the files successfully compiled by both. Returns Comparison or None
+    if there are no such files.
+
+    The confidence interval is obtained by bootstrap: repetitions of each
+    file are resampled (with replacement) for both compilers independently,
+    and the percentile interval of the resulting geometric mean ratios is
+    taken. Thus, it reflects the measurement noise of the given corpus on the
+    given machine"""
+    files = sorted(store.files(old, level) & store.files(new, level))
+    data = []
+    for fname in files:
+        a = store.samples(old, level, fname, metric)
+        b = store.samples(new, level, fname, metric)
+        # Zero CPU time is possible for tiny files (the resolution is
+        # limited), such files are not informative
+        if a and b and median(a) > 0 and median(b) > 0:
+            data.append((a, b))
+    if not data:
+        return None
+    ratio = _geomean_ratio([(median(a), median(b)) for (a, b) in data])
+    rng = random.Random(seed)
+    dist = []
+    for it in range(iterations):
+        pairs = []
+        for (a, b) in data:
+            old_med = median([rng.choice(a) for _ in a])
+            new_med = median([rng.choice(b) for _ in b])
+            if old_med > 0 and new_med > 0:
+                pairs.append((old_med, new_med))
+        if pairs:
+            dist.append(_geomean_ratio(pairs))
+    dist.sort()
+    alpha = (1.0 - confidence) / 2
+    low = dist[int(alpha * (len(dist) - 1))]
+    high = dist[int(math.ceil((1.0 - alpha) * (len(dist) - 1)))]
+    total = max if metric == RSS else sum
+    return Comparison(old, new, level, metric, len(data),
+                      total(median(a) for (a, _) in data),
+                      total(median(b) for (_, b) in data), ratio, low, high)
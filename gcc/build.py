@@ -3,6 +3,7 @@ from __future__ import print_function
 
 import os, os.path
 import shutil, subprocess
+import hashlib, json
 import string
 import sys, traceback
 pjoin = os.path.join
@@ -11,7 +12,14 @@ pjoin = os.path.join
 import sh
 
 # Local
-from .common import StopWatch, print_exception
+from .common import StopWatch, print_exception, format_size, parse_size
+from .check import TestsuiteRunner
+from . import stage0
+from .distbuild import (BuildTimes, Dispatcher, make_executor,
+                        wrapper_command)
+from .compcache import CACHE_VAR, CompileCache
+from . import prereqs
+from . import checkpoint
 
 # === Constants ===
 
@@ -38,6 +46,15 @@ default_lang    = [C, CXX, LTO]
 extra_lang      = [OBJC, FORTRAN, GO, JAVA]
 all_lang        = default_lang + extra_lang
 
+# Compilers proper of languages (make targets in the gcc subdirectory)
+compilers_proper = { C: 'cc1', CXX: 'cc1plus', LTO: 'lto1', OBJC: 'cc1obj',
+                     OBJCXX: 'cc1objplus', FORTRAN: 'f951', GO: 'go1',
+                     ADA: 'gnat1', JAVA: 'jc1' }
+
+# Testsuites (dejagnu tools) of languages, LTO is tested by check-gcc
+check_tools = { C: 'gcc', CXX: 'g++', OBJC: 'objc', OBJCXX: 'obj-c++',
+                FORTRAN: 'gfortran', GO: 'go' }
+
 class BuildError(Exception): pass
 class InternalError(Exception): pass
 
@@ -90,6 +107,9 @@ class GCCBuilder:
         self._stopwatch = StopWatch()
         self._buildtime = 0
         self._do_invoke = None
+        self._dispatcher = None
+        self._cache = None
+        self._prereqs = {}
         self._env = environment
         self._script_dir = os.path.normpath(pjoin(os.path.dirname(__file__), '..'))
         site_config = pjoin(self._script_dir, 'configury.stfu')
@@ -186,6 +206,8 @@ class GCCBuilder:
         res['enable-languages'] = langs_str
         res['enable-clocale'] = 'gnu'
         res['disable-nls'] = True
+        for (lib, prefix) in self._prereqs.items():
+            res['with-' + lib] = prefix
         if args.isl is not None:
             isl_dir = 'isl-' + get_isl_ver_for_gcc_ver(self.version)
             res['with-isl'] = pjoin(args.isl, isl_dir)
@@ -204,6 +226,9 @@ class GCCBuilder:
             res['CC'] = args.cc
         if args.cxx is not None:
             res['CXX'] = args.cxx
+        if self._dispatcher is not None or self._cache is not None:
+            res['CC'] = wrapper_command(args.cc or 'gcc')
+            res['CXX'] = wrapper_command(args.cxx or 'g++')
         if args.assembler is not None:
             res['with-as'] = args.assembler
         flags_str = self._get_c_cxx_flags(args)
@@ -212,14 +237,25 @@ class GCCBuilder:
             res['CXXFLAGS'] = flags_str
 
         if args.config_script:
-            path_src = pjoin(self._source_dir, 'config',
-                             args.config_script + '.mk')
-            if not os.path.exists(path_src):
-                path_script = pjoin(self._script_dir, args.config_script + '.mk')
-                if not os.path.exists(path_script):
-                    raise BuildError(args.config_script + '.mk not found')
-                shutil.copyfile(path_script, path_src)
-            res['with-build-config'] = args.config_script
+            # Comma-separated list of names of .mk files (in the config
+            # directory of the source tree or in the script directory) or
+            # paths to .mk files
+            names = []
+            for script in args.config_script.split(','):
+                if script.endswith('.mk') and os.path.isfile(script):
+                    name = os.path.basename(script)[:-3]
+                    shutil.copyfile(script, pjoin(self._source_dir, 'config',
+                                                  name + '.mk'))
+                    names.append(name)
+                    continue
+                path_src = pjoin(self._source_dir, 'config', script + '.mk')
+                if not os.path.exists(path_src):
+                    path_script = pjoin(self._script_dir, script + '.mk')
+                    if not os.path.exists(path_script):
+                        raise BuildError(script + '.mk not found')
+                    shutil.copyfile(path_script, path_src)
+                names.append(script)
+            res['with-build-config'] = ' '.join(names)
 
         lines = []
         for (k, v) in res.items():
@@ -241,6 +277,56 @@ class GCCBuilder:
 
         return lines
 
+    @catch_errors
+    def select_stage0(self, args):
+        """Sets args.cc and args.cxx to the fastest installed compiler, which
+        can build this version of GCC. Compilers are benchmarked if there is
+        no valid ranking for this version (this requires a configured build
+        directory)"""
+        self._common_init(args)
+        con = self._env
+        candidates = stage0.find_candidates(con, args.install_dir)
+        if not candidates:
+            raise BuildError('No stage 0 compilers found')
+        # Stage 1 of a bootstrap is built with STAGE1_CFLAGS, i.e. "-g"
+        flags = self._get_c_cxx_flags(args) or '-g'
+        ranking = stage0.Stage0Ranking(args.stage0_ranking)
+        entry = None if args.rank_stage0 else \
+                ranking.get(self.version, flags, candidates)
+        if entry is None:
+            make_dir = stage0.make_dir_of(args.build_dir)
+            files = stage0.find_source_files(self._source_dir)
+            if make_dir is None or not files:
+                con.warn('No ranking of stage 0 compilers for GCC {} and {} '
+                         'is not configured, using the default '
+                         'compiler'.format(self.version, args.build_dir))
+                return
+            con.info('Ranking stage 0 compilers on {} with "{}"'.format(
+                        ', '.join(os.path.basename(f) for f in files), flags))
+            entry = stage0.benchmark(con, candidates, make_dir, files, flags)
+            if not any(comp['time'] is not None
+                       for comp in entry['compilers']):
+                # E.g., the build directory is only configured, generated
+                # headers are missing. Do not cache the result
+                con.warn('None of the stage 0 compilers could compile the '
+                         'benchmark files, using the default compiler')
+                return
+            ranking.set(self.version, entry)
+            ranking.save()
+        con.info('Stage 0 compilers for GCC {} (ranked {}):\n{}'.format(
+                    self.version, entry['date'],
+                    stage0.format_ranking(entry)))
+        # Installation removes the prefix, do not use a compiler from it
+        exclude = self.get_prefix(args) if args.install else None
+        comp = stage0.select(entry, exclude)
+        if comp is None:
+            raise BuildError('None of the stage 0 compilers can build GCC ' +
+                             self.version)
+        args.cc = comp['cc']
+        args.cxx = comp['cxx']
+        con.ok('Using stage 0 compiler {} ({})'.format(comp['name'],
+                                                      comp['version']))
+
     @catch_errors
     def configure(self, args):
         self._common_init(args)
@@ -250,7 +336,26 @@ class GCCBuilder:
         os.chdir(args.build_dir)
         con.info('Entering build directory: ' + args.build_dir)
         con.info('Configure options: ' + ' '.join(['\'{}\''.format(opt) if ' ' in opt else opt for opt in conf_opt]))
+        if args.checkpoints:
+            store = checkpoint.CheckpointStore(args.checkpoint_dir)
+            stage = checkpoint.stage_of(is_bootstrap(args))
+            key = checkpoint.fingerprint(self._source_dir, args.build_dir,
+                                         conf_opt, [args.cc or 'gcc',
+                                                    args.cxx or 'g++'], stage)
+            method = store.restore(key, args.build_dir)
+            if method is not None:
+                con.ok('Cloned configured build directory from checkpoint '
+                       '{} ({})'.format(key[:12], method))
+                return
         self._env.invoke(pjoin(self._source_dir, 'configure'), *conf_opt)
+        if args.checkpoints:
+            # Configure host modules, so that the checkpoint covers them
+            targets = checkpoint.stage_targets(args.build_dir, stage)
+            if targets:
+                self._env.invoke('make', *(self._get_make_command(args) +
+                                           targets))
+            store.save(key, args.build_dir, ' '.join(conf_opt))
+            con.info('Saved checkpoint {}'.format(key[:12]))
 
     def _get_make_command(self, args, in_gcc=False, seq=False):
         path = [args.build_dir]
@@ -258,8 +363,11 @@ class GCCBuilder:
             path.append('gcc')
         path.append('Makefile')
         res = ['-f', pjoin(*path)]
-        if not seq and args.jobs > 1:
-            res.append('-j' + str(args.jobs))
+        jobs = int(args.jobs)
+        if self._dispatcher is not None:
+            jobs += self._dispatcher.slots
+        if not seq and jobs > 1:
+            res.append('-j' + str(jobs))
         return res
 
     def _make_full(self, args):
@@ -276,6 +384,116 @@ class GCCBuilder:
         os.chdir(args.build_dir)
         self._make_full(args)
 
+    def _start_dist(self, args):
+        if not is_stage1_build(args) or args.build_type == COVERAGE:
+            raise BuildError('Distributed build is supported only for '
+                             'minimal and stage1 builds')
+        con = self._env
+        compilers = [args.cc or 'gcc', args.cxx or 'g++']
+        dispatcher = Dispatcher(con, make_executor(args.dist), compilers)
+        if not dispatcher.workers:
+            dispatcher.stop()
+            con.warn('No usable workers, building locally')
+            return
+        con.info('Distributing compilation to {} worker(s), {} slot(s): '
+                 '{}'.format(len(dispatcher.workers), dispatcher.slots,
+                             ', '.join(worker.name
+                                       for worker in dispatcher.workers)))
+        dispatcher.start()
+        self._dispatcher = dispatcher
+
+    def _stop_dist(self):
+        dispatcher = self._dispatcher
+        self._dispatcher = None
+        dispatcher.stop()
+        con = self._env
+        stats = dispatcher.stats
+        con.info('Distributed {} compilation(s), {} compiled locally (no '
+                 'free slot), {} failed remotely'.format(
+                    stats.remote, stats.local, stats.failed))
+        for worker in dispatcher.workers:
+            con.info('  {}: {} job(s), busy {:.0f}s'.format(
+                        worker.name, worker.jobs, worker.busy))
+        con.info('Network: {:.1f} MB sent, {:.1f} MB received, remote '
+                 'compilation time {:.0f}s'.format(
+                    stats.bytes_sent / 1e6, stats.bytes_received / 1e6,
+                    stats.remote_time))
+
+    def _start_cache(self, args):
+        if is_bootstrap(args):
+            raise BuildError('Compile cache is not supported for bootstrap '
+                             'builds')
+        cache = CompileCache(args.cache_dir)
+        try:
+            cache.set_max_size(parse_size(args.cache_size))
+        except ValueError:
+            raise BuildError('Invalid cache size: {}'.format(args.cache_size))
+        self._env.info('Using compile cache in {}'.format(args.cache_dir))
+        os.environ[CACHE_VAR] = cache.path
+        self._cache = cache
+        self._cache_stats = cache.stats()
+
+    def _stop_cache(self):
+        cache = self._cache
+        self._cache = None
+        os.environ.pop(CACHE_VAR, None)
+        con = self._env
+        stats = cache.stats()
+        (hits, misses, uncacheable) = [
+            stats.get(key, 0) - self._cache_stats.get(key, 0)
+            for key in ['hits', 'misses', 'uncacheable']]
+        total = hits + misses
+        con.info('Compile cache: {} hit(s), {} miss(es), hit rate {:.1f}%, '
+                 '{} uncacheable invocation(s)'.format(
+                    hits, misses, 100.0 * hits / total if total else 0,
+                    uncacheable))
+        con.info('Cache size: {} of {}'.format(
+                    format_size(stats.get('size', 0)),
+                    format_size(stats['max_size'])))
+
+    def _prepare_prereqs(self, args):
+        """Builds missing prerequisite libraries in the cache, sets
+        self._prereqs"""
+        con = self._env
+        in_tree = prereqs.in_tree_libraries(self._source_dir)
+        if in_tree:
+            con.warn('Source directory contains {}, which configure prefers '
+                     'to prebuilt libraries; not using the prerequisite '
+                     'cache'.format(', '.join(in_tree)))
+            return
+        try:
+            versions = prereqs.required_versions(self._source_dir)
+        except IOError:
+            raise BuildError('contrib/download_prerequisites not found, '
+                             'cannot determine versions of prerequisites')
+        if args.isl is not None:
+            # --isl takes precedence
+            versions.pop('isl', None)
+        cache = prereqs.PrereqCache(con, args.prereq_cache, args.cc or 'gcc')
+        try:
+            self._prereqs = cache.ensure(versions, args.jobs)
+        except (IOError, OSError, RuntimeError) as ex:
+            raise BuildError('Prerequisite cache: {}'.format(ex))
+        for prefix in self._prereqs.values():
+            con.info('Using ' + prefix)
+
+    def _record_build_time(self, args, distributed):
+        if not args.dist_stats or not is_stage1_build(args):
+            return
+        con = self._env
+        kind = '{}:{}'.format(args.build_type, ','.join(args.languages))
+        times = BuildTimes(args.dist_stats)
+        seconds = self._stopwatch.delta.sec
+        times.record(kind, distributed, seconds)
+        if distributed:
+            local = times.get(kind, False)
+            if local is None:
+                con.info('No local build of this kind recorded, speedup is '
+                         'unknown')
+            else:
+                con.ok('Speedup over local build: {:.2f}x ({:.0f}s -> '
+                       '{:.0f}s)'.format(local / seconds, local, seconds))
+
     @catch_errors
     def build(self, args):
         self._common_init(args)
@@ -285,17 +503,98 @@ class GCCBuilder:
             cleanup_dir(args.build_dir)
         else:
             os.makedirs(args.build_dir)
+        if args.prereqs:
+            self._prepare_prereqs(args)
+        if args.dist:
+            self._start_dist(args)
+        distributed = self._dispatcher is not None
+        if args.cache:
+            self._start_cache(args)
+        try:
+            self._stopwatch.start()
+            self.configure(args)
+            con.info('Configure time: ' + self._stopwatch.delta_str)
+            if args.nomake:
+                con.ok('Configured successfully')
+                self._stopwatch.stop()
+            else:
+                con.ok('Configured successfully, running make')
+                self.make(args)
+                self._stopwatch.stop()
+                con.ok('Built successfully in ' + self._stopwatch.delta_str)
+        finally:
+            if self._dispatcher is not None:
+                self._stop_dist()
+            if self._cache is not None:
+                self._stop_cache()
+        if not args.nomake:
+            self._record_build_time(args, distributed)
+
+    @catch_errors
+    def rebuild(self, args):
+        """Rebuilds compilers proper of args.languages in an existing build
+        directory (only the gcc subdirectory is remade)"""
+        self._common_init(args)
+        con = self._env
+        gcc_dir = pjoin(args.build_dir, 'gcc')
+        if not os.path.isfile(pjoin(gcc_dir, 'Makefile')):
+            raise BuildError('Build directory is not configured: ' +
+                             args.build_dir)
+        targets = [compilers_proper[lang] for lang in args.languages
+                   if lang in compilers_proper]
+        if not targets:
+            raise BuildError('No compiler proper to rebuild')
+        os.chdir(gcc_dir)
+        con.info('Rebuilding {} in {}'.format(', '.join(targets), gcc_dir))
         self._stopwatch.start()
-        self.configure(args)
-        con.info('Configure time: ' + self._stopwatch.delta_str)
-        if args.nomake:
-            con.ok('Configured successfully')
-            self._stopwatch.stop()
-        else:
-            con.ok('Configured successfully, running make')
-            self.make(args)
-            self._stopwatch.stop()
-            con.ok('Built successfully in ' + self._stopwatch.delta_str)
+        self._env.invoke('make', *(self._get_make_command(args, in_gcc=True) +
+                                   targets))
+        self._stopwatch.stop()
+        con.ok('Rebuilt successfully in ' + self._stopwatch.delta_str)
+        if not args.dist_stats:
+            return
+        # Compare with the last full build of the same frontends
+        times = BuildTimes(args.dist_stats)
+        seconds = self._stopwatch.delta.sec
+        kind = '{}:{}'.format(args.build_type, ','.join(args.languages))
+        times.record('rebuild:' + kind, False, seconds)
+        full = times.get(kind, False)
+        if full is not None and seconds > 0:
+            con.info('Full build: {:.0f}s, {:.1f}x slower'.format(
+                        full, full / seconds))
+
+    def source_version(self):
+        """Returns the version of the source tree: GCC version, date stamp
+        and, for git checkouts, the revision and a hash of local changes"""
+        res = self.version
+        datestamp = pjoin(self._source_dir, 'gcc', 'DATESTAMP')
+        if os.path.isfile(datestamp):
+            with open(datestamp, 'r') as f:
+                res += ' ' + f.read().strip()
+        if os.path.exists(pjoin(self._source_dir, '.git')):
+            def git(*git_args):
+                proc = subprocess.Popen(['git'] + list(git_args),
+                                        cwd=self._source_dir,
+                                        stdout=subprocess.PIPE)
+                return proc.communicate()[0]
+            res += ' ' + git('rev-parse', 'HEAD').decode('utf-8').strip()
+            diff = git('diff', 'HEAD')
+            if diff:
+                res += '+' + hashlib.sha1(diff).hexdigest()[:12]
+        return res
+
+    def fingerprint(self, args):
+        """Returns a dictionary: fingerprint of the build (configure
+        options, build type, languages, actions after the build and the
+        source version) and the source version"""
+        self._common_init(args)
+        source = self.source_version()
+        data = [self.get_configure_options(args), args.build_type,
+                args.languages, bool(args.rebuild), bool(args.check),
+                bool(args.install), source]
+        return { 'fingerprint': hashlib.sha1(json.dumps(data).encode(
+                                    'utf-8')).hexdigest(),
+                 'source': source }
 
     @property
     def build_time_str(self):
@@ -310,7 +609,34 @@ class GCCBuilder:
             con.info('Install directory already exists. Cleaning up.')
             shutil.rmtree(prefix)
         make_args = self._get_make_command(args, seq=True)
-        make_args.append('install')
+        # Minimal builds do not have target libraries, install only
+        # the driver and the compiler proper
+        make_args.append('install-gcc' if args.build_type == MINIMAL
+                         else 'install')
         self._env.invoke('make', *make_args)
         con.ok('Installed successfully')
 
+    @catch_errors
+    def check(self, args):
+        self._common_init(args)
+        con = self._env
+        if not os.path.isfile(pjoin(args.build_dir, 'gcc', 'Makefile')):
+            raise BuildError('Build directory is not configured: ' +
+                             args.build_dir)
+        if args.build_type == MINIMAL:
+            con.warn('Minimal build has no target libraries, execution '
+                     'tests will fail')
+        tools = []
+        for lang in args.languages:
+            tool = check_tools.get(lang)
+            if tool is not None and tool not in tools:
+                tools.append(tool)
+        runner = TestsuiteRunner(con, self._source_dir, args.build_dir,
+                                 args.check_history)
+        self._stopwatch.start()
+        flags = args.check_flags.split() if args.check_flags else []
+        if not runner.run(tools, int(args.jobs), flags):
+            raise BuildError('Testsuite run failed: some shards produced '
+                             'no results')
+        self._stopwatch.stop()
+        con.ok('Testsuite finished in ' + self._stopwatch.delta_str)
@@ -0,0 +1,396 @@
+# Local build queue: a service (build_queue.py serve) which runs build.py and
+# tarball_build.py jobs submitted by clients on the same host, each in its own
+# build directory.
+#
+# Identical requests are merged: a job is identified by a key, which is
+# derived from the options and the source version ("--fingerprint" of
+# build.py and tarball_build.py): the configure options, the build type and
+# the version of the source tree for build.py, the command line and the
+# releases or the latest snapshots for tarball_build.py. Jobs are started in the order of priority (and
+# submission), as long as their CPUs and memory fit within the limits of the
+# service; a job which does not fit blocks the jobs after it, so large jobs
+# are not starved. The queue is stored in queue.json and survives restarts of
+# the service; output of jobs is written to log files, which clients can
+# follow.
+
+from __future__ import print_function, division
+
+import os, os.path
+import errno
+import hashlib
+import json
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+if sys.version_info[0] < 3:
+    import SocketServer as socketserver
+else:
+    import socketserver
+
+from .netmsg import send_msg, recv_msg
+
+pjoin = os.path.join
+
+SCRIPTS = { 'build': 'build.py', 'tarball': 'tarball_build.py' }
+# Options which set the directories of a job (relative to its build
+# directory in the queue)
+_dir_opts = { 'build': [('-b', 'build')],
+              'tarball': [('--build-dir', 'build'), ('--extract-dir', 'src')] }
+
+DEFAULT_PRIORITY = 0
+DEFAULT_MEMORY_PER_CPU = 1 << 30
+# Jobs kept in the queue after they finish
+KEEP_FINISHED = 200
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELED = 'canceled'
+FINISHED = [DONE, FAILED, CANCELED]
+
+_script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def total_memory():
+    """Returns the size of physical memory in bytes"""
+    with open('/proc/meminfo', 'r') as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def job_key(script, args, cwd):
+    """Returns (key, description) of a job. Raises ValueError if the
+    fingerprint of the job cannot be computed"""
+    h = hashlib.sha1(script.encode('utf-8'))
+    proc = subprocess.Popen([sys.executable, pjoin(_script_dir,
+                                                   SCRIPTS[script])] +
+                            args + ['--fingerprint'], cwd=cwd,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    output = proc.communicate()[0].decode('utf-8', 'replace')
+    if proc.returncode != 0:
+        raise ValueError(output.strip())
+    data = json.loads(output.strip().splitlines()[-1])
+    h.update(data['fingerprint'].encode('utf-8'))
+    if script == 'build':
+        return (h.hexdigest(), 'GCC {}'.format(data['source']))
+    description = ' '.join(args)
+    if data['source']:
+        description += ' ({})'.format(data['source'])
+    return (h.hexdigest(), description)
+
+
+class BuildQueue(object):
+    """State of the service: jobs (dictionaries, persisted in queue.json)
+    and running processes. All methods are called under self.lock"""
+
+    def __init__(self, path, max_cpus, max_memory):
+        self.path = path
+        self.max_cpus = max_cpus
+        self.max_memory = max_memory
+        self.lock = threading.Condition()
+        self.jobs = OrderedDict()
+        self._procs = {}
+        self._next_id = 1
+        for subdir in ['logs', 'builds']:
+            if not os.path.isdir(pjoin(path, subdir)):
+                os.makedirs(pjoin(path, subdir))
+        state_path = pjoin(path, 'queue.json')
+        if os.path.isfile(state_path):
+            with open(state_path, 'r') as f:
+                data = json.load(f, object_pairs_hook=OrderedDict)
+            self._next_id = data['next_id']
+            for job in data['jobs']:
+                if job['state'] == RUNNING:
+                    # Interrupted by a restart of the service. After a crash
+                    # or a reboot the PID can belong to another process
+                    if self._is_job_process(job):
+                        self._kill(job)
+                    job['state'] = QUEUED
+                    job['started'] = None
+                self.jobs[job['id']] = job
+
+    def save(self):
+        path = pjoin(self.path, 'queue.json')
+        data = OrderedDict([('next_id', self._next_id),
+                            ('jobs', list(self.jobs.values()))])
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=1)
+        os.rename(path + '.tmp', path)
+
+    def log_path(self, job_id):
+        return pjoin(self.path, 'logs', '{}.log'.format(job_id))
+
+    def build_dir(self, job_id):
+        return pjoin(self.path, 'builds', str(job_id))
+
+    def submit(self, req):
+        """Adds a job or merges the request into an identical one. Returns
+        (job, duplicate)"""
+        for job in self.jobs.values():
+            if job['key'] != req['key'] or job['state'] in [FAILED, CANCELED]:
+                continue
+            if job['state'] == DONE and req['force']:
+                continue
+            job['priority'] = max(job['priority'], req['priority'])
+            if req['user'] not in job['users']:
+                job['users'].append(req['user'])
+            self.save()
+            return (job, True)
+        job = OrderedDict([
+            ('id', self._next_id), ('key', req['key']),
+            ('description', req['description']), ('script', req['script']),
+            ('args', req['args']), ('cwd', req['cwd']),
+            ('priority', req['priority']), ('cpus', req['cpus']),
+            ('memory', req['memory']), ('keep', req['keep']),
+            ('users', [req['user']]), ('state', QUEUED),
+            ('submitted', time.time()), ('started', None),
+            ('finished', None), ('status', None), ('pid', None)])
+        self._next_id += 1
+        self.jobs[job['id']] = job
+        self._prune()
+        self.save()
+        self.lock.notify_all()
+        return (job, False)
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values()
+                    if job['state'] in FINISHED]
+        for job in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+            del self.jobs[job['id']]
+            if os.path.exists(self.log_path(job['id'])):
+                os.unlink(self.log_path(job['id']))
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job['state'] in FINISHED:
+            return False
+        if job['state'] == RUNNING:
+            job['canceled'] = True
+            self._kill(job)
+        else:
+            job['state'] = CANCELED
+            job['finished'] = time.time()
+        self.save()
+        self.lock.notify_all()
+        return True
+
+    def _is_job_process(self, job):
+        """Checks whether the process job['pid'] is still the leader of
+        the process group of the job: its command line refers to the build
+        directory of the job"""
+        if job['pid'] is None:
+            return False
+        try:
+            with open('/proc/{}/cmdline'.format(job['pid']), 'rb') as f:
+                cmdline = f.read().decode('utf-8', 'replace').split('\0')
+            if os.getpgid(job['pid']) != job['pid']:
+                return False
+        except (IOError, OSError):
+            return False
+        build_dir = self.build_dir(job['id'])
+        return any(arg.startswith(build_dir + os.sep) for arg in cmdline)
+
+    def _kill(self, job):
+        if job['pid'] is None:
+            return
+        try:
+            os.killpg(job['pid'], signal.SIGTERM)
+        except OSError as ex:
+            if ex.errno != errno.ESRCH:
+                raise
+
+    def _command(self, job):
+        cmd = [sys.executable, pjoin(_script_dir, SCRIPTS[job['script']])]
+        cmd += job['args']
+        build_dir = self.build_dir(job['id'])
+        for (opt, subdir) in _dir_opts[job['script']]:
+            cmd += [opt, pjoin(build_dir, subdir)]
+        cmd += ['-j', str(job['cpus'])]
+        return cmd
+
+    def _start(self, job):
+        with open(self.log_path(job['id']), 'w') as log:
+            with open(os.devnull, 'r') as devnull:
+                # A new session: the job and its children are killed as a
+                # process group
+                proc = subprocess.Popen(self._command(job), cwd=job['cwd'],
+                                        stdin=devnull, stdout=log,
+                                        stderr=subprocess.STDOUT,
+                                        preexec_fn=os.setsid)
+        job['state'] = RUNNING
+        job['started'] = time.time()
+        job['pid'] = proc.pid
+        self._procs[job['id']] = proc
+
+    def _finish(self, job, status):
+        del self._procs[job['id']]
+        if job.pop('canceled', False):
+            job['state'] = CANCELED
+        else:
+            job['state'] = DONE if status == 0 else FAILED
+        job['status'] = status
+        job['finished'] = time.time()
+        job['pid'] = None
+        build_dir = self.build_dir(job['id'])
+        if not job['keep'] and os.path.isdir(build_dir):
+            shutil.rmtree(build_dir)
+
+    def usage(self):
+        """Returns (CPUs, memory) used by running jobs"""
+        running = [job for job in self.jobs.values()
+                   if job['state'] == RUNNING]
+        return (sum(job['cpus'] for job in running),
+                sum(job['memory'] for job in running))
+
+    def schedule(self):
+        """Reaps finished jobs and starts queued ones which fit"""
+        changed = False
+        for (job_id, proc) in list(self._procs.items()):
+            status = proc.poll()
+            if status is not None:
+                self._finish(self.jobs[job_id], status)
+                changed = True
+        queued = sorted([job for job in self.jobs.values()
+                         if job['state'] == QUEUED],
+                        key=lambda job: (-job['priority'], job['id']))
+        (cpus, memory) = self.usage()
+        for job in queued:
+            # A job larger than the limits runs alone
+            fits = (cpus + job['cpus'] <= self.max_cpus and
+                    memory + job['memory'] <= self.max_memory) or \
+                   (cpus == 0 and memory == 0)
+            if not fits:
+                break
+            self._start(job)
+            cpus += job['cpus']
+            memory += job['memory']
+            changed = True
+        if changed:
+            self.save()
+            self.lock.notify_all()
+
+    def stop(self):
+        """Stops running jobs, they are restarted with the service"""
+        for job in self.jobs.values():
+            if job['state'] == RUNNING:
+                self._kill(job)
+        for proc in self._procs.values():
+            proc.wait()
+        self.save()
+
+
+class _QueueHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        queue = server.queue
+        (req, _, _) = recv_msg(self.request)
+        kind = req.get('type')
+        if kind == 'submit':
+            try:
+                (req['key'], req['description']) = job_key(
+                    req['script'], req['args'], req['cwd'])
+            except ValueError as ex:
+                send_msg(self.request, { 'status': 'error',
+                                         'error': str(ex) })
+                return
+            with queue.lock:
+                (job, duplicate) = queue.submit(req)
+                send_msg(self.request, { 'status': 'ok', 'job': job,
+                                         'duplicate': duplicate })
+        elif kind == 'list':
+            with queue.lock:
+                (cpus, memory) = queue.usage()
+                send_msg(self.request, { 'status': 'ok',
+                                         'jobs': list(queue.jobs.values()),
+                                         'cpus': [cpus, queue.max_cpus],
+                                         'memory': [memory,
+                                                    queue.max_memory] })
+        elif kind == 'cancel':
+            with queue.lock:
+                ok = queue.cancel(req['id'])
+            send_msg(self.request, { 'status': 'ok' if ok else 'error',
+                                     'error': 'no such active job' })
+        elif kind == 'log':
+            self._stream_log(req['id'], req.get('follow', False))
+        else:
+            send_msg(self.request, { 'status': 'error',
+                                     'error': 'unknown request' })
+
+    def _stream_log(self, job_id, follow):
+        """Sends the log of a job in chunks; if follow is set, waits for new
+        output until the job finishes. The last message contains the job"""
+        queue = self.server.queue
+        pos = 0
+        while True:
+            with queue.lock:
+                job = queue.jobs.get(job_id)
+                if job is None:
+                    send_msg(self.request, { 'status': 'error',
+                                             'error': 'no such job' })
+                    return
+                job = dict(job)
+            path = queue.log_path(job_id)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    f.seek(pos)
+                    data = f.read()
+                pos += len(data)
+                if data:
+                    send_msg(self.request, { 'status': 'data' }, data)
+            if not follow or job['state'] in FINISHED:
+                send_msg(self.request, { 'status': 'ok', 'job': job })
+                return
+            with queue.lock:
+                queue.lock.wait(1.0)
+
+
+class QueueServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Listens on the socket in the queue directory and runs the
+    scheduler"""
+
+    daemon_threads = True
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.socket_path = pjoin(queue.path, 'socket')
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        socketserver.UnixStreamServer.__init__(self, self.socket_path,
+                                               _QueueHandler)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run_scheduler)
+        self._thread.daemon = True
+
+    def _run_scheduler(self):
+        while not self._stopped.is_set():
+            with self.queue.lock:
+                self.queue.schedule()
+                self.queue.lock.wait(1.0)
+
+    def serve(self):
+        self._thread.start()
+        try:
+            self.serve_forever()
+        finally:
+            self._stopped.set()
+            self._thread.join()
+            with self.queue.lock:
+                self.queue.stop()
+            self.server_close()
+            os.unlink(self.socket_path)
+
+
+def request(queue_dir, req):
+    """Sends a request to the service, returns the connected socket (the
+    caller receives the replies)"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(pjoin(queue_dir, 'socket'))
+    send_msg(sock, req)
+    return sock
@@ -0,0 +1,343 @@
+# Sharded parallel run of the compiler testsuites (dejagnu). Each testsuite
+# (tool) is split into shards by .exp file, long-running .exp files are
+# additionally split into several runtest instances, which divide the tests
+# between themselves (GCC_RUNTEST_PARALLELIZE_DIR). Shards are scheduled
+# longest first, based on durations recorded during previous runs
+
+from __future__ import print_function, division
+
+import os, os.path
+import json
+import math
+import multiprocessing
+import re
+import shutil
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+from .common import source_exts
+
+pjoin = os.path.join
+
+# Estimated duration of an .exp file, which was never run: per test file
+DEFAULT_TEST_TIME = 0.5
+# Weight of the last run in the recorded duration
+HISTORY_WEIGHT = 0.5
+
+test_exts = set(source_exts + ['.m', '.mm', '.go', '.adb', '.ads', '.d'])
+
+_sum_result_re = re.compile(r'^(PASS|FAIL|XPASS|XFAIL|KFAIL|UNRESOLVED|'
+                            r'UNTESTED|UNSUPPORTED|ERROR|WARNING): ')
+_summary_names = [('PASS', 'expected passes'),
+                  ('FAIL', 'unexpected failures'),
+                  ('XPASS', 'unexpected successes'),
+                  ('XFAIL', 'expected failures'),
+                  ('KFAIL', 'known failures'),
+                  ('UNRESOLVED', 'unresolved testcases'),
+                  ('UNTESTED', 'untested testcases'),
+                  ('UNSUPPORTED', 'unsupported tests')]
+
+
+class CheckHistory(object):
+    """Durations of .exp files recorded during previous runs:
+    {tool: {exp: seconds}}"""
+
+    def __init__(self, path):
+        self._path = path
+        self._data = {}
+        if path is not None and os.path.isfile(path):
+            with open(path, 'r') as f:
+                self._data = json.load(f)
+
+    def get(self, tool, exp):
+        return self._data.get(tool, {}).get(exp)
+
+    def update(self, tool, exp, duration):
+        tool_data = self._data.setdefault(tool, {})
+        old = tool_data.get(exp)
+        if old is not None:
+            duration = HISTORY_WEIGHT * duration + (1 - HISTORY_WEIGHT) * old
+        tool_data[exp] = duration
+
+    def save(self):
+        if self._path is None:
+            return
+        dirname = os.path.dirname(os.path.abspath(self._path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(self._path + '.tmp', 'w') as f:
+            json.dump(self._data, f, indent=1, sort_keys=True)
+        os.rename(self._path + '.tmp', self._path)
+
+
+class Shard(object):
+    """A single runtest invocation: tool, .exp file name and (if the .exp
+    is split) the part number"""
+
+    def __init__(self, tool, exp, estimate, part=None, parts=None):
+        self.tool = tool
+        self.exp = exp
+        self.estimate = estimate
+        self.part = part
+        self.parts = parts
+        self.index = None
+
+    @property
+    def name(self):
+        if self.part is None:
+            return '{} {}'.format(self.tool, self.exp)
+        return '{} {} ({}/{})'.format(self.tool, self.exp, self.part + 1,
+                                      self.parts)
+
+
+def find_exp_files(testsuite_dir, tool):
+    """Returns {.exp file name: number of test files} for the tool.
+    runtest looks for .exp files in subdirectories of the testsuite named
+    after the tool ("gcc.dg", "gcc.c-torture", ...). .exp files with equal
+    names are selected by RUNTESTFLAGS together, so they form a single
+    entry"""
+    result = OrderedDict()
+    for name in sorted(os.listdir(testsuite_dir)):
+        top = pjoin(testsuite_dir, name)
+        if not os.path.isdir(top) or \
+                (name != tool and not name.startswith(tool + '.')):
+            continue
+        for (dirpath, dirnames, fnames) in os.walk(top):
+            dirnames.sort()
+            tests = sum(1 for fname in fnames
+                        if os.path.splitext(fname)[1] in test_exts)
+            for fname in sorted(fnames):
+                if fname.endswith('.exp'):
+                    result[fname] = result.get(fname, 0) + tests
+    return result
+
+def plan_shards(tools_exps, history, jobs, can_split=True):
+    """Creates shards for {tool: {exp: number of tests}}. If can_split is
+    True, .exp files longer than a half of the ideal per-job time are split
+    into several parts. Returns the list of shards, longest first"""
+    estimates = []
+    for (tool, exps) in tools_exps.items():
+        for (exp, num_tests) in exps.items():
+            estimate = history.get(tool, exp)
+            if estimate is None:
+                estimate = max(num_tests, 1) * DEFAULT_TEST_TIME
+            estimates.append((tool, exp, estimate))
+    total = sum(estimate for (_, _, estimate) in estimates)
+    max_shard = total / jobs / 2
+    shards = []
+    for (tool, exp, estimate) in estimates:
+        parts = 1
+        if can_split and jobs > 1 and max_shard > 0:
+            parts = min(int(math.ceil(estimate / max_shard)), jobs)
+        if parts <= 1:
+            shards.append(Shard(tool, exp, estimate))
+        else:
+            shards += [Shard(tool, exp, estimate / parts, part, parts)
+                       for part in range(parts)]
+    shards.sort(key=lambda s: (-s.estimate, s.tool, s.exp, s.part))
+    for (idx, shard) in enumerate(shards):
+        shard.index = idx
+    return shards
+
+def shard_dir_name(shard):
+    return 'testsuite-shard{}'.format(shard.index)
+
+def run_shard(job):
+    """Runs a single shard in its own testsuite directory (TESTSUITEDIR),
+    returns (shard index, duration, make exit status)"""
+    (gcc_dir, shard, parallel_dir, runtest_flags) = job
+    testsuite = pjoin(gcc_dir, shard_dir_name(shard))
+    if os.path.exists(testsuite):
+        shutil.rmtree(testsuite)
+    os.makedirs(testsuite)
+    env = dict(os.environ)
+    env.pop('MAKEFLAGS', None)
+    if parallel_dir is not None:
+        env['GCC_RUNTEST_PARALLELIZE_DIR'] = parallel_dir
+    else:
+        env.pop('GCC_RUNTEST_PARALLELIZE_DIR', None)
+    flags = ' '.join([shard.exp] + runtest_flags)
+    start = time.time()
+    with open(pjoin(testsuite, 'make.out'), 'w') as out:
+        status = subprocess.call(['make', '-C', gcc_dir, 'check-' + shard.tool,
+                                  'TESTSUITEDIR=' + shard_dir_name(shard),
+                                  'RUNTESTFLAGS=' + flags],
+                                 stdout=out, stderr=subprocess.STDOUT, env=env)
+    return (shard.index, time.time() - start, status)
+
+def count_results(lines):
+    """Returns {result kind: number of result lines} of .sum file lines"""
+    counts = OrderedDict((kind, 0) for (kind, _) in _summary_names)
+    for line in lines:
+        if _sum_result_re.match(line):
+            kind = line.split(':', 1)[0]
+            if kind in counts:
+                counts[kind] += 1
+    return counts
+
+def merge_sum_files(paths, tool, out_path):
+    """Simple merge of .sum files (used when contrib/dg-extract-results.py
+    is not available): result lines are sorted, the summary is
+    recomputed"""
+    header = []
+    results = []
+    for path in paths:
+        with open(path, 'r') as f:
+            lines = f.read().splitlines()
+        if not header:
+            for line in lines:
+                if line.startswith('Running ') or '=== ' in line:
+                    break
+                header.append(line)
+        results += [line for line in lines if _sum_result_re.match(line)]
+    results.sort(key=lambda line: (line.split(': ', 1)[1], line))
+    counts = count_results(results)
+    with open(out_path, 'w') as f:
+        for line in header:
+            f.write(line + '\n')
+        f.write('\t\t=== {} tests ===\n\n'.format(tool))
+        for line in results:
+            f.write(line + '\n')
+        f.write('\n\t\t=== {} Summary ===\n\n'.format(tool))
+        for (kind, desc) in _summary_names:
+            if counts[kind]:
+                f.write('# of {:<24}{}\n'.format(desc, counts[kind]))
+
+def merge_results(source_dir, paths, tool, out_path, log=False):
+    """Merges .sum (or .log, if log is True) files of shards into
+    out_path"""
+    script = pjoin(source_dir, 'contrib', 'dg-extract-results.py')
+    if os.path.isfile(script):
+        cmd = [sys.executable, script] + (['-L'] if log else []) + paths
+        with open(out_path, 'w') as out:
+            if subprocess.call(cmd, stdout=out) == 0:
+                return
+    if log:
+        with open(out_path, 'w') as out:
+            for path in paths:
+                with open(path, 'r') as f:
+                    shutil.copyfileobj(f, out)
+    else:
+        merge_sum_files(paths, tool, out_path)
+
+
+class TestsuiteRunner(object):
+    def __init__(self, env, source_dir, build_dir, history_path):
+        self._env = env
+        self._source_dir = source_dir
+        self._gcc_dir = pjoin(build_dir, 'gcc')
+        self._testsuite_dir = pjoin(source_dir, 'gcc', 'testsuite')
+        self._history = CheckHistory(history_path)
+
+    def _can_split(self):
+        """Checks whether the testsuite supports dividing tests of a single
+        .exp between several runtest instances (GCC 5 and later)"""
+        path = pjoin(self._testsuite_dir, 'lib', 'gcc-defs.exp')
+        if not os.path.isfile(path):
+            return False
+        with open(path, 'r') as f:
+            return 'GCC_RUNTEST_PARALLELIZE_DIR' in f.read()
+
+    def run(self, tools, jobs, runtest_flags=None):
+        """Runs testsuites of tools using jobs parallel runtest instances.
+        Merged results are written into testsuite/<tool>/<tool>.{sum,log}
+        (as "make check" does). Returns True if all shards produced results
+        (make exits with non-zero status when any test fails, so its status
+        is not checked)"""
+        con = self._env
+        runtest_flags = runtest_flags or []
+        tools_exps = OrderedDict()
+        for tool in tools:
+            exps = find_exp_files(self._testsuite_dir, tool)
+            if not exps:
+                con.warn('No .exp files found for {}'.format(tool))
+                continue
+            tools_exps[tool] = exps
+        can_split = self._can_split()
+        shards = plan_shards(tools_exps, self._history, jobs, can_split)
+        con.info('Running {} shard(s) of {} testsuite(s), {} job(s), '
+                 'estimated time: {:.0f} s'.format(
+                    len(shards), ', '.join(tools_exps), jobs,
+                    sum(s.estimate for s in shards) / jobs))
+        # site.exp is shared by all shards, create it before they start
+        self._env.invoke('make', '-C', self._gcc_dir, 'site.exp')
+        parallel_root = pjoin(self._gcc_dir, 'testsuite-parallel')
+        if os.path.exists(parallel_root):
+            shutil.rmtree(parallel_root)
+        parallel_jobs = []
+        for shard in shards:
+            parallel_dir = None
+            if shard.part is not None:
+                parallel_dir = pjoin(parallel_root,
+                                     '{}.{}'.format(shard.tool, shard.exp))
+                if not os.path.isdir(parallel_dir):
+                    os.makedirs(parallel_dir)
+            parallel_jobs.append((self._gcc_dir, shard, parallel_dir,
+                                  runtest_flags))
+        durations = {}
+        done = 0
+        ok = True
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for (idx, duration, status) in \
+                    pool.imap_unordered(run_shard, parallel_jobs):
+                shard = shards[idx]
+                key = (shard.tool, shard.exp)
+                durations[key] = durations.get(key, 0.0) + duration
+                done += 1
+                con.info('[{}/{}] {}: {:.1f} s (estimated {:.1f} s)'.format(
+                            done, len(shards), shard.name, duration,
+                            shard.estimate))
+        finally:
+            pool.terminate()
+            pool.join()
+        for ((tool, exp), duration) in durations.items():
+            self._history.update(tool, exp, duration)
+        self._history.save()
+        for tool in tools_exps:
+            ok = self._merge(tool, shards) and ok
+        return ok
+
+    def _merge(self, tool, shards):
+        con = self._env
+        sums = []
+        logs = []
+        complete = True
+        for shard in shards:
+            if shard.tool != tool:
+                continue
+            base = pjoin(self._gcc_dir, shard_dir_name(shard), tool, tool)
+            if not os.path.isfile(base + '.sum'):
+                con.warn('{}: no results found (see {})'.format(
+                            shard.name, pjoin(self._gcc_dir,
+                                              shard_dir_name(shard),
+                                              'make.out')))
+                complete = False
+                continue
+            sums.append(base + '.sum')
+            if os.path.isfile(base + '.log'):
+                logs.append(base + '.log')
+        if not sums:
+            return False
+        out_dir = pjoin(self._gcc_dir, 'testsuite', tool)
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        out = pjoin(out_dir, tool)
+        merge_results(self._source_dir, sums, tool, out + '.sum')
+        merge_results(self._source_dir, logs, tool, out + '.log', log=True)
+        con.ok('Results: ' + out + '.sum')
+        self._print_summary(tool, out + '.sum')
+        return complete
+
+    def _print_summary(self, tool, path):
+        con = self._env
+        with open(path, 'r') as f:
+            counts = count_results(f)
+        for (kind, desc) in _summary_names:
+            if counts[kind]:
+                con.info('  # of {:<24}{}'.format(desc, counts[kind]))
+        if counts['FAIL']:
+            con.warn('{}: {} unexpected failure(s)'.format(tool,
+                                                          counts['FAIL']))
@@ -0,0 +1,209 @@
+# Checkpoints of configured build directories. A checkpoint is a copy of the
+# build directory after the top-level configure and the configuration of host
+# modules (configure-host for non-bootstrap builds, configure-stage1-* for
+# bootstrap builds: later stages are configured with the compiler built by
+# the previous stage). Builds with the same fingerprint start from a clone of
+# the checkpoint instead of running configure.
+#
+# Configured build directories contain absolute paths of the build and the
+# source directory, so both are a part of the fingerprint; so are the
+# configure options, the identities of the stage 0 compilers and the contents
+# of the configure scripts and makefile templates of the source tree.
+
+from __future__ import print_function
+
+import os, os.path
+import errno
+import hashlib
+import json
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from .common import compiler_identity, sha1_file
+
+pjoin = os.path.join
+
+# Clone methods, in the order of preference
+REFLINK = 'reflink'
+HARDLINK = 'hardlink'
+COPY = 'copy'
+CLONE_METHODS = [REFLINK, HARDLINK, COPY]
+
+DEFAULT_KEEP = 5
+# Changes of the fingerprint or the checkpoint format invalidate checkpoints
+KEY_VERSION = '1'
+
+# Files of the source tree (in the top directory and in each module) which
+# affect configuration
+_config_inputs = ['configure', 'Makefile.in', 'config.in', 'Makefile.def',
+                  'Makefile.tpl', 'config.sub', 'config.guess', 'config.gcc',
+                  'config.host', 'BASE-VER', 'DEV-PHASE', 'ltmain.sh',
+                  'config-ml.in']
+
+_stage1_target_re = re.compile(r'^(configure-stage1-[^\s:]+):')
+
+def stage_of(bootstrap):
+    """Returns the name of the configuration stage of checkpoints"""
+    return 'stage1' if bootstrap else 'host'
+
+def fingerprint(source_dir, build_dir, options, compilers, stage):
+    """Returns the fingerprint of a configured build directory"""
+    h = hashlib.sha1()
+    h.update('{}\n{}\n{}\n{}\n'.format(
+                KEY_VERSION, os.path.abspath(source_dir),
+                os.path.abspath(build_dir), stage).encode('utf-8'))
+    h.update(json.dumps(options).encode('utf-8'))
+    for compiler in compilers:
+        h.update('{}\n'.format(compiler_identity(compiler)[0]).encode('utf-8'))
+    dirs = [''] + sorted(name for name in os.listdir(source_dir)
+                         if os.path.isdir(pjoin(source_dir, name)))
+    for subdir in dirs:
+        for name in _config_inputs:
+            path = pjoin(source_dir, subdir, name)
+            if os.path.isfile(path):
+                h.update('{} {}\n'.format(pjoin(subdir, name),
+                                          sha1_file(path)).encode('utf-8'))
+    return h.hexdigest()
+
+def stage_targets(build_dir, stage):
+    """Returns make targets which configure host modules in a build directory
+    configured by the top-level configure"""
+    if stage == 'host':
+        return ['configure-host']
+    targets = []
+    with open(pjoin(build_dir, 'Makefile'), 'r') as f:
+        for line in f:
+            match = _stage1_target_re.match(line)
+            if match and match.group(1) not in targets:
+                targets.append(match.group(1))
+    return targets
+
+def _manifest(path):
+    """Returns {relative path: [size, mtime]} of regular files in path"""
+    res = {}
+    for (dirpath, _, fnames) in os.walk(path):
+        for fname in fnames:
+            full_path = pjoin(dirpath, fname)
+            if os.path.islink(full_path):
+                continue
+            st = os.stat(full_path)
+            res[os.path.relpath(full_path, path)] = [st.st_size,
+                                                     st.st_mtime]
+    return res
+
+def _clean(path):
+    for name in os.listdir(path):
+        full_path = pjoin(path, name)
+        if os.path.isdir(full_path) and not os.path.islink(full_path):
+            shutil.rmtree(full_path)
+        else:
+            os.unlink(full_path)
+
+def _hardlink_tree(src, dst):
+    for (dirpath, dirnames, fnames) in os.walk(src):
+        rel = os.path.relpath(dirpath, src)
+        target = os.path.normpath(pjoin(dst, rel))
+        if not os.path.isdir(target):
+            os.mkdir(target)
+        shutil.copystat(dirpath, target)
+        for name in dirnames + fnames:
+            full_path = pjoin(dirpath, name)
+            if os.path.islink(full_path):
+                os.symlink(os.readlink(full_path), pjoin(target, name))
+            elif name in fnames:
+                os.link(full_path, pjoin(target, name))
+
+def clone_tree(src, dst, methods=CLONE_METHODS):
+    """Clones the contents of directory src into an empty directory dst,
+    preserving timestamps. Returns the method used"""
+    for method in methods:
+        try:
+            if method == REFLINK:
+                with open(os.devnull, 'w') as devnull:
+                    status = subprocess.call(['cp', '-a', '--reflink=always',
+                                              src + '/.', dst],
+                                             stderr=devnull)
+                if status != 0:
+                    raise OSError(errno.EOPNOTSUPP, 'reflink failed')
+            elif method == HARDLINK:
+                _hardlink_tree(src, dst)
+            else:
+                subprocess.check_call(['cp', '-a', src + '/.', dst])
+            return method
+        except (OSError, subprocess.CalledProcessError):
+            if method == methods[-1]:
+                raise
+            _clean(dst)
+
+
+class CheckpointStore(object):
+    """Checkpoints are stored as subdirectories named by the fingerprint:
+    tree (the build directory) and checkpoint.json (description and the
+    manifest of the tree). The manifest detects checkpoints modified through
+    hardlinked clones; such checkpoints are discarded"""
+
+    def __init__(self, path, keep=DEFAULT_KEEP):
+        self.path = path
+        self.keep = keep
+
+    def _dir(self, key):
+        return pjoin(self.path, key)
+
+    def find(self, key):
+        """Returns the tree of a valid checkpoint or None"""
+        info_path = pjoin(self._dir(key), 'checkpoint.json')
+        if not os.path.isfile(info_path):
+            return None
+        with open(info_path, 'r') as f:
+            info = json.load(f)
+        tree = pjoin(self._dir(key), 'tree')
+        if _manifest(tree) != info['manifest']:
+            shutil.rmtree(self._dir(key))
+            return None
+        return tree
+
+    def restore(self, key, build_dir):
+        """Clones a checkpoint into build_dir (which must be empty), returns
+        the clone method or None if there is no valid checkpoint"""
+        tree = self.find(key)
+        if tree is None:
+            return None
+        method = clone_tree(tree, build_dir)
+        # The least recently used checkpoints are removed first
+        os.utime(self._dir(key), None)
+        return method
+
+    def save(self, key, build_dir, description):
+        """Saves a checkpoint of build_dir, removes old checkpoints"""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp', dir=self.path)
+        try:
+            tree = pjoin(tmp_dir, 'tree')
+            os.mkdir(tree)
+            # Hardlinks would be modified by the build
+            clone_tree(build_dir, tree, [REFLINK, COPY])
+            with open(pjoin(tmp_dir, 'checkpoint.json'), 'w') as f:
+                json.dump({ 'description': description,
+                            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                            'manifest': _manifest(tree) }, f)
+            if os.path.isdir(self._dir(key)):
+                shutil.rmtree(self._dir(key))
+            os.rename(tmp_dir, self._dir(key))
+        except:
+            shutil.rmtree(tmp_dir)
+            raise
+        self._prune()
+
+    def _prune(self):
+        entries = []
+        for name in os.listdir(self.path):
+            path = self._dir(name)
+            if not name.startswith('.tmp') and os.path.isdir(path):
+                entries.append((os.path.getmtime(path), path))
+        entries.sort(reverse=True)
+        for (_, path) in entries[self.keep:]:
+            shutil.rmtree(path)
@@ -5,6 +5,7 @@ import sys, subprocess, traceback
 import os, time
 import re
 import math
+import hashlib
 
 def dict_to_struct(dct):
     class Struct(object):
@@ -21,6 +22,95 @@ def dict_to_struct(dct):
 
 _ansi_strip = re.compile(r'\x1b[^m]*m')
 
+source_exts = ['.c', '.i', '.cc', '.cp', '.cxx', '.cpp', '.c++', '.C', '.ii',
+               '.f', '.for', '.f90', '.f95', '.f03', '.f08', '.F', '.F90']
+
+def collect_sources(paths):
+    """Returns the list of source files: paths, with directories replaced
+    by source files found in them (recursively)"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for (dirpath, dirnames, fnames) in os.walk(path):
+                dirnames.sort()
+                for fname in sorted(fnames):
+                    if os.path.splitext(fname)[1] in source_exts:
+                        files.append(os.path.join(dirpath, fname))
+        else:
+            files.append(path)
+    return files
+
+def sha1_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+def run_logged(cmd, log_path, cwd=None):
+    """Runs cmd with output redirected to log_path, returns (exit status,
+    wall time, CPU time of the process and its children)"""
+    with open(log_path, 'w') as log:
+        start = _timer()
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT,
+                                cwd=cwd)
+        (_, status, usage) = os.wait4(proc.pid, 0)
+        # Prevent Popen from waiting for the reaped process
+        proc.returncode = status
+        wall = _timer() - start
+    code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+    return (code, wall, usage.ru_utime + usage.ru_stime)
+
+def which(name):
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        full_path = os.path.join(path, name)
+        if path and os.path.isfile(full_path) and \
+                os.access(full_path, os.X_OK):
+            return full_path
+    return None
+
+def _output(cmd):
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    return proc.communicate()[0]
+
+def compiler_identity(compiler):
+    """Returns (identity, version) of a compiler driver. The identity does
+    not depend on the location or the name of the driver"""
+    h = hashlib.sha1()
+    version = _output([compiler, '--version']).decode('utf-8', 'replace')
+    version = version.splitlines()[0] if version.strip() else ''
+    # Drop the name of the driver ("g++ (GCC) 6.1.0")
+    version = version.split(None, 1)[-1]
+    h.update(version.encode('utf-8'))
+    h.update(_output([compiler, '-dumpmachine']))
+    h.update(_output([compiler, '-dumpspecs']))
+    for prog in ['cc1', 'cc1plus', 'as']:
+        path = _output([compiler, '-print-prog-name=' + prog]).decode(
+                    'utf-8', 'replace').strip()
+        if not os.path.isabs(path):
+            path = which(path)
+        if path is not None and os.path.isfile(path):
+            h.update('{} {}\n'.format(prog, sha1_file(path)).encode('utf-8'))
+    return (h.hexdigest(), version)
+
+def parse_size(text):
+    """Parses sizes like "512M" or "20G", returns bytes"""
+    units = { 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40 }
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def format_size(size):
+    """Formats a size in bytes (can be negative), e.g., 1.5M"""
+    for (unit, div) in [('G', 1 << 30), ('M', 1 << 20), ('K', 1 << 10)]:
+        if abs(size) >= div:
+            return '{:.1f}{}'.format(float(size) / div, unit)
+    return '{}B'.format(size)
+
 def strip_ansi_colors(s):
    return _ansi_strip.sub('', s)
 
@@ -39,28 +129,28 @@ class StopWatch:
 
         @property
         def format_sec(self):
-            return '{}.{:03}'.format(self._ms / 1000, self._ms % 1000)
+            return '{}.{:03}'.format(self._ms // 1000, self._ms % 1000)
 
         @property
         def format_min(self):
             if self._ms > 60000:
-                sec = self._ms / 1000
-                return '{}:{:02}.{:03}'.format(sec / 60, sec % 60, self._ms % 1000)
+                sec = self._ms // 1000
+                return '{}:{:02}.{:03}'.format(sec // 60, sec % 60, self._ms % 1000)
             return self.format_sec
 
         @property
         def format_hr(self):
-            msec = self.msec
+            msec = self._ms
             if msec > 3600000:
-                sec = msec / 1000
-                hr = sec / 3600
+                sec = msec // 1000
+                hr = sec // 3600
                 sec = sec % 3600
                 return '{}:{:02}:{:02}.{:03}'.format(hr,
-                            sec / 60, sec % 60, msec % 1000)
+                            sec // 60, sec % 60, msec % 1000)
             return self.format_min
 
         def __repr__(self):
-            return 'StopWatch.TimeDelta({})'.format(self_sec)
+            return 'StopWatch.TimeDelta({})'.format(self.sec)
 
         def __str__(self):
             return self.format_min
@@ -0,0 +1,174 @@
+# Content-addressed cache of compilation results for builds with the stage 0
+# compiler (used by the compiler wrapper, see distbuild.py). The key of a
+# compilation is a hash of the preprocessed source, the compilation flags and
+# the identity of the compiler. Entries (the object file and the diagnostics)
+# are stored zlib-compressed, the least recently used ones are removed when
+# the cache exceeds its size limit.
+
+from __future__ import print_function, division
+
+import os, os.path
+import errno
+import fcntl
+import hashlib
+import json
+import struct
+import tempfile
+import zlib
+
+CACHE_VAR = 'GCC_COMPILE_CACHE'
+DEFAULT_MAX_SIZE = 10 << 30
+# Fraction of the size limit left after cleanup
+CLEANUP_RATIO = 0.8
+# Changes of the key format invalidate all entries
+KEY_VERSION = '1'
+
+_stderr_len = struct.Struct('!I')
+
+
+class CompileCache(object):
+    """The cache directory contains entries (in subdirectories named by the
+    first two characters of the key), stats.json (counters, total size and
+    the size limit) and identities.json (identities of compilers, keyed by
+    the path, size and modification time of the driver). Both files are
+    updated under a lock, because the wrapper runs in many processes"""
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+
+    def _locked_update(self, name, func):
+        """Applies func to the contents of JSON file name (a dictionary)
+        under the lock, returns the result of func"""
+        with open(os.path.join(self.path, 'lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                path = os.path.join(self.path, name)
+                data = {}
+                if os.path.isfile(path):
+                    with open(path, 'r') as f:
+                        data = json.load(f)
+                result = func(data)
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(data, f, indent=1, sort_keys=True)
+                os.rename(path + '.tmp', path)
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def stats(self):
+        path = os.path.join(self.path, 'stats.json')
+        if not os.path.isfile(path):
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def set_max_size(self, size):
+        def update(data):
+            data['max_size'] = size
+        self._locked_update('stats.json', update)
+
+    def count(self, counter):
+        """Increments one of counters: hits, misses, uncacheable"""
+        def update(data):
+            data[counter] = data.get(counter, 0) + 1
+        self._locked_update('stats.json', update)
+
+    def compiler_identity(self, compiler, compute):
+        """Returns the identity of compiler (the path to the driver),
+        compute(compiler) is called if it is not known yet"""
+        path = os.path.realpath(compiler)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime]
+        def lookup(data):
+            entry = data.get(path)
+            if entry is None or entry['stamp'] != stamp:
+                entry = { 'stamp': stamp, 'identity': compute(compiler)[0] }
+                data[path] = entry
+            return entry['identity']
+        return self._locked_update('identities.json', lookup)
+
+    @staticmethod
+    def make_key(identity, args, ext, source):
+        h = hashlib.sha1()
+        h.update('{}\n{}\n{}\n{}\n'.format(KEY_VERSION, identity, ext,
+                                           json.dumps(args)).encode('utf-8'))
+        h.update(source)
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """Returns (object file, stderr) or None. A hit marks the entry as
+        recently used"""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = zlib.decompress(f.read())
+            os.utime(path, None)
+        except (IOError, OSError, zlib.error):
+            return None
+        (length, ) = _stderr_len.unpack(data[:_stderr_len.size])
+        pos = _stderr_len.size + length
+        return (data[pos:],
+                data[_stderr_len.size:pos].decode('utf-8', 'replace'))
+
+    def put(self, key, obj, stderr):
+        path = self._entry_path(key)
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError as ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+        err = stderr.encode('utf-8')
+        data = zlib.compress(_stderr_len.pack(len(err)) + err + obj, 1)
+        (fd, tmp_path) = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+        size = len(data)
+        def update(stats):
+            stats['size'] = stats.get('size', 0) + size
+            max_size = stats.get('max_size', DEFAULT_MAX_SIZE)
+            if stats['size'] > max_size:
+                stats['size'] = self._cleanup(max_size)
+                stats['cleanups'] = stats.get('cleanups', 0) + 1
+        self._locked_update('stats.json', update)
+
+    def _cleanup(self, max_size):
+        """Removes the least recently used entries, so that the cache takes
+        at most CLEANUP_RATIO of max_size. Returns the new size"""
+        entries = []
+        for name in os.listdir(self.path):
+            subdir = os.path.join(self.path, name)
+            if len(name) != 2 or not os.path.isdir(subdir):
+                continue
+            for fname in os.listdir(subdir):
+                # Skip entries being written
+                if fname.startswith('.tmp'):
+                    continue
+                path = os.path.join(subdir, fname)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+        for (_, entry_size, path) in entries:
+            if size <= max_size * CLEANUP_RATIO:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            size -= entry_size
+        return size
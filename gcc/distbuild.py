@@ -0,0 +1,638 @@
+# Distributed compilation of stage 1 builds (in the style of distcc).
+#
+# The compiler is replaced by a wrapper (dist_cc.py), which preprocesses each
+# translation unit locally and sends it to the dispatcher running inside
+# build.py. The dispatcher forwards jobs to workers (dist_worker.py) which
+# have a free slot and returns the object files; if no slot is free, the job
+# is compiled locally. Workers are provided by executors: "tcp" (worker
+# daemons on build nodes) and "local" (worker processes on this machine,
+# stand-ins for build nodes). Other executors can be added to the executors
+# registry.
+#
+# Each worker reports the identities of its compilers: a hash of the target,
+# version, specs and binaries of the compiler proper and the assembler. Only
+# workers having the stage 0 compilers (C and C++) with identical identities
+# are used.
+#
+# The wrapper also implements the compile cache (see compcache.py), with or
+# without distribution.
+
+from __future__ import print_function, division
+
+import os, os.path
+import json
+import multiprocessing
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+if sys.version_info[0] < 3:
+    import Queue as queue
+    import SocketServer as socketserver
+else:
+    import queue
+    import socketserver
+
+from .common import compiler_identity, which
+from .netmsg import recv_msg, send_msg
+from .compcache import CACHE_VAR, CompileCache
+
+DEFAULT_PORT = 3634
+DISPATCHER_VAR = 'GCC_DIST_DISPATCHER'
+CONNECT_TIMEOUT = 10
+COMPILE_TIMEOUT = 1800
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+def parse_address(spec, default_port=DEFAULT_PORT):
+    (host, _, port) = spec.rpartition(':')
+    if not host:
+        return (spec, default_port)
+    return (host, int(port))
+
+
+# === Compiler command line analysis ===
+
+# Options followed by a separate argument
+_arg_opts = set(['-o', '-x', '-I', '-D', '-U', '-include', '-imacros',
+                 '-isystem', '-iquote', '-idirafter', '-iprefix',
+                 '-iwithprefix', '-iwithprefixbefore', '-MF', '-MT', '-MQ',
+                 '-Xpreprocessor', '-Xassembler', '-Xlinker', '-aux-info',
+                 '-L', '-l'])
+# Options used only by the preprocessor, not passed to remote compilation
+_cpp_prefixes = ('-I', '-D', '-U', '-include', '-imacros', '-isystem',
+                 '-iquote', '-idirafter', '-iprefix', '-iwithprefix', '-M',
+                 '-Wp,', '-Xpreprocessor', '-nostdinc')
+_cpp_opts = set(['-C', '-CC', '-P', '-H', '-undef', '-trigraphs'])
+# Options which require local compilation: other modes than compilation to
+# an object file, options referring to local files and host-specific options
+_local_prefixes = ('-E', '-S', '-save-temps', '-B', '-specs', '-fplugin',
+                   '-fprofile-use', '-fauto-profile', '-fdump-', '-wrapper',
+                   '--save-temps', '-fprofile-arcs', '-ftest-coverage',
+                   '--coverage', '-fprofile-generate')
+_local_opts = set(['-M', '-MM', '-'])
+
+# Options which are compiled remotely (code generation, diagnostics and
+# language options); options referring to files (containing a path) and
+# options passed to other programs are excluded by is_remote_arg
+_remote_prefixes = ('-O', '-g', '-f', '-m', '-W', '-std=', '--param=')
+_remote_opts = set(['-pipe', '-w', '-pedantic', '-pedantic-errors', '-ansi',
+                    '-p', '-pg'])
+_other_prog_prefixes = ('-Wa,', '-Wl,', '-Wp,')
+
+def _is_local_arg(arg):
+    return arg in _local_opts or arg.startswith(_local_prefixes) or \
+           '=native' in arg
+
+def is_remote_arg(arg):
+    """Checks whether arg can be passed to remote compilation of a
+    preprocessed source: an allow-list of options which do not write or read
+    files outside of the working directory"""
+    if '/' in arg or _is_local_arg(arg) or \
+            arg.startswith(_other_prog_prefixes):
+        return False
+    return arg in _remote_opts or arg.startswith(_remote_prefixes)
+
+_c_exts = set(['.c'])
+_cxx_exts = set(['.cc', '.cp', '.cxx', '.cpp', '.c++', '.C'])
+
+
+class CompileCommand(object):
+    """A distributable compiler invocation: compilation of a single C or C++
+    source to an object file"""
+
+    def __init__(self, compiler, cpp_args, remote_args, source, output, ext):
+        self.compiler = compiler
+        # Arguments of local preprocessing (without -E and -o)
+        self.cpp_args = cpp_args
+        # Arguments of remote compilation (without input and output)
+        self.remote_args = remote_args
+        self.source = source
+        self.output = output
+        # Extension of preprocessed source: .i (C) or .ii (C++)
+        self.ext = ext
+
+
+def parse_command(compiler, argv):
+    """Returns CompileCommand or None, if the command must be run locally"""
+    sources = []
+    output = None
+    lang = None
+    compile_only = False
+    cpp_args = []
+    remote_args = []
+    has_deps = has_dep_file = has_dep_target = False
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        value = None
+        if arg in _arg_opts:
+            if i + 1 >= len(argv):
+                return None
+            value = argv[i + 1]
+        i += 1 if value is None else 2
+        opt = [arg] if value is None else [arg, value]
+        if _is_local_arg(arg):
+            return None
+        if arg == '-c':
+            compile_only = True
+        elif arg.startswith('-o'):
+            output = value or arg[2:]
+        elif arg.startswith('-x'):
+            lang = value or arg[2:]
+            cpp_args += opt
+        elif arg.startswith(_cpp_prefixes) or arg in _cpp_opts:
+            cpp_args += opt
+            has_deps = has_deps or arg in ['-MD', '-MMD']
+            has_dep_file = has_dep_file or arg.startswith('-MF')
+            has_dep_target = has_dep_target or arg.startswith(('-MT', '-MQ'))
+        elif arg.startswith('-'):
+            cpp_args += opt
+            remote_args += opt
+        else:
+            sources.append(arg)
+            cpp_args.append(arg)
+    if not compile_only or len(sources) != 1:
+        return None
+    source = sources[0]
+    (base, ext) = os.path.splitext(os.path.basename(source))
+    # Configure tests are small, not worth sending
+    if base == 'conftest':
+        return None
+    if lang is None:
+        if ext in _c_exts:
+            lang = 'c++' if '++' in os.path.basename(compiler) else 'c'
+        elif ext in _cxx_exts:
+            lang = 'c++'
+    if lang not in ['c', 'c++']:
+        return None
+    if output is None:
+        output = base + '.o'
+    if has_deps:
+        # Dependencies are generated by the preprocessor, the default names
+        # would be derived from the temporary output
+        if not has_dep_file:
+            cpp_args += ['-MF', os.path.splitext(output)[0] + '.d']
+        if not has_dep_target:
+            cpp_args += ['-MQ', output]
+    if not all(is_remote_arg(arg) for arg in remote_args):
+        return None
+    return CompileCommand(compiler, cpp_args, remote_args, source, output,
+                          '.i' if lang == 'c' else '.ii')
+
+
+def compile_preprocessed(compiler, args, ext, source):
+    """Compiles preprocessed source (bytes), returns (result, object file
+    contents): result contains exit status, stderr and compilation time"""
+    tmp_dir = tempfile.mkdtemp(prefix='dist-')
+    try:
+        src_path = os.path.join(tmp_dir, 'input' + ext)
+        obj_path = os.path.join(tmp_dir, 'input.o')
+        with open(src_path, 'wb') as f:
+            f.write(source)
+        start = _timer()
+        proc = subprocess.Popen([compiler] + args + ['-c', src_path, '-o',
+                                                     obj_path],
+                                cwd=tmp_dir, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        err = proc.communicate()[0].decode('utf-8', 'replace')
+        elapsed = _timer() - start
+        obj = b''
+        if proc.returncode == 0:
+            try:
+                with open(obj_path, 'rb') as f:
+                    obj = f.read()
+            except (IOError, OSError) as ex:
+                return ({ 'status': 'error',
+                          'error': 'no object file: {}'.format(ex) }, b'')
+        return ({ 'status': 'ok', 'exit': proc.returncode, 'stderr': err,
+                  'time': elapsed }, obj)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+# === Worker ===
+
+def check_remote_args(args):
+    """Returns the first argument of a compile request which must not be
+    run on a worker (see is_remote_arg), or None"""
+    for arg in args:
+        if not is_remote_arg(arg):
+            return arg
+    return None
+
+def _parse_network(spec):
+    """Returns (address, mask) of an IPv4 network ADDRESS[/BITS]"""
+    (addr, _, bits) = spec.partition('/')
+    bits = int(bits) if bits else 32
+    if not 0 <= bits <= 32:
+        raise ValueError('Invalid network: {}'.format(spec))
+    mask = (0xffffffff << (32 - bits)) & 0xffffffff
+    return (_ip_to_int(addr) & mask, mask)
+
+def _ip_to_int(addr):
+    return struct.unpack('!I', socket.inet_aton(addr))[0]
+
+class _WorkerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        (req, payload, _) = recv_msg(self.request)
+        if req.get('type') == 'hello':
+            send_msg(self.request, { 'identities': server.versions,
+                                     'slots': server.slots })
+            return
+        compiler = server.compilers.get(req.get('identity'))
+        if compiler is None:
+            send_msg(self.request, { 'status': 'error',
+                                     'error': 'unknown compiler' })
+            return
+        bad_arg = check_remote_args(req['args'])
+        if bad_arg is not None:
+            send_msg(self.request, { 'status': 'error',
+                                     'error': 'argument not allowed: ' +
+                                              bad_arg })
+            return
+        with server.semaphore:
+            (result, obj) = compile_preprocessed(compiler, req['args'],
+                                                 req['ext'],
+                                                 zlib.decompress(payload))
+        send_msg(self.request, result, zlib.compress(obj, 1))
+
+
+class WorkerServer(socketserver.ThreadingTCPServer):
+    """Compiles preprocessed sources with the given compilers, at most slots
+    at a time. allow is a list of IPv4 networks (ADDRESS[/BITS]) of the
+    clients which are served (None: all clients)"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, compilers, slots, allow=None):
+        self.allow = None if allow is None else \
+                     [_parse_network(spec) for spec in allow]
+        self.compilers = {}
+        self.versions = {}
+        for path in compilers:
+            (identity, version) = compiler_identity(path)
+            self.compilers[identity] = path
+            self.versions[identity] = version
+        self.slots = slots
+        self.semaphore = threading.Semaphore(slots)
+        socketserver.ThreadingTCPServer.__init__(self, address,
+                                                 _WorkerHandler)
+
+    def verify_request(self, request, client_address):
+        if self.allow is None:
+            return True
+        try:
+            addr = _ip_to_int(client_address[0])
+        except (socket.error, ValueError):
+            return False
+        return any(addr & mask == net for (net, mask) in self.allow)
+
+
+# === Executors ===
+
+class Executor(object):
+    """Provider of workers. start returns the list of worker addresses
+    (host, port), stop releases the workers"""
+
+    def start(self, env, compilers):
+        raise NotImplementedError()
+
+    def stop(self):
+        pass
+
+
+class TCPExecutor(Executor):
+    """Worker daemons (dist_worker.py) on build nodes. spec is a
+    comma-separated list of HOST[:PORT]"""
+
+    def __init__(self, spec):
+        self._addresses = [parse_address(host) for host in spec.split(',')
+                           if host]
+
+    def start(self, env, compilers):
+        return self._addresses
+
+
+def _serve_local(compilers, conn):
+    server = WorkerServer(('127.0.0.1', 0), compilers, 1)
+    conn.send(server.server_address[1])
+    conn.close()
+    server.serve_forever()
+
+class LocalExecutor(Executor):
+    """Worker processes with one slot each on this machine (for testing). spec
+    is the number of workers (default: number of CPUs)"""
+
+    def __init__(self, spec):
+        self._num = int(spec) if spec else multiprocessing.cpu_count()
+        self._procs = []
+
+    def start(self, env, compilers):
+        addresses = []
+        for _ in range(self._num):
+            (parent, child) = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=_serve_local,
+                                           args=(compilers, child))
+            proc.daemon = True
+            proc.start()
+            self._procs.append(proc)
+            addresses.append(('127.0.0.1', parent.recv()))
+        return addresses
+
+    def stop(self):
+        for proc in self._procs:
+            proc.terminate()
+            proc.join()
+        self._procs = []
+
+
+executors = OrderedDict([('tcp', TCPExecutor), ('local', LocalExecutor)])
+
+def make_executor(spec):
+    """spec is "NAME:ARGS" for executors from the registry, otherwise a list
+    of hosts for the tcp executor"""
+    (name, _, rest) = spec.partition(':')
+    if name in executors:
+        return executors[name](rest)
+    return TCPExecutor(spec)
+
+
+# === Dispatcher ===
+
+class Worker(object):
+    def __init__(self, address, slots, identities):
+        self.address = address
+        self.slots = slots
+        self.identities = identities
+        self.jobs = 0
+        self.busy = 0.0
+        self.failed = False
+
+    @property
+    def name(self):
+        return '{}:{}'.format(*self.address)
+
+
+class DistStats(object):
+    def __init__(self):
+        self.remote = 0
+        self.local = 0
+        self.failed = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.remote_time = 0.0
+
+
+class _DispatcherHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        (req, payload, _) = recv_msg(self.request)
+        (reply, obj) = self.server.dispatch(req, payload)
+        send_msg(self.request, reply, obj)
+
+
+class Dispatcher(socketserver.ThreadingTCPServer):
+    """Receives jobs from compiler wrappers and distributes them to workers
+    with free slots"""
+
+    daemon_threads = True
+
+    def __init__(self, env, executor, compilers):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 _DispatcherHandler)
+        self._env = env
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._thread = None
+        self.identities = {}
+        self.workers = []
+        self.stats = DistStats()
+        self._slots = queue.Queue()
+        for compiler in compilers:
+            self.identities[compiler] = compiler_identity(compiler)
+        for address in executor.start(env, compilers):
+            self._add_worker(address)
+
+    def _add_worker(self, address):
+        con = self._env
+        try:
+            sock = socket.create_connection(address, CONNECT_TIMEOUT)
+            try:
+                send_msg(sock, { 'type': 'hello' })
+                (reply, _, _) = recv_msg(sock)
+            finally:
+                sock.close()
+        except (socket.error, EOFError, ValueError) as ex:
+            con.warn('Worker {}:{} is not available: {}'.format(
+                        address[0], address[1], ex))
+            return
+        worker = Worker(address, reply['slots'], reply['identities'])
+        for (compiler, (identity, version)) in self.identities.items():
+            if identity not in worker.identities:
+                con.warn('Worker {} does not have {} ({}), not '
+                         'used'.format(worker.name, compiler, version))
+                return
+        self.workers.append(worker)
+        for _ in range(worker.slots):
+            self._slots.put(worker)
+
+    @property
+    def slots(self):
+        return sum(worker.slots for worker in self.workers)
+
+    @property
+    def address(self):
+        return '{}:{}'.format(*self.server_address)
+
+    def dispatch(self, req, source):
+        """Compiles a job on a worker with a free slot. Returns (reply,
+        object file): reply status is 'ok' or 'local' (the job should be
+        compiled locally)"""
+        identity = self.identities.get(req['compiler'])
+        try:
+            worker = self._slots.get_nowait()
+        except queue.Empty:
+            worker = None
+        if identity is None or worker is None:
+            with self._lock:
+                self.stats.local += 1
+            return ({ 'status': 'local' }, b'')
+        start = _timer()
+        payload = zlib.compress(source, 1)
+        try:
+            sock = socket.create_connection(worker.address, CONNECT_TIMEOUT)
+            try:
+                sock.settimeout(COMPILE_TIMEOUT)
+                sent = send_msg(sock, { 'type': 'compile',
+                                        'identity': identity[0],
+                                        'args': req['args'],
+                                        'ext': req['ext'] }, payload)
+                (reply, obj, received) = recv_msg(sock)
+            finally:
+                sock.close()
+        except (socket.error, EOFError, ValueError) as ex:
+            # The slot is not returned, the worker gets no more jobs
+            with self._lock:
+                self.stats.failed += 1
+                if not worker.failed:
+                    worker.failed = True
+                    self._env.warn('Worker {} failed: {}'.format(worker.name,
+                                                                  ex))
+            return ({ 'status': 'local' }, b'')
+        self._slots.put(worker)
+        with self._lock:
+            self.stats.bytes_sent += sent
+            self.stats.bytes_received += received
+            worker.busy += _timer() - start
+            if reply.get('status') != 'ok' or reply['exit'] != 0:
+                # Let the local compiler report errors
+                self.stats.failed += 1
+                return ({ 'status': 'local' }, b'')
+            worker.jobs += 1
+            self.stats.remote += 1
+            self.stats.remote_time += reply['time']
+        return (reply, zlib.decompress(obj))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        os.environ[DISPATCHER_VAR] = self.address
+
+    def stop(self):
+        os.environ.pop(DISPATCHER_VAR, None)
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+        self.server_close()
+        self._executor.stop()
+
+
+class BuildTimes(object):
+    """Durations of local and distributed builds of each kind (build type
+    and languages), used to report the speedup"""
+
+    def __init__(self, path):
+        self._path = path
+        self._data = {}
+        if path is not None and os.path.isfile(path):
+            with open(path, 'r') as f:
+                self._data = json.load(f)
+
+    def get(self, kind, distributed):
+        return self._data.get(kind, {}).get('dist' if distributed else 'local')
+
+    def record(self, kind, distributed, seconds):
+        if self._path is None:
+            return
+        self._data.setdefault(kind, {})['dist' if distributed else
+                                        'local'] = seconds
+        with open(self._path + '.tmp', 'w') as f:
+            json.dump(self._data, f, indent=1, sort_keys=True)
+        os.rename(self._path + '.tmp', self._path)
+
+
+# === Compiler wrapper ===
+
+def wrapper_command(compiler):
+    """Returns the value of CC/CXX which runs compiler via the wrapper"""
+    script = os.path.join(os.path.dirname(os.path.dirname(
+                            os.path.abspath(__file__))), 'dist_cc.py')
+    return ' '.join([sys.executable, script, compiler])
+
+def _run_local(compiler, argv):
+    os.execvp(compiler, [compiler] + argv)
+
+def _preprocess(cmd):
+    """Returns (exit status, preprocessed source)"""
+    tmp_dir = tempfile.mkdtemp(prefix='dist-cc-')
+    try:
+        tmp_path = os.path.join(tmp_dir, 'input' + cmd.ext)
+        status = subprocess.call([cmd.compiler] + cmd.cpp_args +
+                                 ['-E', '-o', tmp_path])
+        if status != 0:
+            return (status, None)
+        with open(tmp_path, 'rb') as f:
+            return (0, f.read())
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def _compile_remote(address, cmd, source):
+    """Returns (reply, object file) or None, if the job must be compiled
+    locally"""
+    try:
+        sock = socket.create_connection(parse_address(address),
+                                        CONNECT_TIMEOUT)
+        try:
+            sock.settimeout(None)
+            send_msg(sock, { 'compiler': cmd.compiler,
+                             'args': cmd.remote_args, 'ext': cmd.ext },
+                     source)
+            (reply, obj, _) = recv_msg(sock)
+        finally:
+            sock.close()
+    except (socket.error, EOFError, ValueError):
+        return None
+    if reply['status'] != 'ok':
+        return None
+    return (reply, obj)
+
+def _write_output(cmd, obj, stderr):
+    if stderr:
+        sys.stderr.write(stderr)
+    with open(cmd.output + '.tmp', 'wb') as f:
+        f.write(obj)
+    os.rename(cmd.output + '.tmp', cmd.output)
+
+def wrapper_main(argv):
+    """Entry point of the compiler wrapper: argv is the compiler and its
+    arguments. Compilations are looked up in the compile cache (if
+    GCC_COMPILE_CACHE is set, see compcache.py) and sent to the dispatcher
+    (if GCC_DIST_DISPATCHER is set)"""
+    compiler = argv[0]
+    args = argv[1:]
+    address = os.environ.get(DISPATCHER_VAR)
+    cache_dir = os.environ.get(CACHE_VAR)
+    cache = CompileCache(cache_dir) if cache_dir else None
+    cmd = parse_command(compiler, args) if address or cache else None
+    if cmd is None:
+        if cache is not None:
+            cache.count('uncacheable')
+        _run_local(compiler, args)
+    (status, source) = _preprocess(cmd)
+    if status != 0:
+        return status
+    if cache is not None:
+        path = compiler if os.sep in compiler else which(compiler)
+        identity = cache.compiler_identity(path, compiler_identity)
+        key = CompileCache.make_key(identity, cmd.remote_args, cmd.ext,
+                                    source)
+        entry = cache.get(key)
+        if entry is not None:
+            cache.count('hits')
+            _write_output(cmd, *entry)
+            return 0
+        cache.count('misses')
+    result = _compile_remote(address, cmd, source) if address else None
+    if result is None and cache is not None:
+        # Compile the preprocessed source, so that the cached object does
+        # not depend on whether it was compiled remotely or locally
+        result = compile_preprocessed(compiler, cmd.remote_args, cmd.ext,
+                                      source)
+    if result is None or result[0]['status'] != 'ok' or \
+            result[0]['exit'] != 0:
+        # Let the original command report errors
+        _run_local(compiler, args)
+    (reply, obj) = result
+    _write_output(cmd, obj, reply['stderr'])
+    if cache is not None:
+        cache.put(key, obj, reply['stderr'])
+    return 0
@@ -0,0 +1,281 @@
+# Collection of coverage data of a gcov-instrumented build (build.py
+# --coverage): gcov is run in parallel over object directories, results are
+# merged per source file and exported in lcov format.
+#
+# Results of each .gcda file are stored separately (together with its size and
+# modification time), so that after running more tests only the changed .gcda
+# files are processed again.
+
+from __future__ import print_function, division
+
+import os, os.path
+import gzip
+import json
+import shutil
+import subprocess
+import tempfile
+from collections import OrderedDict
+
+FORMAT_JSON = 'json'                    # GCC 9 and later
+FORMAT_INTERMEDIATE = 'intermediate'    # GCC 4.9 - 8
+
+# Number of .gcda files processed by a single gcov invocation
+CHUNK_SIZE = 16
+
+def gcov_format(gcov):
+    """Returns the output format supported by gcov"""
+    proc = subprocess.Popen([gcov, '--help'], stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    out = proc.communicate()[0].decode('utf-8', 'replace')
+    if '--json-format' in out:
+        return FORMAT_JSON
+    if '--intermediate-format' in out:
+        return FORMAT_INTERMEDIATE
+    return None
+
+def find_gcda(build_dir):
+    """Returns {object directory: [.gcda files]} (absolute paths)"""
+    result = OrderedDict()
+    for (dirpath, dirnames, fnames) in os.walk(os.path.abspath(build_dir)):
+        dirnames.sort()
+        gcda = [os.path.join(dirpath, fname) for fname in sorted(fnames)
+                if fname.endswith('.gcda')]
+        if gcda:
+            result[dirpath] = gcda
+    return result
+
+def gcda_stamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime]
+
+def _new_file():
+    return { 'lines': {}, 'functions': {}, 'branches': {} }
+
+def _add_branches(data, line, counts):
+    """Adds branch counts of a line (-1 means "not executed")"""
+    old = data['branches'].get(line)
+    if old is None or len(old) != len(counts):
+        data['branches'][line] = counts
+    else:
+        data['branches'][line] = [max(a, 0) + max(b, 0) if max(a, b) >= 0
+                                  else -1 for (a, b) in zip(old, counts)]
+
+def parse_json(data):
+    """Parses gcov JSON output (already decoded), returns
+    {source file: coverage}. Coverage is a dictionary: 'lines' {line:
+    count}, 'functions' {name: [start line, count]} and 'branches' {line:
+    [counts]} (line numbers are strings, for the sake of JSON)"""
+    cwd = data.get('current_working_directory', '')
+    result = {}
+    for entry in data.get('files', []):
+        path = os.path.normpath(os.path.join(cwd, entry['file']))
+        cov = result.setdefault(path, _new_file())
+        for func in entry.get('functions', []):
+            name = func.get('demangled_name') or func['name']
+            old = cov['functions'].get(name, [func['start_line'], 0])
+            cov['functions'][name] = [old[0],
+                                      old[1] + func['execution_count']]
+        for line in entry.get('lines', []):
+            num = str(line['line_number'])
+            cov['lines'][num] = cov['lines'].get(num, 0) + line['count']
+            branches = line.get('branches')
+            if branches:
+                _add_branches(cov, num, [b['count'] for b in branches])
+    return result
+
+def parse_intermediate(text, objdir):
+    """Parses gcov intermediate text format (-i, GCC 4.9 - 8), returns the
+    same structure as parse_json. Branches are reported as taken (1), not
+    taken (0) or not executed (-1)"""
+    result = {}
+    cov = None
+    branches = OrderedDict()
+    for line in text.splitlines():
+        (tag, _, value) = line.partition(':')
+        if tag == 'file':
+            cov = result.setdefault(os.path.normpath(
+                        os.path.join(objdir, value)), _new_file())
+        elif cov is None:
+            continue
+        elif tag == 'function':
+            fields = value.split(',')
+            # GCC 8: start,end,count,name; older: line,count,name
+            if len(fields) >= 4:
+                (start, count, name) = (fields[0], fields[2],
+                                        ','.join(fields[3:]))
+            else:
+                (start, count, name) = (fields[0], fields[1],
+                                        ','.join(fields[2:]))
+            old = cov['functions'].get(name, [int(start), 0])
+            cov['functions'][name] = [old[0], old[1] + int(count)]
+        elif tag == 'lcount':
+            fields = value.split(',')
+            cov['lines'][fields[0]] = cov['lines'].get(fields[0], 0) + \
+                                      int(fields[1])
+        elif tag == 'branch':
+            (num, kind) = value.split(',')[:2]
+            branches.setdefault((id(cov), num), (cov, []))[1].append(
+                    { 'taken': 1, 'nottaken': 0 }.get(kind, -1))
+    for ((_, num), (cov, counts)) in branches.items():
+        _add_branches(cov, num, counts)
+    return result
+
+def _merge_into(dest, src):
+    for (path, cov) in src.items():
+        if path not in dest:
+            dest[path] = _new_file()
+        target = dest[path]
+        for (num, count) in cov['lines'].items():
+            target['lines'][num] = target['lines'].get(num, 0) + count
+        for (name, (start, count)) in cov['functions'].items():
+            old = target['functions'].get(name, [start, 0])
+            target['functions'][name] = [old[0], old[1] + count]
+        for (num, counts) in cov['branches'].items():
+            _add_branches(target, num, counts)
+
+def _invoke_gcov(gcov, args, cwd):
+    with open(os.devnull, 'w') as null:
+        proc = subprocess.Popen([gcov] + args, cwd=cwd, stdout=null,
+                                stderr=subprocess.PIPE)
+        err = proc.communicate()[1].decode('utf-8', 'replace')
+    return (proc.returncode, err.strip())
+
+def run_gcov(job):
+    """Runs gcov on .gcda files of one object directory in a temporary
+    directory. Returns ({.gcda file: coverage}, list of error messages)"""
+    (gcov, fmt, objdir, files) = job
+    tmp_dir = tempfile.mkdtemp(prefix='gcov-')
+    result = {}
+    errors = []
+    try:
+        if fmt == FORMAT_JSON:
+            # Each output file contains the name of its .gcda file, so all
+            # files are processed by a single gcov invocation. Without -b,
+            # branch counts are not reported
+            (status, err) = _invoke_gcov(gcov, ['--json-format', '-b', '-o',
+                                                objdir] + files, tmp_dir)
+            if status != 0:
+                errors.append('{}: {}'.format(objdir, err))
+            for fname in os.listdir(tmp_dir):
+                with gzip.open(os.path.join(tmp_dir, fname), 'rb') as f:
+                    data = json.loads(f.read().decode('utf-8'))
+                path = os.path.normpath(os.path.join(
+                        data.get('current_working_directory', objdir),
+                        data['data_file']))
+                result[path] = parse_json(data)
+        else:
+            for path in files:
+                (status, err) = _invoke_gcov(gcov, ['--intermediate-format',
+                                                    '-b', '-o', objdir, path],
+                                             tmp_dir)
+                if status != 0:
+                    errors.append('{}: {}'.format(path, err))
+                    continue
+                coverage = {}
+                for fname in os.listdir(tmp_dir):
+                    out = os.path.join(tmp_dir, fname)
+                    with open(out, 'r') as f:
+                        _merge_into(coverage, parse_intermediate(f.read(),
+                                                                 objdir))
+                    os.unlink(out)
+                result[path] = coverage
+    finally:
+        shutil.rmtree(tmp_dir)
+    return (result, errors)
+
+def make_jobs(gcov, fmt, gcda_files):
+    """Splits {object directory: [.gcda files]} into jobs for run_gcov"""
+    jobs = []
+    for (objdir, files) in gcda_files.items():
+        for start in range(0, len(files), CHUNK_SIZE):
+            jobs.append((gcov, fmt, objdir, files[start:start + CHUNK_SIZE]))
+    return jobs
+
+
+class CoverageStore(object):
+    """Coverage of each .gcda file: {.gcda: {'stamp': [size, mtime],
+    'files': {source: coverage}}}, saved as gzipped JSON"""
+
+    def __init__(self, path):
+        self._path = path
+        self.gcda = {}
+        if os.path.isfile(path):
+            with gzip.open(path, 'rb') as f:
+                self.gcda = json.loads(f.read().decode('utf-8'))
+
+    def outdated(self, gcda_files):
+        """Returns {object directory: [.gcda files]} of new or changed
+        files, removes entries of .gcda files which no longer exist"""
+        current = set()
+        result = OrderedDict()
+        for (objdir, files) in gcda_files.items():
+            for path in files:
+                current.add(path)
+                entry = self.gcda.get(path)
+                if entry is None or entry['stamp'] != gcda_stamp(path):
+                    result.setdefault(objdir, []).append(path)
+        for path in list(self.gcda):
+            if path not in current:
+                del self.gcda[path]
+        return result
+
+    def update(self, path, coverage):
+        self.gcda[path] = { 'stamp': gcda_stamp(path), 'files': coverage }
+
+    def save(self):
+        with gzip.open(self._path + '.tmp', 'wb') as f:
+            f.write(json.dumps(self.gcda).encode('utf-8'))
+        os.rename(self._path + '.tmp', self._path)
+
+    def merged(self, include=None, exclude=None):
+        """Returns coverage merged over all .gcda files: {source: coverage}.
+        include and exclude are compiled regexps matched against source
+        paths"""
+        result = {}
+        for entry in self.gcda.values():
+            files = dict((path, cov) for (path, cov) in entry['files'].items()
+                         if (include is None or include.search(path)) and
+                            (exclude is None or not exclude.search(path)))
+            _merge_into(result, files)
+        return result
+
+
+def file_summary(cov):
+    """Returns (lines found, lines hit, functions found, functions hit,
+    branches found, branches hit)"""
+    lines = cov['lines'].values()
+    funcs = [count for (_, count) in cov['functions'].values()]
+    branches = [c for counts in cov['branches'].values() for c in counts]
+    return (len(lines), sum(1 for c in lines if c > 0),
+            len(funcs), sum(1 for c in funcs if c > 0),
+            len(branches), sum(1 for c in branches if c > 0))
+
+def write_lcov(merged, path, test_name=''):
+    """Writes merged coverage as an lcov tracefile (for genhtml)"""
+    with open(path + '.tmp', 'w') as f:
+        for source in sorted(merged):
+            cov = merged[source]
+            f.write('TN:{}\nSF:{}\n'.format(test_name, source))
+            funcs = sorted(cov['functions'].items(),
+                           key=lambda item: (item[1][0], item[0]))
+            for (name, (start, _)) in funcs:
+                f.write('FN:{},{}\n'.format(start, name))
+            for (name, (_, count)) in funcs:
+                f.write('FNDA:{},{}\n'.format(count, name))
+            f.write('FNF:{}\nFNH:{}\n'.format(
+                    len(funcs), sum(1 for (_, (_, c)) in funcs if c > 0)))
+            num_branches = 0
+            hit_branches = 0
+            for num in sorted(cov['branches'], key=int):
+                for (idx, count) in enumerate(cov['branches'][num]):
+                    f.write('BRDA:{},0,{},{}\n'.format(
+                            num, idx, count if count >= 0 else '-'))
+                    num_branches += 1
+                    hit_branches += count > 0
+            f.write('BRF:{}\nBRH:{}\n'.format(num_branches, hit_branches))
+            lines = sorted(cov['lines'].items(), key=lambda item: int(item[0]))
+            for (num, count) in lines:
+                f.write('DA:{},{}\n'.format(num, count))
+            f.write('LF:{}\nLH:{}\nend_of_record\n'.format(
+                    len(lines), sum(1 for (_, c) in lines if c > 0)))
+    os.rename(path + '.tmp', path)
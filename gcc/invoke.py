@@ -5,6 +5,11 @@ import sys
 import argparse
 import os, os.path, stat
 import re
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict
 if sys.version_info[0] < 3:
     import cStringIO as io
 else:
@@ -40,11 +45,34 @@ class InvocationParams(object):
         pass
 
 
+class CompileResult(object):
+    def __init__(self, returncode, stdout, stderr, elapsed, timed_out=False):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    @property
+    def is_ice(self):
+        return 'internal compiler error' in self.stderr
+
+
 class CompilerInvoker(object):
     def __init__(self, path):
         self._conf = None
         self._path = path
         self._cmd = sh.Command(path)
+        # Name of the installation directory (set by CompilerList)
+        self.install_name = None
+
+    @property
+    def path(self):
+        return self._path
 
     @property
     def frontend(self):
@@ -73,9 +101,38 @@ class CompilerInvoker(object):
         stderr.close()
         return result
 
-    def compile(self, source, args, need_output = False):
-        if not need_output:
-            args.append
+    def compile(self, source, args, timeout=None):
+        """Runs the compiler with arguments args on source (which can be
+        None, if args already contain the input), returns CompileResult.
+        The compiler is killed after timeout seconds"""
+        cmd = [self._path] + list(args)
+        if source is not None:
+            cmd.append(source)
+        start = time.time()
+        # A new session: the compiler proper (which keeps the pipes open) is
+        # killed together with the driver
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, preexec_fn=os.setsid)
+        timed_out = []
+        timer = None
+        if timeout is not None:
+            def kill():
+                if proc.returncode is not None:
+                    return
+                timed_out.append(True)
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+        (stdout, stderr) = proc.communicate()
+        if timer is not None:
+            timer.cancel()
+        return CompileResult(proc.returncode,
+                             stdout.decode('utf-8', 'replace'),
+                             stderr.decode('utf-8', 'replace'),
+                             time.time() - start, bool(timed_out))
 
     @property
     def configuration(self):
@@ -88,7 +145,10 @@ class CompilerInvoker(object):
 
 
 class GCCInvoker(CompilerInvoker):
-    _FULL_VER_RE = re.compile(r'^(gcc|g\+\+)\s+\(GCC\)\s+([0-9\.]+)(?:\s+(\d+))?.*$')
+    # Vendor builds print something else instead of "(GCC)", e.g.:
+    # "x86_64-linux-gnu-gcc-12 (Debian 12.2.0-14) 12.2.0"
+    _FULL_VER_RE = re.compile(r'^\S*?(gcc|g\+\+)(?:-[0-9.]+)?\s+\([^)]*\)\s+'
+                              r'([0-9\.]+)(?:\s+(\d+))?.*$')
 
     def __init__(self, path):
         CompilerInvoker.__init__(self, path)
@@ -101,9 +161,6 @@ class GCCInvoker(CompilerInvoker):
         if m.group(3) is not None:
             self._date = m.group(3)
 
-    def compile(path, dialect):
-        return
-
     @property
     def family(self):
         return FAMILY_GCC
@@ -138,39 +195,45 @@ class ClangInvoker(CompilerInvoker):
         return self._revision
 
 class CompilerList:
+    """Compilers installed into subdirectories of search paths (such as
+    cfg.install_dir). Each compiler found is tagged with the name of its
+    installation directory (install_name), e.g., 'gcc-6-latest-fdo'"""
+
     def __init__(self):
         self._compilers = []
         self._bin_names = re.compile(r'^(gcc|g\+\+|clang).*$')
-        self._gcc_re = re.compile(r'^(gcc|g\+\+)\s\(GCC\).*$')
         self._clang_re = re.compile(r'^clang\s.*$')
 
-    def _check_dir(env, self, path):
+    def _check_dir(self, env, path, name, verbose=False):
         con = env
         bin_path = os.path.join(path, 'bin')
         if not os.path.isdir(bin_path):
             return
-        for name in os.listdir(bin_path):
-            full_path = os.path.join(bin_path, name)
+        for bin_name in sorted(os.listdir(bin_path)):
+            full_path = os.path.join(bin_path, bin_name)
             if os.path.isfile(full_path) and os.access(full_path, os.X_OK) and \
-                                                self._bin_names.match(name):
+                                                self._bin_names.match(bin_name):
                 cmd = sh.Command(full_path)
                 try:
                     ver = cmd('--version')
                     lines = ver.split('\n')
                     line1 = lines[0].strip()
                     compiler = None
-                    if self._gcc_re.match(line1):
+                    if GCCInvoker._FULL_VER_RE.match(line1):
                         compiler = GCCInvoker(full_path)
                     elif self._clang_re.match(line1):
                         compiler = ClangInvoker(full_path)
 
                     if compiler:
+                        compiler.install_name = name
+                        self._compilers.append(compiler)
                         con.ok('Found: {0}'.format(compiler))
-                        con.info(compiler.configuration + '\n')
+                        if verbose:
+                            con.info(compiler.configuration + '\n')
                 except sh.ErrorReturnCode:
                     continue
 
-    def discover_versions(env, self, search_paths):
+    def discover_versions(self, env, search_paths, verbose=False):
         con = env
         if isinstance(search_paths, str):
             search_paths = [ search_paths ]
@@ -178,18 +241,19 @@ class CompilerList:
             norm_path = os.path.normpath(path)
             if not os.path.isdir(norm_path):
                 con.warn("Directory '{0}' does not exist!".format(norm_path))
-            for name in os.listdir(norm_path):
+                continue
+            for name in sorted(os.listdir(norm_path)):
                 full_path = os.path.realpath(os.path.join(norm_path, name))
                 if not os.path.isdir(full_path):
                     continue
                 if 'gcc' in name or 'clang' in name:
                     con.info("Checking '{0}'".format(full_path))
-                    self._check_dir(full_path)
+                    self._check_dir(env, full_path, name, verbose)
+
     @property
-    def comilers(self):
+    def compilers(self):
         return self._compilers[:]
 
-    @property
     def get_by_family(self, family):
         return [comp for comp in self._compilers if comp.family == family]
 
@@ -200,3 +264,82 @@ class CompilerList:
     @property
     def llvm_compilers(self):
         return self.get_by_family(FAMILY_CLANG)
+
+    def get_drivers(self, family=FAMILY_GCC):
+        """Returns {install_name: compiler} for the main (C) drivers of the
+        given family, i.e., 'gcc' or 'clang' (but not 'g++' or 'gcc-ar')"""
+        driver = 'gcc' if family == FAMILY_GCC else 'clang'
+        return OrderedDict((comp.install_name, comp)
+                           for comp in self.get_by_family(family)
+                           if os.path.basename(comp.path) == driver)
+
+def resolve_compiler(spec, install_dir=None, driver='gcc'):
+    """Returns path to the compiler driver specified by spec: either a path
+    to the driver, an installation prefix (or its bin directory), or a name
+    of a subdirectory of install_dir (e.g., 'gcc-6-latest'). Returns None if
+    the compiler is not found"""
+    candidates = [spec, os.path.join(spec, driver),
+                  os.path.join(spec, 'bin', driver)]
+    if install_dir is not None:
+        candidates.append(os.path.join(install_dir, spec, 'bin', driver))
+    if os.sep not in spec:
+        # Search PATH
+        candidates += [os.path.join(path, spec) for path in
+                       os.environ.get('PATH', '').split(os.pathsep) if path]
+    for path in candidates:
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return os.path.abspath(path)
+    return None
+
+def compiler_label(compiler):
+    """Returns a short name of the compiler suitable for file names, e.g.,
+    'gcc-6.0.0-20160424'"""
+    label = '{}-{}'.format(compiler.family.lower(), compiler.base_version_str)
+    if compiler.build_str:
+        label += '-' + re.sub(r'[^\w.-]+', '_', compiler.build_str)
+    return label
+
+def resolve_compilers(env, specs, install_dir=None):
+    """Resolves compiler specs (see resolve_compiler), reports the
+    compilers. Returns the list of (path, GCCInvoker, label); labels are
+    made unique. Stops with an error if a compiler is not found"""
+    result = []
+    for spec in specs:
+        path = resolve_compiler(spec, install_dir)
+        if path is None:
+            env.fatal_error('Compiler {} not found'.format(spec))
+        compiler = GCCInvoker(path)
+        env.info('Using {}: {}'.format(compiler, path))
+        label = compiler_label(compiler)
+        labels = [item[2] for item in result]
+        if label in labels:
+            label += '-{}'.format(len(labels) + 1)
+        result.append((path, compiler, label))
+    return result
+
+# Pool workers of compile_report: (compilers, report option, parser)
+_report_worker = None
+
+def init_report_worker(paths, option, parse):
+    """Pool initializer for compile_report: paths are the compilers, option
+    enables the report (e.g., '-ftime-report'), parse extracts it from
+    stderr"""
+    global _report_worker
+    _report_worker = ([GCCInvoker(path) for path in paths], option, parse)
+
+def compile_report(job):
+    """Compiles a file (job is (compiler index, path, flags, timeout)) with
+    the report option. Returns (compiler index, path, report, error)"""
+    (idx, path, flags, timeout) = job
+    (compilers, option, parse) = _report_worker
+    res = compilers[idx].compile(path, flags + [option, '-o', os.devnull],
+                                 timeout)
+    if res.timed_out:
+        return (idx, path, None, 'timeout')
+    if not res.ok:
+        lines = res.stderr.strip().splitlines()
+        return (idx, path, None, lines[-1] if lines else 'error')
+    report = parse(res.stderr)
+    if not report:
+        return (idx, path, None, 'no {} output'.format(option))
+    return (idx, path, report, None)
@@ -0,0 +1,247 @@
+# Parsing and aggregation of -fmem-report output. The detailed per allocation
+# site tables are printed only by compilers configured with
+# --enable-gather-detailed-mem-stats (build.py --mem-stats)
+
+from __future__ import print_function, division
+
+import os
+import json
+import re
+from collections import OrderedDict
+
+_units = { '': 1, 'k': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3 }
+
+_dash_re = re.compile(r'^-{20,}$')
+# "1234k:", "1234k: 1.2%", "1234k:100.0%", "1234"
+_num_re = re.compile(r'^(\d+)([kMG]?)(?::(?:[\d.]+%)?)?$')
+_percent_re = re.compile(r'^:?\(?[\d.]+%\)?$')
+_column_split_re = re.compile(r'\s{2,}')
+_column_split_single_re = re.compile(r' (?=[A-Z])')
+# "Ordinary maps allocated size:          127k"
+_value_re = re.compile(r'^([A-Za-z][^:]*?):\s+(\d+)([kMG]?)\s*$')
+# Line numbers in allocation sites: "cp/lex.cc:1234 (make_node)"
+_line_num_re = re.compile(r':\d+(?= \(|$)')
+
+TOTAL = 'Total'
+
+def parse_row(line):
+    """Parses a table row: label followed by numbers (possibly with units
+    and percents) and an optional allocation type (ggc, heap). Returns
+    (label, list of values, type) or None"""
+    tokens = line.split()
+    values = []
+    kind = None
+    while tokens:
+        tok = tokens[-1]
+        m = _num_re.match(tok)
+        if m:
+            values.append(int(m.group(1)) * _units[m.group(2)])
+        elif _percent_re.match(tok) or tok == ':':
+            pass
+        elif not values and kind is None and tok.isalpha() and \
+                len(tokens) > 2:
+            kind = tok
+        else:
+            break
+        tokens.pop()
+    values.reverse()
+    if not tokens and len(values) > 1:
+        # Numeric label, e.g., size of objects
+        tokens = [line.split()[0]]
+        values = values[1:]
+    if not tokens or not values:
+        return None
+    return (' '.join(tokens), values, kind)
+
+def _is_header(line):
+    cols = _column_split_re.split(line.strip())
+    return len(cols) >= 2 and not any(c.isdigit() for c in line)
+
+def parse_mem_report(text):
+    """Parses -fmem-report output (compiler's stderr). Returns a list of
+    records (table, label, {column: value}). Values are in bytes (or
+    counts)"""
+    records = []
+    lines = text.splitlines()
+    section = None
+    table = None
+    columns = None
+    in_rows = False
+    i = 0
+    while i < len(lines):
+        line = lines[i].rstrip()
+        i += 1
+        if not line.strip():
+            table = None
+            continue
+        if _dash_re.match(line):
+            # Detailed statistics: dash line, header, dash line, rows, dash
+            # line, totals, dash line
+            if i + 1 < len(lines) and _dash_re.match(lines[i + 1].strip()) \
+                    and _is_header(lines[i]):
+                cols = _column_split_re.split(lines[i].strip())
+                table = cols[0]
+                # Some column names are separated by a single space, e.g.,
+                # "Leak items Peak items"
+                columns = [c for col in cols[1:]
+                           for c in _column_split_single_re.split(col)
+                           if c != 'Type']
+                in_rows = True
+                i += 2
+            elif in_rows:
+                # Skip totals (the columns are not aligned with the header,
+                # the totals are recomputed from rows anyway)
+                while i < len(lines) and not _dash_re.match(lines[i].strip()):
+                    i += 1
+                i += 1
+                in_rows = False
+                table = None
+            continue
+        if table is None and _is_header(line) and i < len(lines) and \
+                parse_row(lines[i]) is not None:
+            # Simple table, e.g., "Size  Allocated  Used  Overhead"
+            cols = _column_split_re.split(line.strip())
+            table = section or cols[0]
+            columns = cols[1:]
+            continue
+        m = _value_re.match(line) if table is None else None
+        if m:
+            records.append((section or 'General', m.group(1),
+                            { 'value': int(m.group(2)) * _units[m.group(3)] }))
+            continue
+        row = parse_row(line) if table is not None else None
+        if row is None:
+            if not line.startswith('#') and ':' not in line:
+                section = line.strip()
+            table = None
+            continue
+        (label, values, kind) = row
+        if in_rows and label == TOTAL:
+            continue
+        names = columns
+        if len(values) > len(columns):
+            names = columns + ['col{}'.format(n)
+                               for n in range(len(columns), len(values))]
+        records.append((table, label, dict(zip(names, values))))
+    return records
+
+def normalize_site(label):
+    """Removes line numbers from an allocation site (they change between
+    versions)"""
+    return _line_num_re.sub('', label)
+
+
+class MemReportStore(object):
+    """-fmem-report statistics of a corpus compiled by a single compiler,
+    summed over files: {table: {site: {column: value}}}"""
+
+    def __init__(self, label=None, compiler=None, version=None, flags=None):
+        self.label = label
+        self.compiler = compiler
+        self.version = version
+        self.flags = flags or []
+        self.files = []
+        self.failed = {}
+        self.tables = OrderedDict()
+        self.columns = OrderedDict()    # table -> list of columns
+
+    def add(self, fname, records, keep_lines=False):
+        self.files.append(fname)
+        for (table, site, values) in records:
+            if not keep_lines:
+                site = normalize_site(site)
+            sites = self.tables.setdefault(table, OrderedDict())
+            cols = self.columns.setdefault(table, [])
+            totals = sites.setdefault(site, {})
+            for (col, value) in values.items():
+                if col not in cols:
+                    cols.append(col)
+                totals[col] = totals.get(col, 0) + value
+
+    def add_failure(self, fname, message):
+        self.failed[fname] = message
+
+    def save(self, path):
+        data = { 'label': self.label, 'compiler': self.compiler,
+                 'version': self.version, 'flags': self.flags,
+                 'files': self.files, 'failed': self.failed,
+                 'columns': self.columns, 'tables': self.tables }
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=1)
+        os.rename(path + '.tmp', path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'r') as f:
+            data = json.load(f, object_pairs_hook=OrderedDict)
+        store = MemReportStore(data['label'], data['compiler'],
+                               data['version'], data['flags'])
+        store.files = data['files']
+        store.failed = data['failed']
+        store.columns = data['columns']
+        store.tables = data['tables']
+        return store
+
+    def find_column(self, table, name):
+        """Returns the column of table matching name (case-insensitive), or
+        the first column if name is None"""
+        cols = self.columns.get(table, [])
+        if name is None:
+            return cols[0] if cols else None
+        for col in cols:
+            if col.lower() == name.lower():
+                return col
+        return None
+
+    def ranked(self, table, column):
+        """Returns [(value, site)] for table sorted by column (descending),
+        without the total (if the table has one)"""
+        sites = self.tables.get(table, {})
+        return sorted([(values.get(column, 0), site)
+                       for (site, values) in sites.items() if site != TOTAL],
+                      key=lambda r: (-r[0], r[1]))
+
+
+class Change(object):
+    def __init__(self, table, site, old, new):
+        self.table = table
+        self.site = site
+        self.old = old
+        self.new = new
+
+    @property
+    def delta(self):
+        return self.new - self.old
+
+    @property
+    def percent(self):
+        if self.old == 0:
+            return float('inf') if self.new else 0.0
+        return 100.0 * self.delta / self.old
+
+
+def compare_stores(old, new, column=None, threshold=5.0, min_change=0):
+    """Compares two stores. For each table the given column (the first one
+    by default) is compared for all sites. Returns {table: [changes]}, only
+    changes exceeding threshold percent and min_change are included (sorted
+    by absolute delta)"""
+    result = OrderedDict()
+    tables = list(old.tables) + [t for t in new.tables if t not in old.tables]
+    for table in tables:
+        col = old.find_column(table, column) or new.find_column(table, column)
+        if col is None:
+            continue
+        sites_old = old.tables.get(table, {})
+        sites_new = new.tables.get(table, {})
+        changes = []
+        for site in set(sites_old) | set(sites_new):
+            change = Change(table, site,
+                            sites_old.get(site, {}).get(col, 0),
+                            sites_new.get(site, {}).get(col, 0))
+            if abs(change.delta) >= max(min_change, 1) and \
+                    abs(change.percent) > threshold:
+                changes.append(change)
+        if changes:
+            changes.sort(key=lambda c: (-abs(c.delta), c.site))
+            result[(table, col)] = changes
+    return result
@@ -0,0 +1,35 @@
+# Messages over stream sockets, used by the distributed build (distbuild.py)
+# and the build queue (buildqueue.py). A message consists of the lengths of
+# the JSON header and of the binary payload, the header and the payload.
+
+from __future__ import print_function
+
+import json
+import struct
+
+_frame = struct.Struct('!II')
+
+def send_msg(sock, header, payload=b''):
+    """Sends a message, returns its size in bytes"""
+    data = json.dumps(header).encode('utf-8')
+    sock.sendall(_frame.pack(len(data), len(payload)) + data)
+    if payload:
+        sock.sendall(payload)
+    return _frame.size + len(data) + len(payload)
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError('Connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def recv_msg(sock):
+    """Receives a message, returns (header, payload, size in bytes)"""
+    (header_len, payload_len) = _frame.unpack(_recv_exact(sock, _frame.size))
+    header = json.loads(_recv_exact(sock, header_len).decode('utf-8'))
+    payload = _recv_exact(sock, payload_len)
+    return (header, payload, _frame.size + header_len + payload_len)
@@ -0,0 +1,211 @@
+# Cache of prebuilt prerequisite libraries of GCC (gmp, mpfr, mpc and isl).
+# Instead of building in-tree copies of the libraries in each build (and in
+# each bootstrap stage), the versions required by the source tree (listed in
+# contrib/download_prerequisites) are built once with the stage 0 compiler,
+# installed into the cache and passed to configure (--with-gmp, etc.).
+#
+# An installation is keyed by the library version, the identity of the stage
+# 0 compiler (see compiler_identity in common.py), the host and the keys of
+# the libraries it depends on. Libraries are static and position-independent, so they can be
+# linked into the compiler regardless of the build type.
+
+from __future__ import print_function
+
+import os, os.path
+import errno
+import fcntl
+import hashlib
+import json
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+from collections import OrderedDict
+
+from .common import compiler_identity, run_logged
+
+pjoin = os.path.join
+
+# In build order
+LIBRARIES = ['gmp', 'mpfr', 'mpc', 'isl']
+DEPENDS = { 'gmp': [], 'mpfr': ['gmp'], 'mpc': ['gmp', 'mpfr'],
+            'isl': ['gmp'] }
+# configure options which point a library to its dependencies
+_dep_options = { 'gmp': '--with-gmp={}', 'mpfr': '--with-mpfr={}' }
+_isl_dep_options = { 'gmp': '--with-gmp-prefix={}' }
+
+BASE_URL = 'http://gcc.gnu.org/pub/gcc/infrastructure/'
+DEFAULT_FLAGS = '-O2 -pipe'
+# Changes of the build procedure invalidate all installations
+KEY_VERSION = '1'
+
+# Both the old (MPFR=mpfr-2.4.2) and the new (mpfr='mpfr-3.1.4.tar.bz2')
+# formats of download_prerequisites
+_version_re = re.compile(r'^\s*(gmp|mpfr|mpc|isl)\s*=\s*[\'"]?'
+                         r'((?:gmp|mpfr|mpc|isl)-[0-9][0-9.]*[0-9])'
+                         r'(\.tar\.\w+)?', re.IGNORECASE)
+
+def required_versions(source_dir):
+    """Returns an OrderedDict: library -> (name with version, tarball name
+    or None) of libraries listed in contrib/download_prerequisites"""
+    path = pjoin(source_dir, 'contrib', 'download_prerequisites')
+    found = {}
+    with open(path, 'r') as f:
+        for line in f:
+            match = _version_re.match(line)
+            if match:
+                lib = match.group(1).lower()
+                tarball = match.group(3) and match.group(2) + match.group(3)
+                found[lib] = (match.group(2), tarball)
+    return OrderedDict((lib, found[lib]) for lib in LIBRARIES if lib in found)
+
+def in_tree_libraries(source_dir):
+    """Returns prerequisites present in the source tree (e.g., symlinks
+    created by download_prerequisites): configure prefers them to
+    --with-gmp and other options"""
+    return [lib for lib in LIBRARIES if os.path.exists(pjoin(source_dir, lib))]
+
+
+class PrereqCache(object):
+    """The cache directory contains installations (host/name-hash),
+    downloaded tarballs (downloads) and build logs of failed builds
+    (logs)"""
+
+    def __init__(self, env, path, cc, flags=DEFAULT_FLAGS):
+        self._env = env
+        self.path = os.path.abspath(path)
+        self.cc = cc
+        self.flags = flags
+        self._identity = None
+
+    def _makedirs(self, path):
+        try:
+            os.makedirs(path)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+
+    @property
+    def identity(self):
+        """(identity, version, host) of the stage 0 compiler"""
+        if self._identity is None:
+            (identity, version) = compiler_identity(self.cc)
+            host = subprocess.check_output([self.cc, '-dumpmachine']).decode(
+                        'utf-8', 'replace').strip()
+            self._identity = (identity, version, host)
+        return self._identity
+
+    def key(self, name, dep_keys):
+        h = hashlib.sha1()
+        h.update('{}\n{}\n{}\n{}\n{}\n'.format(
+                    KEY_VERSION, name, self.identity[0], self.identity[2],
+                    self.flags).encode('utf-8'))
+        for dep_key in dep_keys:
+            h.update(dep_key.encode('utf-8'))
+        return h.hexdigest()
+
+    def prefix(self, name, key):
+        return pjoin(self.path, self.identity[2], '{}-{}'.format(name,
+                                                                key[:12]))
+
+    def _get_tarball(self, name, tarball):
+        """Returns the path to the tarball of library name, downloads it if
+        needed"""
+        downloads = pjoin(self.path, 'downloads')
+        self._makedirs(downloads)
+        candidates = [tarball] if tarball else \
+                     [name + '.tar.bz2', name + '.tar.gz']
+        for fname in candidates:
+            path = pjoin(downloads, fname)
+            if os.path.isfile(path):
+                return path
+        for fname in candidates:
+            path = pjoin(downloads, fname)
+            try:
+                self._env.invoke('wget', BASE_URL + fname, '-O',
+                                 path + '.tmp')
+            except Exception:
+                if os.path.exists(path + '.tmp'):
+                    os.unlink(path + '.tmp')
+                continue
+            os.rename(path + '.tmp', path)
+            return path
+        raise IOError('Failed to download {} from {}'.format(name, BASE_URL))
+
+    def _build(self, lib, name, tarball, prefix, deps, jobs):
+        """Builds library lib (name is the name with version) and installs it
+        into prefix; deps maps dependencies to their prefixes"""
+        con = self._env
+        tmp_dir = tempfile.mkdtemp(prefix='build-', dir=self.path)
+        try:
+            con.info('Building {}'.format(name))
+            tar = tarfile.open(self._get_tarball(name, tarball))
+            tar.extractall(tmp_dir)
+            tar.close()
+            src_dir = pjoin(tmp_dir, name)
+            build_dir = pjoin(tmp_dir, 'build')
+            dest_dir = pjoin(tmp_dir, 'dest')
+            os.makedirs(build_dir)
+            options = _isl_dep_options if lib == 'isl' else _dep_options
+            configure = [pjoin(src_dir, 'configure'), '--prefix=' + prefix,
+                         '--disable-shared', '--enable-static',
+                         '--with-pic', 'CC=' + self.cc,
+                         'CFLAGS=' + self.flags] + \
+                        [options[dep].format(deps[dep])
+                         for dep in DEPENDS[lib]]
+            log_path = pjoin(tmp_dir, 'build.log')
+            for cmd in [configure, ['make', '-j', str(jobs)],
+                        ['make', 'install', 'DESTDIR=' + dest_dir]]:
+                (status, _, _) = run_logged(cmd, log_path + '.part',
+                                            cwd=build_dir)
+                with open(log_path, 'a') as log:
+                    with open(log_path + '.part', 'r') as part:
+                        shutil.copyfileobj(part, log)
+                if status != 0:
+                    logs = pjoin(self.path, 'logs')
+                    self._makedirs(logs)
+                    saved = pjoin(logs, os.path.basename(prefix) + '.log')
+                    shutil.copyfile(log_path, saved)
+                    raise RuntimeError('Failed to build {}, see {}'.format(
+                                        name, saved))
+            self._makedirs(os.path.dirname(prefix))
+            os.rename(dest_dir + prefix, prefix)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def ensure(self, versions, jobs):
+        """Builds missing libraries (versions as returned by
+        required_versions). Returns an OrderedDict: library -> prefix"""
+        self._makedirs(self.path)
+        result = OrderedDict()
+        keys = {}
+        with open(pjoin(self.path, 'lock'), 'a') as lock:
+            # Concurrent builds wait for each other instead of building the
+            # same library twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                for (lib, (name, tarball)) in versions.items():
+                    missing = [dep for dep in DEPENDS[lib]
+                               if dep not in result]
+                    if missing:
+                        raise RuntimeError('{} requires {}'.format(
+                                            name, ', '.join(missing)))
+                    keys[lib] = self.key(name, [keys[dep]
+                                                for dep in DEPENDS[lib]])
+                    prefix = self.prefix(name, keys[lib])
+                    if not os.path.isdir(prefix):
+                        self._build(lib, name, tarball, prefix, result, jobs)
+                        with open(pjoin(prefix, 'prereq.json'), 'w') as f:
+                            json.dump(OrderedDict([
+                                ('library', name),
+                                ('compiler', self.identity[1]),
+                                ('host', self.identity[2]),
+                                ('flags', self.flags),
+                                ('depends', [os.path.basename(result[dep])
+                                             for dep in DEPENDS[lib]])]),
+                                f, indent=1)
+                    result[lib] = prefix
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return result
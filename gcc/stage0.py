@@ -0,0 +1,219 @@
+# Automatic selection of the stage 0 compiler: installed compilers are
+# benchmarked by compiling a few heavy files of the GCC source tree (with the
+# command line used by an existing build and flags of the build type). The
+# ranking is cached per GCC version, the fastest compiler which compiled all
+# files is used for the build.
+
+from __future__ import print_function, division
+
+import os, os.path
+import json
+import shlex
+import subprocess
+import tempfile
+import time
+from collections import OrderedDict
+
+from .bench import measure, median
+from .invoke import CompilerList, GCCInvoker, resolve_compiler
+
+pjoin = os.path.join
+
+# Heavy translation units of gcc/ (.c before GCC 12, .cc since)
+DEFAULT_FILES = ['fold-const', 'expr', 'dwarf2out']
+DEFAULT_REPEAT = 3
+COMPILE_TIMEOUT = 600
+
+SYSTEM = 'system'
+
+# The compile command of gcc/Makefile (COMPILE.base without "-o $@")
+_show_command_mk = '''
+show-stage0-command:
+\t@echo $(or $(COMPILER),$(CC)) -c $(ALL_COMPILERFLAGS) $(ALL_CPPFLAGS)
+'''
+
+
+class Candidate(object):
+    """A stage 0 compiler: C and C++ drivers in the same directory"""
+
+    def __init__(self, name, cc, cxx, version):
+        self.name = name
+        self.cc = cc
+        self.cxx = cxx
+        self.version = version
+
+    def to_json(self):
+        return OrderedDict([('name', self.name), ('cc', self.cc),
+                            ('cxx', self.cxx), ('version', self.version)])
+
+
+def find_candidates(env, install_dir):
+    """Returns GCC installations in install_dir (found by CompilerList),
+    which have both gcc and g++, and the system compiler"""
+    result = []
+    comp_list = CompilerList()
+    if install_dir is not None:
+        comp_list.discover_versions(env, install_dir)
+    for (name, compiler) in comp_list.get_drivers().items():
+        cxx = pjoin(os.path.dirname(compiler.path), 'g++')
+        if os.path.isfile(cxx):
+            result.append(Candidate(name, compiler.path, cxx,
+                                    compiler.full_version_str))
+    cc = resolve_compiler('gcc')
+    cxx = resolve_compiler('g++')
+    if cc is not None and cxx is not None and \
+            all(os.path.realpath(cc) != os.path.realpath(cand.cc)
+                for cand in result):
+        result.append(Candidate(SYSTEM, cc, cxx,
+                                GCCInvoker(cc).full_version_str))
+    return result
+
+def make_dir_of(build_dir):
+    """Returns the directory of the compiler built by the stage 0 compiler
+    (stage1-gcc after a bootstrap) or None, if it is not configured"""
+    for name in ['stage1-gcc', 'gcc']:
+        path = pjoin(build_dir, name)
+        if os.path.isfile(pjoin(path, 'Makefile')):
+            return path
+    return None
+
+def get_compile_command(make_dir):
+    """Returns the command line used for compiling files of gcc/ (as a
+    list)"""
+    (fd, mk_path) = tempfile.mkstemp(suffix='.mk')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(_show_command_mk)
+        out = subprocess.check_output(['make', '-s', '-C', make_dir, '-f',
+                                       'Makefile', '-f', mk_path,
+                                       'show-stage0-command'])
+    finally:
+        os.unlink(mk_path)
+    return shlex.split(out.decode('utf-8').strip().splitlines()[-1])
+
+def find_source_files(source_dir, names=DEFAULT_FILES):
+    result = []
+    for name in names:
+        for ext in ['.cc', '.c']:
+            path = pjoin(source_dir, 'gcc', name + ext)
+            if os.path.isfile(path):
+                result.append(path)
+                break
+    return result
+
+def adjust_command(cmd, candidate, flags):
+    """Replaces the compiler and optimization/debug flags of cmd"""
+    compiler = candidate.cxx if '++' in os.path.basename(cmd[0]) \
+               else candidate.cc
+    args = [arg for arg in cmd[1:] if not arg.startswith(('-O', '-g'))]
+    return [compiler] + shlex.split(flags) + args
+
+
+class Stage0Ranking(object):
+    """Cached results of benchmarks: {GCC version: {'flags', 'date',
+    'files', 'compilers': [{name, cc, cxx, version, time, error}]}}.
+    Compilers are sorted by time, failed ones are at the end"""
+
+    def __init__(self, path):
+        self._path = path
+        self._data = {}
+        if path is not None and os.path.isfile(path):
+            with open(path, 'r') as f:
+                self._data = json.load(f, object_pairs_hook=OrderedDict)
+
+    def get(self, version, flags, candidates):
+        """Returns the ranking for the GCC version, or None if it is missing,
+        outdated (different flags or set of candidate compilers) or no
+        compiler succeeded"""
+        entry = self._data.get(version)
+        if entry is None or entry['flags'] != flags or \
+                all(comp['time'] is None for comp in entry['compilers']):
+            return None
+        ranked = set((comp['name'], comp['cc']) for comp in entry['compilers'])
+        if ranked != set((cand.name, cand.cc) for cand in candidates):
+            return None
+        return entry
+
+    def set(self, version, entry):
+        self._data[version] = entry
+
+    def save(self):
+        if self._path is None:
+            return
+        dirname = os.path.dirname(os.path.abspath(self._path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(self._path + '.tmp', 'w') as f:
+            json.dump(self._data, f, indent=1)
+        os.rename(self._path + '.tmp', self._path)
+
+
+def benchmark(env, candidates, make_dir, files, flags,
+              repeat=DEFAULT_REPEAT):
+    """Compiles files with each candidate, returns the ranking entry. Time
+    of a compiler is the sum of median CPU times of the files"""
+    con = env
+    cmd = get_compile_command(make_dir)
+    results = []
+    for cand in candidates:
+        con.info('Benchmarking {} ({})'.format(cand.name, cand.version))
+        result = cand.to_json()
+        result['time'] = None
+        result['error'] = None
+        total = 0.0
+        for path in files:
+            full_cmd = adjust_command(cmd, cand, flags) + [path, '-o',
+                                                           os.devnull]
+            times = []
+            for _ in range(repeat):
+                (sample, error) = measure(full_cmd, COMPILE_TIMEOUT, make_dir)
+                if sample is None:
+                    result['error'] = '{}: {}'.format(os.path.basename(path),
+                                                      error)
+                    break
+                times.append(sample.cpu)
+            if result['error'] is not None:
+                con.warn('{} is not usable: {}'.format(cand.name,
+                                                       result['error']))
+                break
+            total += median(times)
+        else:
+            result['time'] = total
+            con.info('{}: {:.2f}s'.format(cand.name, total))
+        results.append(result)
+    results.sort(key=lambda r: (r['time'] is None, r['time']))
+    return OrderedDict([('flags', flags),
+                        ('date', time.strftime('%Y-%m-%d %H:%M:%S')),
+                        ('files', [os.path.basename(path) for path in files]),
+                        ('compilers', results)])
+
+def format_ranking(entry):
+    lines = []
+    best = None
+    for comp in entry['compilers']:
+        if comp['time'] is None:
+            lines.append('  {:<30} {:<28} failed: {}'.format(
+                    comp['name'], comp['version'], comp['error']))
+            continue
+        if best is None:
+            best = comp['time']
+        lines.append('  {:<30} {:<28} {:>8.2f}s {:>6.2f}x'.format(
+                comp['name'], comp['version'], comp['time'],
+                comp['time'] / best if best else 1.0))
+    return '\n'.join(lines)
+
+def select(entry, exclude=None):
+    """Returns the fastest usable compiler from the ranking (as a dictionary)
+    or None. exclude is a directory (an installation prefix) which must not
+    contain the compiler"""
+    for comp in entry['compilers']:
+        if comp['time'] is None or not os.path.isfile(comp['cc']) or \
+                not os.path.isfile(comp['cxx']):
+            continue
+        if exclude is not None:
+            prefix = os.path.join(os.path.realpath(exclude), '')
+            bin_dir = os.path.realpath(os.path.dirname(comp['cc']))
+            if os.path.join(bin_dir, '').startswith(prefix):
+                continue
+        return comp
+    return None
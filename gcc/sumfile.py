@@ -0,0 +1,184 @@
+# Parsing and comparison of dejagnu .sum files
+
+from __future__ import print_function
+
+import os, os.path
+import io
+import re
+import sys
+from collections import OrderedDict
+
+try:
+    _intern = sys.intern
+except AttributeError:
+    _intern = intern
+
+STATUSES = ['PASS', 'XFAIL', 'KFAIL', 'KPASS', 'UNSUPPORTED', 'UNTESTED',
+            'FAIL', 'XPASS', 'UNRESOLVED', 'ERROR']
+# Statuses which indicate a problem
+BAD_STATUSES = set(['FAIL', 'XPASS', 'UNRESOLVED', 'ERROR'])
+
+_statuses = set(STATUSES)
+# Tests matching these are often unstable (timing, debug info quality)
+default_flaky_patterns = [r'^(gcc|g\+\+)\.dg/guality/', r'/tsan/']
+
+# "Running /src/gcc/testsuite/gcc.dg/dg.exp ..."
+_running_re = re.compile(r'^Running (\S+\.exp) \.\.\.')
+_target_prefix = 'Running target '
+_timeout_prefix = 'WARNING: program timed out'
+_version_re = re.compile(r'\sversion \d+\.\d+')
+
+def _open_sum(path):
+    if sys.version_info[0] < 3:
+        return open(path, 'r')
+    return io.open(path, 'r', errors='replace')
+
+def exp_name(path):
+    """Returns the name of an .exp file relative to the testsuite directory,
+    e.g., 'gcc.dg/dg.exp'"""
+    idx = path.rfind('/testsuite/')
+    return path[idx + len('/testsuite/'):] if idx != -1 else path
+
+
+class SumFile(object):
+    """Results of a single .sum file. Results are grouped by (target board,
+    .exp file): {group: {test name: status}}. Names of tests reported
+    several times within a group get a suffix: ' [2]', ' [3]', etc. timed_out
+    is the set of (group, test) which were preceded by a timeout warning"""
+
+    def __init__(self, path):
+        self.path = path
+        self.tool = None
+        self.groups = OrderedDict()
+        self.timed_out = set()
+        self.num_results = 0
+        # "/build/gcc/xgcc  version 6.0.0 20160424 (experimental) (GCC)"
+        self.version_line = None
+
+    def parse(self):
+        target = ''
+        group = None
+        tests = None
+        timeout = False
+        for line in _open_sum(self.path):
+            status, sep, name = line.partition(': ')
+            if sep and status in _statuses:
+                if tests is None:
+                    group = (target, '')
+                    tests = self.groups.setdefault(group, {})
+                name = name.rstrip()
+                if name in tests:
+                    n = 2
+                    while '{} [{}]'.format(name, n) in tests:
+                        n += 1
+                    name = '{} [{}]'.format(name, n)
+                name = _intern(name)
+                tests[name] = _intern(status)
+                self.num_results += 1
+                if timeout:
+                    self.timed_out.add((group, name))
+                    timeout = False
+            elif line.startswith(_timeout_prefix):
+                timeout = True
+            elif line.startswith('Running '):
+                if line.startswith(_target_prefix):
+                    target = line[len(_target_prefix):].strip()
+                    tests = None
+                    continue
+                m = _running_re.match(line)
+                if m:
+                    group = (target, exp_name(m.group(1)))
+                    tests = self.groups.setdefault(group, {})
+            elif self.tool is None and line.startswith('\t\t=== ') and \
+                    line.rstrip().endswith(' tests ==='):
+                self.tool = line.strip()[4:-10]
+            elif self.version_line is None and ' version ' in line and \
+                    _version_re.search(line):
+                self.version_line = line.strip()
+        return self
+
+
+def parse_sum(path):
+    return SumFile(path).parse()
+
+
+class GroupDiff(object):
+    """Differences within a group (target board, .exp file). Each list
+    contains (test, old status, new status), statuses of new and removed
+    tests are None on the missing side"""
+
+    def __init__(self, group):
+        self.group = group
+        self.new_failures = []
+        self.fixed = []
+        self.new_tests = []
+        self.removed = []
+        self.flaky = []
+
+    def __bool__(self):
+        return bool(self.new_failures or self.fixed or self.new_tests or
+                    self.removed or self.flaky)
+
+    __nonzero__ = __bool__
+
+    @property
+    def name(self):
+        (target, exp) = self.group
+        return '{} ({})'.format(exp or '(no .exp)', target or 'no target')
+
+
+def compare_sums(old, new, flaky_patterns=None):
+    """Compares two SumFile objects, returns the list of non-empty
+    GroupDiff. Changes of tests which timed out or whose names match
+    flaky_patterns (compiled regexps) are reported as flaky"""
+    flaky_patterns = flaky_patterns or []
+    result = []
+    groups = list(old.groups) + [g for g in new.groups if g not in old.groups]
+    empty = {}
+    for group in groups:
+        old_tests = old.groups.get(group, empty)
+        new_tests = new.groups.get(group, empty)
+        diff = GroupDiff(group)
+        for (name, new_status) in new_tests.items():
+            old_status = old_tests.get(name)
+            if old_status == new_status:
+                continue
+            change = (name, old_status, new_status)
+            old_bad = old_status in BAD_STATUSES
+            new_bad = new_status in BAD_STATUSES
+            if old_bad == new_bad and old_status is not None:
+                # E.g., PASS -> XFAIL, FAIL -> UNRESOLVED
+                continue
+            if (group, name) in old.timed_out or \
+                    (group, name) in new.timed_out or \
+                    any(p.search(name) for p in flaky_patterns):
+                diff.flaky.append(change)
+            elif new_bad:
+                diff.new_failures.append(change)
+            elif old_status is None:
+                diff.new_tests.append(change)
+            else:
+                diff.fixed.append(change)
+        for (name, old_status) in old_tests.items():
+            if name not in new_tests:
+                diff.removed.append((name, old_status, None))
+        for changes in [diff.new_failures, diff.fixed, diff.new_tests,
+                        diff.removed, diff.flaky]:
+            changes.sort()
+        if diff:
+            result.append(diff)
+    return result
+
+def find_sum_files(path):
+    """Returns {relative path: path} of .sum files in path (a file or a
+    directory, which is searched recursively)"""
+    if not os.path.isdir(path):
+        return OrderedDict([(os.path.basename(path), path)])
+    result = OrderedDict()
+    for (dirpath, dirnames, fnames) in os.walk(path):
+        dirnames.sort()
+        for fname in sorted(fnames):
+            if fname.endswith('.sum'):
+                full = os.path.join(dirpath, fname)
+                result[os.path.relpath(full, path)] = full
+    return result
@@ -0,0 +1,260 @@
+# Compact store of historical testsuite results.
+#
+# The store is a directory with three append-only files:
+#   names.txt    - interned test names ("tool<TAB>target<TAB>exp<TAB>test"),
+#                  the line number is the test ID
+#   runs.jsonl   - one JSON object per run (label, branch, configuration,
+#                  version, date, kind, location of results in results.bin)
+#   results.bin  - zlib-compressed results of runs. Each run is encoded as
+#                  ranges of IDs of tests which were run, followed by sorted
+#                  ID lists for each status except PASS (which is implied).
+# Since tests are interned in the order of .sum files, IDs of a run mostly
+# form a few contiguous ranges, and non-PASS results are sparse, so a run of
+# the full testsuite takes a few kilobytes.
+
+from __future__ import print_function
+
+import os, os.path
+import array
+import bisect
+import hashlib
+import json
+import re
+import zlib
+from collections import OrderedDict
+
+from .sumfile import STATUSES, BAD_STATUSES
+
+pjoin = os.path.join
+
+PASS = 'PASS'
+_other_statuses = [s for s in STATUSES if s != PASS]
+
+# "6.0.0 20160424 (experimental)", "5.3.1 20160412 (prerelease)", "5.3.0"
+_version_re = re.compile(r'version (\d+(?:\.\d+)+)(?: (\d{8}))?'
+                         r'(?: \((experimental|prerelease)\))?')
+
+def _to_bytes(arr):
+    return arr.tobytes() if hasattr(arr, 'tobytes') else arr.tostring()
+
+def _from_bytes(data):
+    arr = array.array('I')
+    if hasattr(arr, 'frombytes'):
+        arr.frombytes(data)
+    else:
+        arr.fromstring(data)
+    return arr
+
+def parse_version(line):
+    """Parses the compiler version line of a .sum file. Returns a dictionary
+    with version, date (YYYYMMDD, empty for releases), kind ('snapshot' or
+    'release') and branch ('trunk' for experimental versions, major version
+    (or major.minor, for versions before 5) otherwise)"""
+    m = _version_re.search(line or '')
+    if m is None:
+        return {}
+    (version, date, status) = m.groups()
+    nums = version.split('.')
+    if status == 'experimental':
+        branch = 'trunk'
+    elif int(nums[0]) < 5:
+        branch = '.'.join(nums[:2])
+    else:
+        branch = nums[0]
+    return { 'version': version, 'date': date or '', 'branch': branch,
+             'kind': 'snapshot' if date else 'release' }
+
+
+class RunResults(object):
+    """Decoded results of a single run"""
+
+    def __init__(self, data):
+        arr = _from_bytes(zlib.decompress(data))
+        pos = 0
+        num_ranges = arr[pos]
+        pos += 1
+        self._starts = arr[pos:pos + 2 * num_ranges:2]
+        self._ends = arr[pos + 1:pos + 2 * num_ranges:2]
+        pos += 2 * num_ranges
+        self._ids = {}
+        for status in _other_statuses:
+            count = arr[pos]
+            pos += 1
+            if count:
+                self._ids[status] = arr[pos:pos + count]
+            pos += count
+
+    @staticmethod
+    def encode(results):
+        """Encodes {test ID: status}"""
+        ids = sorted(results)
+        ranges = []
+        for tid in ids:
+            if ranges and ranges[-1][1] == tid:
+                ranges[-1][1] = tid + 1
+            else:
+                ranges.append([tid, tid + 1])
+        arr = array.array('I', [len(ranges)])
+        for (start, end) in ranges:
+            arr.append(start)
+            arr.append(end)
+        by_status = dict((status, []) for status in _other_statuses)
+        for tid in ids:
+            status = results[tid]
+            if status != PASS:
+                by_status[status].append(tid)
+        for status in _other_statuses:
+            arr.append(len(by_status[status]))
+            arr.extend(by_status[status])
+        return zlib.compress(_to_bytes(arr), 6)
+
+    def status(self, tid):
+        """Returns the status of test tid or None, if it was not run"""
+        idx = bisect.bisect_right(self._starts, tid) - 1
+        if idx < 0 or tid >= self._ends[idx]:
+            return None
+        for (status, ids) in self._ids.items():
+            idx = bisect.bisect_left(ids, tid)
+            if idx < len(ids) and ids[idx] == tid:
+                return status
+        return PASS
+
+    def counts(self):
+        total = sum(end - start for (start, end) in zip(self._starts,
+                                                        self._ends))
+        result = OrderedDict((status, len(self._ids.get(status, [])))
+                             for status in _other_statuses)
+        result[PASS] = total - sum(result.values())
+        return result
+
+
+class TestDB(object):
+    def __init__(self, path):
+        self._path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._names = []
+        self._ids = {}
+        names_path = pjoin(path, 'names.txt')
+        if os.path.isfile(names_path):
+            with open(names_path, 'r') as f:
+                for line in f:
+                    self._ids[line.rstrip('\n')] = len(self._names)
+                    self._names.append(line.rstrip('\n'))
+        self.runs = []
+        runs_path = pjoin(path, 'runs.jsonl')
+        if os.path.isfile(runs_path):
+            with open(runs_path, 'r') as f:
+                self.runs = [json.loads(line, object_pairs_hook=OrderedDict)
+                             for line in f if line.strip()]
+        self._results = {}
+
+    @staticmethod
+    def make_key(tool, target, exp, name):
+        return '\t'.join(s.replace('\t', ' ')
+                         for s in [tool, target, exp, name])
+
+    def name(self, tid):
+        return self._names[tid]
+
+    def find_tests(self, pattern):
+        """Returns IDs of tests whose keys contain pattern (a regexp)"""
+        regex = re.compile(pattern)
+        return [tid for (tid, name) in enumerate(self._names)
+                if regex.search(name)]
+
+    def add_run(self, info, sums):
+        """Adds results of a run: info is a dictionary (label, branch,
+        config, etc.), sums is a list of SumFile. Returns the run or None, if
+        the same run (identical label, configuration, date and results) is
+        already stored"""
+        digest = hashlib.sha1()
+        results = {}
+        new_names = []
+        for sf in sorted(sums, key=lambda sf: sf.tool or ''):
+            for ((target, exp), tests) in sf.groups.items():
+                for (name, status) in tests.items():
+                    key = self.make_key(sf.tool or '', target, exp, name)
+                    tid = self._ids.get(key)
+                    if tid is None:
+                        tid = len(self._names)
+                        self._ids[key] = tid
+                        self._names.append(key)
+                        new_names.append(key)
+                    results[tid] = status
+        if new_names:
+            with open(pjoin(self._path, 'names.txt'), 'a') as f:
+                for key in new_names:
+                    f.write(key + '\n')
+        for tid in sorted(results):
+            digest.update('{} {}\n'.format(tid, results[tid]).encode('utf-8'))
+        digest = digest.hexdigest()
+        for run in self.runs:
+            if run['digest'] == digest and \
+                    all(run.get(key) == info.get(key)
+                        for key in ['label', 'config', 'date']):
+                return None
+        data = RunResults.encode(results)
+        with open(pjoin(self._path, 'results.bin'), 'ab') as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(data)
+        run = OrderedDict(info)
+        run['id'] = len(self.runs)
+        run['digest'] = digest
+        run['offset'] = offset
+        run['size'] = len(data)
+        # The run becomes visible only when this line is written
+        with open(pjoin(self._path, 'runs.jsonl'), 'a') as f:
+            f.write(json.dumps(run) + '\n')
+        self.runs.append(run)
+        return run
+
+    def _load_results(self):
+        if len(self._results) == len(self.runs):
+            return
+        with open(pjoin(self._path, 'results.bin'), 'rb') as f:
+            for run in self.runs:
+                if run['id'] in self._results:
+                    continue
+                f.seek(run['offset'])
+                self._results[run['id']] = RunResults(f.read(run['size']))
+
+    def results(self, run):
+        self._load_results()
+        return self._results[run['id']]
+
+    def select_runs(self, branch=None, config=None, kind=None):
+        """Returns runs matching the given filters, sorted chronologically
+        (by date, then by the order of addition)"""
+        runs = [run for run in self.runs
+                if (branch is None or run.get('branch') == branch) and
+                   (config is None or run.get('config') == config) and
+                   (kind is None or run.get('kind') == kind)]
+        return sorted(runs, key=lambda run: (run.get('date', ''), run['id']))
+
+    def history(self, tid, runs):
+        """Returns [(run, status)] of test tid for the given runs (status is
+        None if the test was not run)"""
+        self._load_results()
+        return [(run, self._results[run['id']].status(tid)) for run in runs]
+
+    def first_failure(self, tid, runs):
+        """Finds when test tid started failing: returns (last good run or
+        None, first failing run) of the latest sequence of failing runs, or
+        None if the test does not fail in the last run where it was run.
+        Runs where the test was not run are skipped"""
+        last_good = None
+        first_bad = None
+        for (run, status) in self.history(tid, runs):
+            if status is None:
+                continue
+            if status in BAD_STATUSES:
+                if first_bad is None:
+                    first_bad = run
+            else:
+                last_good = run
+                first_bad = None
+        if first_bad is None:
+            return None
+        return (last_good, first_bad)
@@ -0,0 +1,181 @@
+# Parsing and aggregation of -ftime-report output
+
+from __future__ import print_function, division
+
+import os
+import json
+import math
+import re
+from collections import OrderedDict
+
+USR, SYS, WALL, GGC = range(4)
+METRICS = ['usr', 'sys', 'wall', 'ggc']
+
+# " phase parsing    :   0.35 ( 54%)   0.20 ( 83%)   0.57 ( 63%)    46M ( 69%)"
+# (GCC 9 and later) or
+# " phase parsing    :   0.35 (54%) usr   0.20 (83%) sys   0.57 (63%) wall   47104 kB (69%) ggc"
+# (older versions)
+_line_re = re.compile(r'^\s*(\S.*?)\s*:\s*(\d.*)$')
+_value_re = re.compile(r'([\d.]+)\s*(kB|[kMG])?\s*(?:\(\s*\d+%\))?\s*(usr|sys|wall|ggc)?')
+_units = { None: 1.0 / 1024, 'kB': 1.0, 'k': 1.0, 'M': 1024.0, 'G': 1024.0 ** 2 }
+
+def parse_time_report(text):
+    """Parses -ftime-report output (compiler's stderr). Returns an ordered
+    dictionary {time variable: [usr, sys, wall, ggc]} (times in seconds, GGC
+    memory in kB). The total is stored as 'TOTAL'"""
+    report = OrderedDict()
+    started = False
+    for line in text.splitlines():
+        if not started:
+            started = line.startswith('Time variable') or \
+                        line.startswith('Execution times')
+            continue
+        m = _line_re.match(line)
+        if m is None:
+            continue
+        values = [0.0] * 4
+        for (pos, v) in enumerate(_value_re.finditer(m.group(2))):
+            (num, unit, label) = v.groups()
+            idx = METRICS.index(label) if label else pos
+            if idx >= len(values):
+                break
+            try:
+                values[idx] = float(num)
+            except ValueError:
+                continue
+            if idx == GGC:
+                values[idx] *= _units[unit if label is None else 'kB']
+        report[m.group(1)] = values
+        if m.group(1) == 'TOTAL':
+            break
+    return report
+
+def _median(values):
+    values = sorted(values)
+    n = len(values)
+    if n == 0:
+        return 0.0
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+def _variance(values):
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean = sum(values) / n
+    return sum((v - mean) ** 2 for v in values) / (n - 1)
+
+
+class TimeReportStore(object):
+    """Parsed time reports of a corpus compiled by a single compiler: for
+    each source file a list of reports (one per repetition)"""
+
+    def __init__(self, label=None, compiler=None, version=None, flags=None):
+        self.label = label
+        self.compiler = compiler
+        self.version = version
+        self.flags = flags or []
+        self.files = {}     # file name -> list of reports
+        self.failed = {}    # file name -> error message
+
+    def add(self, fname, report):
+        self.files.setdefault(fname, []).append(report)
+
+    def add_failure(self, fname, message):
+        self.failed[fname] = message
+
+    def save(self, path):
+        data = { 'label': self.label, 'compiler': self.compiler,
+                 'version': self.version, 'flags': self.flags,
+                 'files': self.files, 'failed': self.failed }
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=1)
+        os.rename(path + '.tmp', path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'r') as f:
+            data = json.load(f, object_pairs_hook=OrderedDict)
+        store = TimeReportStore(data['label'], data['compiler'],
+                                data['version'], data['flags'])
+        store.files = data['files']
+        store.failed = data['failed']
+        return store
+
+    @property
+    def repetitions(self):
+        return min([len(reps) for reps in self.files.values()] or [0])
+
+    def aggregate(self, metric, files=None):
+        """Aggregates metric over files (all successfully compiled files, by
+        default). For each file and time variable the median over repetitions
+        is taken, the medians are summed over files. Returns an ordered
+        dictionary {time variable: (total, noise)}, where noise is the
+        standard deviation of the total estimated from the spread between
+        repetitions"""
+        idx = METRICS.index(metric)
+        if files is None:
+            files = self.files.keys()
+        totals = OrderedDict()
+        variances = {}
+        for fname in sorted(files):
+            reps = self.files[fname]
+            names = OrderedDict()
+            for report in reps:
+                for name in report:
+                    names[name] = True
+            for name in names:
+                values = [report[name][idx] if name in report else 0.0
+                          for report in reps]
+                totals[name] = totals.get(name, 0.0) + _median(values)
+                # Variance of the median is approximately pi/2 times the
+                # variance of the mean
+                variances[name] = variances.get(name, 0.0) + \
+                        _variance(values) * math.pi / 2 / len(values)
+        return OrderedDict((name, (total, math.sqrt(variances[name])))
+                           for (name, total) in totals.items())
+
+
+class Change(object):
+    def __init__(self, name, old, new, noise):
+        self.name = name
+        self.old = old
+        self.new = new
+        self.noise = noise
+
+    @property
+    def delta(self):
+        return self.new - self.old
+
+    @property
+    def percent(self):
+        if self.old == 0:
+            return float('inf') if self.new else 0.0
+        return 100.0 * self.delta / self.old
+
+
+def compare_stores(old, new, metric, threshold=5.0, sigma=3.0, min_change=0.0):
+    """Compares aggregated metric of two stores over the files compiled
+    successfully by both compilers. Returns (list of significant changes
+    sorted by absolute delta, list of all changes, number of common files).
+    A change is significant if it exceeds threshold percent, sigma times
+    the combined noise and min_change"""
+    files = set(old.files) & set(new.files)
+    agg_old = old.aggregate(metric, files)
+    agg_new = new.aggregate(metric, files)
+    names = list(agg_old) + [name for name in agg_new if name not in agg_old]
+    changes = []
+    significant = []
+    for name in names:
+        (val_old, noise_old) = agg_old.get(name, (0.0, 0.0))
+        (val_new, noise_new) = agg_new.get(name, (0.0, 0.0))
+        change = Change(name, val_old, val_new,
+                        math.sqrt(noise_old ** 2 + noise_new ** 2))
+        changes.append(change)
+        delta = abs(change.delta)
+        if delta > min_change and delta > sigma * change.noise and \
+                abs(change.percent) > threshold:
+            significant.append(change)
+    significant.sort(key=lambda c: -abs(c.delta))
+    return (significant, changes, len(files))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+# Collect coverage data of a gcov-instrumented GCC build (build.py --coverage)
+# after running tests: run gcov in parallel, merge results per source file,
+# write an lcov tracefile and show per-file and per-function summaries.
+
+from __future__ import print_function, division
+
+# System
+import sys
+import argparse
+import multiprocessing
+import os, os.path
+import re
+
+# Local
+from gcc.env import Environment
+from gcc.gcov import (CoverageStore, file_summary, find_gcda, gcov_format,
+                      make_jobs, run_gcov, write_lcov)
+
+env = Environment()
+con = env
+
+def get_config():
+    try:
+        from config import cfg
+        return cfg
+    except ImportError:
+        return None
+
+def get_gcov(args):
+    """gcov must match the compiler used to build the instrumented compiler
+    (the stage 0 compiler)"""
+    if args.gcov is not None:
+        return args.gcov
+    cfg = get_config()
+    if cfg is not None and cfg.stage0_gcc is not None:
+        path = os.path.join(cfg.stage0_gcc, 'gcov')
+        if os.path.isfile(path):
+            return path
+    return 'gcov'
+
+def get_paths(args):
+    build_dir = args.build_dir
+    if build_dir is None:
+        cfg = get_config()
+        if cfg is None:
+            env.fatal_error('Build directory is not specified')
+        build_dir = cfg.build_dir
+    output_dir = args.output_dir or os.path.join(build_dir, 'coverage')
+    return (build_dir, output_dir)
+
+def percent(hit, found):
+    """Formats coverage, "-" if nothing was found"""
+    return '{:.1f}%'.format(100.0 * hit / found) if found else '-'
+
+def compile_re(pattern):
+    return re.compile(pattern) if pattern else None
+
+def cmd_collect(args):
+    (build_dir, output_dir) = get_paths(args)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    gcov = get_gcov(args)
+    fmt = gcov_format(gcov)
+    if fmt is None:
+        env.fatal_error('{} supports neither JSON nor intermediate '
+                        'format'.format(gcov))
+    store_path = os.path.join(output_dir, 'coverage.json.gz')
+    if args.full and os.path.exists(store_path):
+        os.unlink(store_path)
+    store = CoverageStore(store_path)
+    gcda_files = find_gcda(build_dir)
+    if not gcda_files:
+        env.fatal_error('No .gcda files found in {} (run some tests '
+                        'first)'.format(build_dir))
+    outdated = store.outdated(gcda_files)
+    num_total = sum(len(files) for files in gcda_files.values())
+    num_outdated = sum(len(files) for files in outdated.values())
+    con.info('{} .gcda file(s) in {} directories, {} new or changed; using '
+             '{} ({} format)'.format(num_total, len(gcda_files), num_outdated,
+                                     gcov, fmt))
+    jobs = make_jobs(gcov, fmt, outdated)
+    if jobs:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        try:
+            for (result, errors) in pool.imap_unordered(run_gcov, jobs):
+                for (path, coverage) in result.items():
+                    store.update(path, coverage)
+                for error in errors:
+                    con.warn(error)
+        finally:
+            pool.terminate()
+            pool.join()
+        store.save()
+    merged = store.merged(compile_re(args.include), compile_re(args.exclude))
+    lcov_path = os.path.join(output_dir, 'coverage.info')
+    write_lcov(merged, lcov_path)
+    totals = [sum(values) for values in
+              zip(*[file_summary(cov) for cov in merged.values()])] or [0] * 6
+    con.ok('Lines: {} of {}, functions: {} of {}, branches: {} of '
+           '{}'.format(percent(totals[1], totals[0]), totals[0],
+                       percent(totals[3], totals[2]), totals[2],
+                       percent(totals[5], totals[4]), totals[4]))
+    con.ok('Saved {}'.format(lcov_path))
+
+def cmd_show(args):
+    (build_dir, output_dir) = get_paths(args)
+    store_path = os.path.join(output_dir, 'coverage.json.gz')
+    if not os.path.isfile(store_path):
+        env.fatal_error('{} not found (run collect first)'.format(store_path))
+    merged = CoverageStore(store_path).merged(compile_re(args.include),
+                                              compile_re(args.exclude))
+    rows = []
+    for (path, cov) in merged.items():
+        (lf, lh, ff, fh, bf, bh) = file_summary(cov)
+        rows.append((path, lf, lh, ff, fh, bf, bh))
+    if args.sort == 'missed':
+        rows.sort(key=lambda r: (-(r[1] - r[2]), r[0]))
+    else:
+        rows.sort()
+    print('{:<50} {:>7} {:>7} {:>7} {:>7}'.format('File', 'Lines', 'Missed',
+                                                  'Funcs', 'Branch'))
+    for (path, lf, lh, ff, fh, bf, bh) in rows[:args.top]:
+        name = os.path.relpath(path, args.relative_to) \
+               if args.relative_to else path
+        print('{:<50} {:>7} {:>7} {:>7} {:>7}'.format(
+                name[-50:], percent(lh, lf), lf - lh, percent(fh, ff),
+                percent(bh, bf)))
+        if args.functions:
+            funcs = sorted(merged[path]['functions'].items(),
+                           key=lambda item: item[1][0])
+            for (func, (line, count)) in funcs:
+                print('    {:>6} {:<50} {}'.format(line, func[:50], count))
+
+def add_common_args(parser):
+    parser.add_argument('build_dir', metavar='BUILD_DIR', nargs='?',
+                        help='build directory (default: from config.py)')
+    parser.add_argument('-o', '--output-dir', dest='output_dir',
+                        help='directory for results (default: '
+                        'BUILD_DIR/coverage)')
+    parser.add_argument('--include', metavar='REGEX',
+                        help='only source files matching REGEX')
+    parser.add_argument('--exclude', metavar='REGEX', default='^/usr/',
+                        help='ignore source files matching REGEX (default: '
+                        '%(default)s)')
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect coverage of a '
+                                     'gcov-instrumented build')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    p = sub.add_parser('collect', help='run gcov and write lcov tracefile')
+    add_common_args(p)
+    p.add_argument('--gcov',
+                   help='gcov executable matching the compiler used for the '
+                   'build (default: from stage0_gcc in config.py or gcov in '
+                   'PATH)')
+    p.add_argument('-j', '--jobs', type=int,
+                   default=multiprocessing.cpu_count(),
+                   help='number of parallel jobs (default: %(default)s)')
+    p.add_argument('--full', action='store_true',
+                   help='process all .gcda files (by default only new and '
+                   'changed ones)')
+    p.set_defaults(func=cmd_collect)
+    p = sub.add_parser('show', help='show per-file summary')
+    add_common_args(p)
+    p.add_argument('-s', '--sort', choices=['name', 'missed'], default='name',
+                   help='sort files by name or number of missed lines '
+                   '(default: %(default)s)')
+    p.add_argument('-n', '--top', type=int, default=sys.maxsize,
+                   help='number of files to show')
+    p.add_argument('-f', '--functions', action='store_true',
+                   help='show execution counts of functions')
+    p.add_argument('--relative-to', dest='relative_to', metavar='DIR',
+                   help='show file names relative to DIR')
+    p.set_defaults(func=cmd_show)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
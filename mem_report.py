@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+# Collect -fmem-report statistics for a corpus of testcases, rank allocation
+# sites and compare memory usage of two compiler builds. Per allocation site
+# statistics require a compiler configured with
+# --enable-gather-detailed-mem-stats (build.py --mem-stats).
+
+from __future__ import print_function, division
+
+# System
+import sys
+import argparse
+import multiprocessing
+import os, os.path
+import shlex
+
+# Local
+from gcc.common import collect_sources, format_size
+from gcc.env import Environment
+from gcc.invoke import (resolve_compilers, init_report_worker,
+                        compile_report)
+from gcc.memreport import MemReportStore, parse_mem_report, compare_stores
+
+env = Environment()
+con = env
+
+def print_comparison(args, old, new):
+    result = compare_stores(old, new, args.column, args.threshold,
+                            args.min_change * 1024)
+    print('{} -> {}: {} / {} file(s)'.format(old.label, new.label,
+                                            len(old.files), len(new.files)))
+    if not result:
+        con.ok('No significant changes')
+        return False
+    for ((table, col), changes) in result.items():
+        print('\n{} ({})'.format(table, col))
+        for ch in changes[:args.top]:
+            print('  {:<60} {:>8} {:>8} {:>9} {:>+8.1f}%'.format(
+                    ch.site[:60], format_size(ch.old), format_size(ch.new),
+                    ('+' if ch.delta > 0 else '') + format_size(ch.delta),
+                    ch.percent))
+        if len(changes) > args.top:
+            print('  ... {} more'.format(len(changes) - args.top))
+    return True
+
+def cmd_collect(args):
+    try:
+        from config import cfg
+        install_dir = cfg.install_dir
+    except ImportError:
+        install_dir = None
+    compilers = resolve_compilers(env, args.compilers, install_dir)
+    paths = [path for (path, _, _) in compilers]
+    files = collect_sources(args.inputs)
+    if not files:
+        env.fatal_error('No testcases found')
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    flags = shlex.split(args.flags)
+    stores = []
+    for (path, compiler, label) in compilers:
+        if 'gather-detailed-mem-stats' not in compiler.configuration:
+            con.warn('{} is not configured with --enable-gather-detailed-'
+                     'mem-stats, allocation sites will not be '
+                     'reported'.format(path))
+        stores.append(MemReportStore(label, path, compiler.full_version_str,
+                                     flags))
+    jobs = [(idx, fname, flags, args.timeout)
+            for fname in files for idx in range(len(paths))]
+    con.info('Compiling {} file(s) with {} compiler(s), {} job(s)'.format(
+                len(files), len(paths), args.jobs))
+    # Only files compiled successfully by all compilers are aggregated (so
+    # that the results are comparable)
+    results = {}
+    pool = multiprocessing.Pool(args.jobs, init_report_worker,
+                                (paths, '-fmem-report', parse_mem_report))
+    try:
+        for (idx, fname, records, error) in \
+                pool.imap_unordered(compile_report, jobs):
+            if records is None:
+                stores[idx].add_failure(fname, error)
+            results.setdefault(fname, {})[idx] = records
+    finally:
+        pool.terminate()
+        pool.join()
+    for fname in files:
+        if any(records is None for records in results[fname].values()):
+            continue
+        for (idx, store) in enumerate(stores):
+            store.add(fname, results[fname][idx], args.keep_lines)
+    for store in stores:
+        if store.failed:
+            con.warn('{}: {} file(s) failed to compile'.format(
+                        store.label, len(store.failed)))
+        path = os.path.join(args.output_dir, store.label + '.json')
+        store.save(path)
+        con.ok('Saved {}'.format(path))
+    for store in stores[1:]:
+        print_comparison(args, stores[0], store)
+
+def cmd_show(args):
+    store = MemReportStore.load(args.store)
+    print('{} ({}), {} file(s)'.format(store.label, store.compiler,
+                                      len(store.files)))
+    for table in store.tables:
+        if args.table and args.table.lower() not in str(table).lower():
+            continue
+        col = store.find_column(table, args.column)
+        if col is None:
+            continue
+        ranked = store.ranked(table, col)
+        total = sum(value for (value, _) in ranked)
+        print('\n{} (by {}, total {})'.format(table, col, format_size(total)))
+        for (value, site) in ranked[:args.top]:
+            values = store.tables[table][site]
+            print('  {:<60} {:>5.1f}% {}'.format(
+                    site[:60], 100.0 * value / total if total else 0.0,
+                    ' '.join('{}={}'.format(c, format_size(values.get(c, 0)))
+                             for c in store.columns[table])))
+
+def cmd_compare(args):
+    old = MemReportStore.load(args.old)
+    new = MemReportStore.load(args.new)
+    if set(old.files) != set(new.files):
+        con.warn('Sets of compiled files differ')
+    sys.exit(1 if print_comparison(args, old, new) else 0)
+
+def add_compare_args(parser):
+    parser.add_argument('-s', '--sort', dest='column',
+                        help='column to compare, e.g., Leak, Garbage, Times '
+                        '(default: the first column of each table)')
+    parser.add_argument('--threshold', type=float, default=5.0,
+                        help='minimal relative change, percent (default: '
+                        '%(default)s)')
+    parser.add_argument('--min-change', type=int, default=64,
+                        dest='min_change',
+                        help='minimal absolute change, kB (for counts - '
+                        'in units of 1024) (default: %(default)s)')
+    parser.add_argument('-n', '--top', type=int, default=20,
+                        help='number of sites to show per table (default: '
+                        '%(default)s)')
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect and compare '
+                                     '-fmem-report statistics')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    p = sub.add_parser('collect', help='compile a corpus with -fmem-report')
+    p.add_argument('inputs', metavar='FILE', nargs='+',
+                   help='testcases or directories containing them')
+    p.add_argument('-c', '--compiler', dest='compilers', action='append',
+                   required=True,
+                   help='compiler: path to the driver, installation prefix or '
+                   'name of installation directory; can be specified '
+                   'multiple times')
+    p.add_argument('-f', '--flags', default='-c -O2',
+                   help='compiler flags (default: %(default)s)')
+    p.add_argument('-j', '--jobs', type=int,
+                   default=multiprocessing.cpu_count(),
+                   help='number of parallel jobs (default: %(default)s)')
+    p.add_argument('--timeout', type=float, default=300,
+                   help='kill the compiler after TIMEOUT seconds '
+                   '(default: %(default)s)')
+    p.add_argument('-o', '--output-dir', dest='output_dir',
+                   default='mem_reports',
+                   help='directory for results (default: %(default)s)')
+    p.add_argument('--keep-lines', action='store_true', dest='keep_lines',
+                   help='do not merge allocation sites in the same function '
+                   '(by default line numbers are ignored)')
+    add_compare_args(p)
+    p.set_defaults(func=cmd_collect)
+    p = sub.add_parser('show', help='rank allocation sites')
+    p.add_argument('store', metavar='STORE', help='result of collect (JSON)')
+    p.add_argument('-s', '--sort', dest='column',
+                   help='column to sort by, e.g., Leak or Times (default: '
+                   'the first column of each table)')
+    p.add_argument('-t', '--table',
+                   help='show only tables whose name contains TABLE')
+    p.add_argument('-n', '--top', type=int, default=20,
+                   help='number of sites to show per table (default: '
+                   '%(default)s)')
+    p.set_defaults(func=cmd_show)
+    p = sub.add_parser('compare', help='compare results for two compilers')
+    p.add_argument('old', metavar='OLD', help='baseline (JSON)')
+    p.add_argument('new', metavar='NEW', help='new results (JSON)')
+    add_compare_args(p)
+    p.set_defaults(func=cmd_compare)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -3,15 +3,18 @@
 # System
 import ftplib
 import argparse
+import hashlib
+import json
 import sys, os, os.path
 import shutil
 import subprocess
 import multiprocessing
 import re
 import tarfile
+import tempfile
 
 # Local
-from gcc.common import print_exception, dict_to_struct
+from gcc.common import print_exception, dict_to_struct, StopWatch
 import gcc.build
 from gcc.invoke import GCCInvoker
 from gcc.env import Environment
@@ -84,6 +87,19 @@ def catch_errors(func):
 
     return wrapper
 
+def extract_tarball(args, tarball):
+    con.info('Extracting {} to {}'.format(tarball, args.source_dir))
+    if os.path.isdir(args.source_dir):
+        shutil.rmtree(args.source_dir)
+    os.makedirs(args.source_dir)
+    tar = tarfile.open(tarball)
+    tar.extractall(args.source_dir)
+    con.ok('Extracted files from ' + tarball)
+    lst = os.listdir(args.source_dir)
+    if len(lst) != 1 or not os.path.isdir(pjoin(args.source_dir, lst[0])):
+        raise Exception('Unexpected tarball contents: ' + str(lst))
+    return pjoin(args.source_dir, lst[0])
+
 def build_and_install(args, ver, tarball):
     bld_args = { }
     # FIXME: caller should pass prefix
@@ -112,19 +128,9 @@ def build_and_install(args, ver, tarball):
     bld_args['multilib'] = True
     bld_args['isl'] = cfg.libs_dir
     bld_args['checking'] = 'yes' if args.checking else 'release'
-    bld_args['jobs'] = multiprocessing.cpu_count()
+    bld_args['jobs'] = args.jobs
     bld_args['debug'] = False
-    con.info('Extracting {} to {}'.format(tarball, args.source_dir))
-    if os.path.isdir(args.source_dir):
-        shutil.rmtree(args.source_dir)
-    os.makedirs(args.source_dir)
-    tar = tarfile.open(tarball)
-    tar.extractall(args.source_dir)
-    con.ok('Extracted files from ' + tarball)
-    lst = os.listdir(args.source_dir)
-    if len(lst) != 1 or not os.path.isdir(pjoin(args.source_dir, lst[0])):
-        raise Exception('Unexpected tarball contents: ' + str(lst))
-    bld_args['source_dir'] = pjoin(args.source_dir, lst[0])
+    bld_args['source_dir'] = extract_tarball(args, tarball)
     args = dict_to_struct(bld_args)
     builder = gcc.build.GCCBuilder(env)
     builder.build(args)
@@ -170,6 +176,19 @@ def update_snapshot(args, ver, tarball):
             os.unlink(local_path)
         raise
 
+def find_remote_snapshot(ftp, ver):
+    """Returns (tarball, date) of the latest snapshot of branch ver on the
+    FTP mirror or (None, None)"""
+    rdir = '/{}/LATEST-{}'.format(cfg.remote_snapshot_dir, ver)
+    con.info('Changing directory to: ' + rdir)
+    ftp.cwd(rdir)
+    con.info('Getting directory listing')
+    for fname in ftp.nlst():
+        date = date_of(fname)
+        if date:
+            return (fname, date)
+    return (None, None)
+
 def update_all_snapshots(args, local_snaps):
     con.info('Connecting to {}'.format(args.mirror))
     need_reconnect = True
@@ -179,18 +198,7 @@ def update_all_snapshots(args, local_snaps):
             ftp = ftplib.FTP(args.mirror)
             ftp.login()
             need_reconnect = False
-        rdir = '/{}/LATEST-{}'.format(cfg.remote_snapshot_dir, ver)
-        con.info('Changing directory to: ' + rdir)
-        ftp.cwd(rdir)
-        con.info('Getting directory listing')
-        files = ftp.nlst()
-        tarball = None
-        date = None
-        for fname in files:
-            date = date_of(fname)
-            if date:
-                tarball = fname
-                break
+        (tarball, date) = find_remote_snapshot(ftp, ver)
         if not tarball:
             con.warn('Tarball not found on remote server')
             continue
@@ -220,6 +228,259 @@ def download_release_tarball(args, ver):
             os.unlink(local_path)
         raise
 
+# === Regression bisection over weekly snapshots ===
+
+def parse_date(date_str):
+    match = re.match(r'^(\d{4})-?(\d{2})-?(\d{2})$', date_str)
+    if not match:
+        raise Exception('Invalid date "{}", expected YYYYMMDD'.format(date_str))
+    return tuple([int(x) for x in match.groups()])
+
+def format_date(date):
+    return '{0[0]:04}{0[1]:02}{0[2]:02}'.format(date)
+
+def get_bisect_prefix(args, ver, date):
+    prefix = 'gcc-{}-{}-bisect'.format(ver, format_date(date))
+    if not args.checking:
+        prefix += '-rel'
+    return prefix
+
+def matches_branch(compiler, ver):
+    ver_num = [int(v) for v in ver.split('.')]
+    return compiler.base_version[:len(ver_num)] == ver_num
+
+def find_installed_snapshots(args, ver):
+    """Returns a dictionary {date: bin_dir} of installed snapshots of branch
+    ver (both regular and cached bisection builds) with matching checking
+    mode"""
+    installed = {}
+    if not os.path.isdir(args.dest):
+        return installed
+    for name in sorted(os.listdir(args.dest)):
+        bin_dir = pjoin(args.dest, name, 'bin')
+        if not name.startswith('gcc-') or not pexists(pjoin(bin_dir, 'gcc')):
+            continue
+        try:
+            compiler = GCCInvoker(pjoin(bin_dir, 'gcc'))
+            is_release = 'enable-checking=release' in compiler.configuration
+        except Exception:
+            continue
+        if not compiler.date or not matches_branch(compiler, ver):
+            continue
+        if is_release == bool(args.checking):
+            continue
+        date = parse_date(compiler.date)
+        if date not in installed:
+            con.info('Found installed snapshot {}: {}'.format(
+                        format_date(date), bin_dir))
+            installed[date] = bin_dir
+    return installed
+
+def list_snapshot_dates(args, ver):
+    """Returns dates of snapshots of branch ver available either on
+    the FTP mirror or in the local bisection tarball cache"""
+    dates = set()
+    bisect_snapdir = pjoin(args.snapdir, 'bisect')
+    if os.path.isdir(bisect_snapdir):
+        for fname in os.listdir(bisect_snapdir):
+            if version_of(fname) == ver:
+                dates.add(date_of(fname))
+    if args.no_download:
+        return sorted(dates)
+    dir_re = re.compile(r'^{}-(\d{{4}})(\d{{2}})(\d{{2}})$'.format(re.escape(ver)))
+    con.info('Connecting to {}'.format(args.mirror))
+    ftp = ftplib.FTP(args.mirror)
+    ftp.login()
+    rdir = '/' + cfg.remote_snapshot_dir
+    con.info('Changing directory to: ' + rdir)
+    ftp.cwd(rdir)
+    con.info('Getting directory listing')
+    for name in ftp.nlst():
+        match = dir_re.match(os.path.basename(name))
+        if match:
+            dates.add(tuple([int(x) for x in match.groups()]))
+    ftp.close()
+    return sorted(dates)
+
+def download_bisect_snapshot(args, ver, date):
+    bisect_snapdir = pjoin(args.snapdir, 'bisect')
+    tarball = make_fname(ver, date)
+    local_path = pjoin(bisect_snapdir, tarball)
+    if pexists(local_path):
+        return local_path
+    full_url = 'ftp://{}/{}/{}-{}/{}'.format(args.mirror,
+                                             cfg.remote_snapshot_dir, ver,
+                                             format_date(date), tarball)
+    ensure_path(bisect_snapdir)
+    try:
+        env.invoke('wget', full_url, '-O', local_path)
+    except:
+        if pexists(local_path):
+            os.unlink(local_path)
+        raise
+    return local_path
+
+def build_bisect_snapshot(args, ver, date):
+    """Builds and installs a minimal C/C++ compiler from the snapshot of
+    branch ver made at date. Returns the bin directory of installed compiler"""
+    tarball = download_bisect_snapshot(args, ver, date)
+    bld_args = { }
+    bld_args['prefix'] = get_bisect_prefix(args, ver, date)
+    bld_args['build_type'] = gcc.build.MINIMAL
+    bld_args['install_dir'] = args.dest
+    bld_args['build_dir'] = args.build_dir
+    bld_args['languages'] = [gcc.build.C, gcc.build.CXX]
+    bld_args['isl'] = cfg.libs_dir
+    bld_args['checking'] = 'yes' if args.checking else 'release'
+    bld_args['jobs'] = args.jobs
+    bld_args['debug'] = False
+    bld_args['source_dir'] = extract_tarball(args, tarball)
+    bld_args = dict_to_struct(bld_args)
+    builder = gcc.build.GCCBuilder(env)
+    builder.build(bld_args)
+    builder.install(bld_args)
+    return pjoin(args.dest, bld_args.prefix, 'bin')
+
+def is_interesting(args, bin_dir):
+    """Runs the interestingness check in a temporary directory. Returns True,
+    if the compiler in bin_dir exhibits the regression"""
+    work_dir = tempfile.mkdtemp(prefix='gcc-bisect-')
+    run_env = dict(os.environ)
+    run_env['PATH'] = bin_dir + os.pathsep + run_env.get('PATH', '')
+    try:
+        ret = subprocess.call([os.path.abspath(args.test), bin_dir,
+                               os.path.abspath(args.testcase)],
+                              cwd=work_dir, env=run_env)
+    finally:
+        shutil.rmtree(work_dir)
+    return ret == 0
+
+@catch_errors
+def bisect_snapshots(args):
+    (ver, good_str, bad_str) = args.bisect
+    good = parse_date(good_str)
+    bad = parse_date(bad_str)
+    if good >= bad:
+        raise Exception('Good date must precede the bad one')
+    build_time = 0.0
+    builds = 0
+    tests = 0
+
+    def check(date, bin_dir):
+        con.info('Testing snapshot {} ({})'.format(format_date(date), bin_dir))
+        result = is_interesting(args, bin_dir)
+        if result:
+            con.warn('Snapshot {} is bad'.format(format_date(date)))
+        else:
+            con.ok('Snapshot {} is good'.format(format_date(date)))
+        return result
+
+    # Narrow the window using installed compilers first, they are free
+    installed = find_installed_snapshots(args, ver)
+    while True:
+        cands = [d for d in sorted(installed) if good < d < bad]
+        if not cands:
+            break
+        mid = cands[len(cands) // 2]
+        tests += 1
+        if check(mid, installed[mid]):
+            bad = mid
+        else:
+            good = mid
+
+    # Then build the midpoint snapshots. Snapshots which fail to build are
+    # skipped (like "git bisect skip"), a neighbouring one is tried instead
+    cands = list_snapshot_dates(args, ver)
+    skipped = set()
+    while True:
+        cands = [d for d in cands if good < d < bad]
+        testable = [d for d in cands if d not in skipped]
+        if not testable:
+            break
+        mid = testable[len(testable) // 2]
+        con.info('{} snapshot(s) left between {} and {}'.format(len(testable),
+                    format_date(good), format_date(bad)))
+        bin_dir = installed.get(mid)
+        if bin_dir is None:
+            stopwatch = StopWatch(start_now=True)
+            try:
+                bin_dir = build_bisect_snapshot(args, ver, mid)
+            except (Exception, SystemExit) as ex:
+                # GCCBuilder reports build errors itself and calls sys.exit
+                if not isinstance(ex, SystemExit):
+                    print_exception(env, ex)
+                con.warn('Failed to build snapshot {}, skipping it'.format(
+                            format_date(mid)))
+                skipped.add(mid)
+                continue
+            finally:
+                build_time += stopwatch.stop()
+            builds += 1
+            installed[mid] = bin_dir
+        tests += 1
+        if check(mid, bin_dir):
+            bad = mid
+        else:
+            good = mid
+
+    con.ok('Regression window: {} (good) .. {} (bad)'.format(format_date(good),
+                                                           format_date(bad)))
+    if cands:
+        con.warn('Snapshots in the window which failed to build: {}'.format(
+                    ', '.join([format_date(d) for d in cands])))
+    con.info('Tests run: {}, snapshots built: {}, total build time: {}'.format(
+                tests, builds, StopWatch.TimeDelta(build_time)))
+
+def find_local_snapshots(args):
+    """Returns {branch: date} of the latest snapshot tarballs in
+    args.snapdir"""
+    local_snaps = {}
+    if os.path.isdir(args.snapdir):
+        for fname in os.listdir(args.snapdir):
+            ver = version_of(fname)
+            if ver and date_of(fname) > local_snaps.get(ver, ()):
+                local_snaps[ver] = date_of(fname)
+    return local_snaps
+
+def source_versions(args):
+    """Returns the list of source versions built by the command (for
+    snapshots, the latest ones available)"""
+    if args.versions:
+        return ['gcc-' + ver for ver in args.versions]
+    if args.bisect:
+        return ['gcc-{}-{}..{}'.format(*args.bisect)]
+    if args.list:
+        return []
+    if args.no_download:
+        local_snaps = find_local_snapshots(args)
+        return [make_fname(ver, local_snaps[ver])[:-len('.tar.bz2')]
+                if ver in local_snaps else 'gcc-{}-none'.format(ver)
+                for ver in args.branches]
+    con.info('Connecting to {}'.format(args.mirror))
+    ftp = ftplib.FTP(args.mirror)
+    ftp.login()
+    sources = []
+    for ver in args.branches:
+        (tarball, _) = find_remote_snapshot(ftp, ver)
+        sources.append(tarball[:-len('.tar.bz2')] if tarball else
+                       'gcc-{}-none'.format(ver))
+    ftp.close()
+    return sources
+
+@catch_errors
+def print_fingerprint(args):
+    """Prints the fingerprint of the command (options and source versions,
+    used by build_queue.py to merge identical builds) as JSON"""
+    source = ', '.join(source_versions(args))
+    # Directories and the number of jobs do not affect the result
+    options = dict((k, v) for (k, v) in vars(args).items()
+                   if k not in ['build_dir', 'source_dir', 'jobs',
+                                'fingerprint'])
+    data = [sorted(options.items()), source]
+    print(json.dumps({ 'fingerprint': hashlib.sha1(json.dumps(data).encode(
+                                          'utf-8')).hexdigest(),
+                       'source': source }))
+
 @catch_errors
 def list_versions_on_ftp(args):
     con.info('Connecting to {}'.format(args.mirror))
@@ -315,6 +576,9 @@ def main():
             help='build and install specified GCC release(s)', nargs='*')
     ver_group.add_argument('-l', '--list', action='store_true',
             help='list versions available on FTP server')
+    ver_group.add_argument('--bisect', nargs=3, metavar=('VER', 'GOOD', 'BAD'),
+            help='find the snapshot of branch VER between dates GOOD and BAD '
+                 '(YYYYMMDD) which introduced a regression')
     parser.add_argument('--dest', default=cfg.install_dir,
             help='common install directory (default: %(default)s)')
     parser.add_argument('--build-dir', dest='build_dir', default=cfg.build_dir,
@@ -325,6 +589,9 @@ def main():
             help='FTP mirror hostname (default: %(default)s)')
     parser.add_argument('--snapdir', default=cfg.snapshot_dir,
             help='local directory for snapshot tarballs (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int,
+            default=multiprocessing.cpu_count(),
+            help='number of parallel build jobs (default: %(default)s)')
     bld_group = parser.add_mutually_exclusive_group()
     bld_group.add_argument('--checking', action='store_true', dest='checking',
             help='build checking version (by default, "release" version is built)')
@@ -337,9 +604,24 @@ def main():
             help='only download tarballs (do not start the build)')
     dl_group.add_argument('--build', action='store_true', dest='no_download',
             help='build GCC from downloaded tarballs (do not download new ones)')
+    parser.add_argument('--testcase',
+            help='testcase for --bisect (passed to the test script)')
+    parser.add_argument('--test',
+            help='interestingness check for --bisect. It is run as '
+                 '"TEST BIN_DIR TESTCASE" and must return 0 if the compiler '
+                 'in BIN_DIR exhibits the regression')
+    parser.add_argument('--fingerprint', action='store_true',
+            help='print the fingerprint of the command (used by '
+                 'build_queue.py to merge identical builds) and exit')
     args = parser.parse_args()
-    if args.list:
+    if args.bisect and (args.testcase is None or args.test is None):
+        parser.error('--bisect requires --testcase and --test')
+    if args.fingerprint:
+        print_fingerprint(args)
+    elif args.list:
         list_versions_on_ftp(args)
+    elif args.bisect:
+        bisect_snapshots(args)
     elif args.versions:
         update_releases(args)
     else:
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+# Store testsuite results (.sum files) of many builds in a compact indexed
+# database and query history of individual tests: when a test started
+# failing, on which branch and configuration.
+
+from __future__ import print_function
+
+# System
+import argparse
+import multiprocessing
+import os.path
+
+# Local
+from gcc.env import Environment
+from gcc.sumfile import BAD_STATUSES, find_sum_files, parse_sum
+from gcc.testdb import TestDB, parse_version
+
+env = Environment()
+con = env
+
+def get_db_path(args):
+    if args.db is not None:
+        return args.db
+    try:
+        from config import cfg
+        if cfg.test_db is not None:
+            return cfg.test_db
+    except ImportError:
+        pass
+    return os.path.expanduser(os.path.join('~', 'gcc', 'test_results'))
+
+def format_run(run):
+    if run is None:
+        return '-'
+    return '{} ({}, {}, {})'.format(run['label'], run.get('branch') or '?',
+                                    run.get('config'), run.get('date') or '?')
+
+def cmd_ingest(args):
+    paths = []
+    for path in args.inputs:
+        paths += find_sum_files(path).values()
+    if not paths:
+        env.fatal_error('No .sum files found')
+    pool = multiprocessing.Pool(min(args.jobs, len(paths)))
+    try:
+        sums = pool.map(parse_sum, paths)
+    finally:
+        pool.terminate()
+        pool.join()
+    info = {}
+    for sf in sums:
+        info = parse_version(sf.version_line)
+        if info:
+            break
+    for key in ['version', 'date', 'branch', 'kind']:
+        if getattr(args, key) is not None:
+            info[key] = getattr(args, key)
+    info['config'] = args.config
+    info['label'] = args.label or '-'.join(
+            [info.get('version', os.path.basename(os.path.abspath(
+                args.inputs[0])))] + ([info['date']] if info.get('date')
+                                      else []))
+    db = TestDB(get_db_path(args))
+    run = db.add_run(info, sums)
+    if run is None:
+        con.warn('Identical results are already stored')
+        return
+    con.ok('Added run {}: {}, {} result(s) in {} file(s), {} bytes'.format(
+            run['id'], format_run(run), sum(sf.num_results for sf in sums),
+            len(sums), run['size']))
+
+def cmd_runs(args):
+    db = TestDB(get_db_path(args))
+    for run in db.select_runs(args.branch, args.config, args.kind):
+        counts = db.results(run).counts()
+        print('{:>5} {:<40} {:>8} {:>6} {}'.format(
+                run['id'], format_run(run)[:40], counts['PASS'],
+                sum(counts[s] for s in BAD_STATUSES), run.get('kind', '')))
+
+def find_tests(args, db):
+    tests = db.find_tests(args.pattern)
+    if not tests:
+        env.fatal_error('No tests match "{}"'.format(args.pattern))
+    if len(tests) > args.limit:
+        con.warn('{} tests match, showing the first {}'.format(len(tests),
+                                                              args.limit))
+    return tests[:args.limit]
+
+def cmd_history(args):
+    db = TestDB(get_db_path(args))
+    runs = db.select_runs(args.branch, args.config, args.kind)
+    for tid in find_tests(args, db):
+        print(db.name(tid).replace('\t', ' | '))
+        # Consecutive runs with the same status are shown as a single line
+        spans = []
+        for (run, status) in db.history(tid, runs):
+            if spans and spans[-1][0] == status:
+                spans[-1][2] = run
+                spans[-1][3] += 1
+            else:
+                spans.append([status, run, run, 1])
+        for (status, first, last, count) in spans:
+            print('  {:<12} {:>4} run(s): {}{}'.format(
+                    status or 'not run', count, format_run(first),
+                    ' .. ' + format_run(last) if count > 1 else ''))
+
+def cmd_first_fail(args):
+    db = TestDB(get_db_path(args))
+    runs = db.select_runs(args.branch, args.config, args.kind)
+    found = False
+    for tid in find_tests(args, db):
+        res = db.first_failure(tid, runs)
+        if res is None:
+            continue
+        found = True
+        (last_good, first_bad) = res
+        print(db.name(tid).replace('\t', ' | '))
+        print('  first failing: {}'.format(format_run(first_bad)))
+        print('  last good:     {}'.format(format_run(last_good)))
+    if not found:
+        con.ok('No failing tests')
+
+def add_filter_args(parser):
+    parser.add_argument('-b', '--branch',
+                        help='only runs of BRANCH (e.g., trunk, 6, 4.9)')
+    parser.add_argument('-c', '--config', help='only runs of configuration')
+    parser.add_argument('-k', '--kind', choices=['snapshot', 'release'],
+                        help='only snapshot or release builds')
+
+def main():
+    parser = argparse.ArgumentParser(description='Historical testsuite '
+                                     'results')
+    parser.add_argument('--db', help='database directory (default: test_db in '
+                        'config.py or ~/gcc/test_results)')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    p = sub.add_parser('ingest', help='add results of a build')
+    p.add_argument('inputs', metavar='PATH', nargs='+',
+                   help='.sum files or directories containing them')
+    p.add_argument('-l', '--label',
+                   help='name of the run (default: version and date)')
+    p.add_argument('-c', '--config', default='default',
+                   help='build configuration (default: %(default)s)')
+    p.add_argument('-b', '--branch',
+                   help='branch (default: from the compiler version)')
+    p.add_argument('--version', help='compiler version (default: from .sum)')
+    p.add_argument('--date',
+                   help='snapshot date, YYYYMMDD (default: from .sum)')
+    p.add_argument('-k', '--kind', choices=['snapshot', 'release'],
+                   help='build kind (default: from .sum)')
+    p.add_argument('-j', '--jobs', type=int,
+                   default=multiprocessing.cpu_count(),
+                   help='number of parallel jobs (default: %(default)s)')
+    p.set_defaults(func=cmd_ingest)
+    p = sub.add_parser('runs', help='list runs')
+    add_filter_args(p)
+    p.set_defaults(func=cmd_runs)
+    for (name, func, desc) in [
+            ('history', cmd_history, 'show history of tests'),
+            ('first-fail', cmd_first_fail, 'find when tests started failing')]:
+        p = sub.add_parser(name, help=desc)
+        p.add_argument('pattern', metavar='REGEX',
+                       help='regular expression matched against test names '
+                       '(prefixed by tool, target board and .exp file)')
+        p.add_argument('-n', '--limit', type=int, default=20,
+                       help='maximal number of tests (default: %(default)s)')
+        add_filter_args(p)
+        p.set_defaults(func=func)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
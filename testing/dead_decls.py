@@ -0,0 +1,550 @@
+#!/usr/bin/env python
+
+# Remove unused declarations from preprocessed C/C++ source.
+#
+# The source is tokenized and split into top-level declarations (members of
+# namespaces and extern "C" blocks are treated as top-level ones). For each
+# declaration we guess the names it declares and collect the identifiers it
+# references. Declarations which come from the main file (according to line
+# markers) are roots; everything not reachable from the roots through the
+# references is removed. The analysis is conservative: names are not scoped
+# (any use of "foo" keeps all declarations of "foo"), and declarations whose
+# names cannot be determined are kept.
+#
+# Line markers and other directives are never removed (so that the rest of
+# the code stays attributed to the right files).
+
+from __future__ import print_function
+
+import sys
+import argparse
+import bisect
+import re
+
+try:
+    from sys import intern
+except ImportError:
+    def intern(s):
+        return s    # Python 2: builtin intern() does not accept unicode
+
+token_re = re.compile(r'''
+    (?P<directive>^[ \t]*\#[^\n]*)
+  | (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<raw>(?:u8|[uUL])?R"(?P<delim>[^(\s]*)\(.*?\)(?P=delim)")
+  | (?P<string>(?:u8|[uUL])?"(?:[^"\\\n]|\\.)*"|(?:u8|[uUL])?'(?:[^'\\\n]|\\.)*')
+  | (?P<number>\.?\d(?:[eEpP][+-]|[\w.'])*)
+  | (?P<ident>[A-Za-z_$][\w$]*)
+  | (?P<punct>::|->\*?|\.\*|\.\.\.|<=>|<<=|>>=|[-+*/%&|^!=<>]=|&&|\|\||<<|>>|\+\+|--|.)
+''', re.M | re.S | re.X)
+
+linemarker_re = re.compile(r'^[ \t]*#\s*(?:line\s+)?\d+\s+"((?:[^"\\]|\\.)*)"')
+ident_re = re.compile(r'^[A-Za-z_$][\w$]*$')
+
+class_keys = set(['class', 'struct', 'union', 'enum'])
+decl_prefixes = set(['__extension__', 'inline', 'export'])
+attr_keywords = set(['__attribute__', '__attribute', '__declspec', 'alignas',
+                     '_Alignas', '__asm__', '__asm', 'asm', 'throw',
+                     'noexcept', '__typeof__', 'typeof', 'decltype'])
+root_keywords = set(['static_assert', '_Static_assert', 'asm', '__asm__',
+                     '__asm'])
+# Specifiers of declarations, which are not definitions of variables with
+# (possibly) dynamic initialization
+var_specifiers = set(['typedef', 'extern', 'const', 'constexpr', 'constinit'])
+# Names which can be used implicitly by the compiler
+implicit_names = ['initializer_list', 'type_info', 'bad_alloc', 'bad_cast',
+                  'bad_typeid', 'bad_array_new_length', 'align_val_t',
+                  'nothrow_t', 'destroying_delete_t', 'tuple_size',
+                  'tuple_element', 'get', 'coroutine_traits',
+                  'coroutine_handle', 'strong_ordering', 'weak_ordering',
+                  'partial_ordering', 'source_location', 'begin', 'end',
+                  'main', '__cxa_atexit', '__dso_handle']
+
+def is_ident(tok):
+    return ident_re.match(tok) is not None
+
+class Source(object):
+    """Tokenized source. Tokens are stored in two parallel lists: texts and
+    start offsets"""
+
+    def __init__(self, text):
+        self.text = text
+        self.toks = []
+        self.pos = []
+        # Offsets where the current file changes, and whether it is the main
+        # file after that point
+        self._main_starts = [0]
+        self._main_flags = [True]
+        self.has_markers = False
+        main_file = None
+        for m in token_re.finditer(text):
+            kind = m.lastgroup
+            if kind in ('space', 'comment'):
+                continue
+            if kind == 'directive':
+                lm = linemarker_re.match(m.group(0))
+                if lm:
+                    fname = lm.group(1)
+                    if main_file is None:
+                        main_file = fname
+                        self.has_markers = True
+                    self._main_starts.append(m.end())
+                    self._main_flags.append(fname == main_file)
+                continue
+            tok = m.group(0)
+            self.toks.append(intern(tok) if kind == 'ident' else tok)
+            self.pos.append(m.start())
+
+    def end(self, i):
+        return self.pos[i] + len(self.toks[i])
+
+    def in_main(self, start, stop):
+        """Returns True if any part of tokens [start, stop) comes from the
+        main file"""
+        if not self.has_markers:
+            return True
+        lo = bisect.bisect_right(self._main_starts, self.pos[start]) - 1
+        hi = bisect.bisect_right(self._main_starts, self.pos[stop - 1]) - 1
+        return any(self._main_flags[lo:hi + 1])
+
+
+class Decl(object):
+    def __init__(self, start, stop):
+        self.start = start      # token range
+        self.stop = stop
+        self.names = set()
+        self.owner = None       # class name for out-of-class member definitions
+        self.root = False
+        self.live = False
+
+
+class Block(object):
+    """namespace or extern "C" block: header tokens [start, body), children,
+    closing brace at stop - 1"""
+    def __init__(self, start, body, stop, children, name):
+        self.start = start
+        self.body = body
+        self.stop = stop
+        self.children = children
+        self.name = name        # namespace name (None for extern "C")
+        self.used = False       # the namespace name is referenced
+
+    @property
+    def live(self):
+        return self.used or any(c.live for c in self.children)
+
+
+def skip_group(toks, i, n):
+    """Skips a balanced (), [], {} or <> group starting at i"""
+    opening = toks[i]
+    closing = {'(': ')', '[': ']', '{': '}', '<': '>'}[opening]
+    depth = 0
+    while i < n:
+        tok = toks[i]
+        if tok == opening:
+            depth += 1
+        elif tok == closing:
+            depth -= 1
+        elif closing == '>' and tok == '>>':
+            depth -= 2
+        elif closing != '>' and tok in '([{' and tok != opening:
+            i = skip_group(toks, i, n) - 1
+        if depth <= 0:
+            return i + 1
+        i += 1
+    return n
+
+def is_type_def(toks, start, brace):
+    """Returns True if tokens [start, brace) are a head of class/enum
+    definition (as opposed to a function definition)"""
+    i = start
+    last_key = -1
+    while i < brace:
+        tok = toks[i]
+        if tok == 'template' and i + 1 < brace and toks[i + 1] == '<':
+            i = skip_group(toks, i + 1, brace)
+            continue
+        if tok in class_keys:
+            last_key = i
+        elif tok == '(' and last_key >= 0:
+            return False
+        if tok in '([':
+            i = skip_group(toks, i, brace)
+            continue
+        i += 1
+    return last_key >= 0
+
+def has_initializer(toks, start, brace):
+    i = start
+    while i < brace:
+        if toks[i] == '=':
+            return True
+        if toks[i] in '([':
+            i = skip_group(toks, i, brace)
+            continue
+        i += 1
+    return False
+
+def parse(toks, i, n, items):
+    """Splits tokens into declarations and blocks, until a closing brace
+    at depth 0 (returns its index) or n"""
+    while i < n:
+        tok = toks[i]
+        if tok == '}':
+            return i
+        if tok == ';':
+            i += 1
+            continue
+        # namespace N {, inline namespace N {, extern "C" {
+        j = i
+        while j < n and toks[j] in ('inline', 'export'):
+            j += 1
+        is_block = False
+        name = None
+        if j < n and toks[j] == 'namespace':
+            k = j + 1
+            name = None
+            while k < n and toks[k] not in attr_keywords and \
+                    (is_ident(toks[k]) or toks[k] == '::'):
+                name = toks[k] if toks[k] != '::' else name
+                k += 1
+            while k < n and toks[k] in attr_keywords | set(['[']):
+                k = skip_group(toks, k + 1, n) if toks[k] != '[' \
+                        else skip_group(toks, k, n)
+            is_block = k < n and toks[k] == '{'
+        elif tok == 'extern' and i + 2 < n and toks[i + 1].startswith('"') \
+                and toks[i + 2] == '{':
+            k = i + 2
+            is_block = True
+        if is_block:
+            children = []
+            close = parse(toks, k + 1, n, children)
+            items.append(Block(i, k + 1, min(close + 1, n), children, name))
+            i = close + 1
+            continue
+        # Ordinary declaration
+        j = i
+        while j < n:
+            tok = toks[j]
+            if tok == ';':
+                j += 1
+                break
+            if tok == '}':
+                break   # unbalanced, stop here
+            if tok == '{':
+                end = skip_group(toks, j, n)
+                if end < n and toks[end] == ';':
+                    j = end + 1
+                    break
+                if is_type_def(toks, i, j) or has_initializer(toks, i, j):
+                    j = end
+                    continue
+                j = end
+                break
+            if tok in '([':
+                j = skip_group(toks, j, n)
+                continue
+            j += 1
+        if j == i:
+            j = i + 1
+        items.append(Decl(i, j))
+        i = j
+    return n
+
+def analyze(toks, decl):
+    """Fills decl.names, decl.owner and decl.root"""
+    i = decl.start
+    n = decl.stop
+    # Skip template headers, prefixes and attributes
+    is_template = False
+    while i < n:
+        tok = toks[i]
+        if tok == 'template' and i + 1 < n and toks[i + 1] == '<':
+            i = skip_group(toks, i + 1, n)
+            is_template = True
+        elif tok == 'extern' and i + 1 < n and toks[i + 1].startswith('"'):
+            i += 2
+        elif tok in decl_prefixes:
+            i += 1
+        elif tok == '[' and i + 1 < n and toks[i + 1] == '[':
+            i = skip_group(toks, i, n)
+        elif tok in attr_keywords and i + 1 < n and toks[i + 1] == '(':
+            i = skip_group(toks, i + 1, n)
+        else:
+            break
+    if i >= n or toks[i] in root_keywords:
+        decl.root = True
+        return
+    if toks[i] == 'using':
+        if i + 1 < n and toks[i + 1] == 'namespace':
+            decl.root = True
+        elif i + 2 < n and toks[i + 2] == '=':
+            decl.names.add(toks[i + 1])
+        else:
+            idents = [t for t in toks[i:n] if is_ident(t)]
+            if len(idents) > 1:
+                decl.names.add(idents[-1])
+        return
+    if toks[i] == 'namespace':
+        # namespace alias
+        if i + 1 < n and is_ident(toks[i + 1]):
+            decl.names.add(toks[i + 1])
+        return
+    class_key = None
+    after_init = False
+    is_var = False
+    specifiers = set()
+    j = i
+    while j < n:
+        tok = toks[j]
+        nxt = toks[j + 1] if j + 1 < n else ';'
+        if tok in attr_keywords and nxt == '(':
+            j = skip_group(toks, j + 1, n)
+            continue
+        if tok == '[' and nxt == '[':
+            j = skip_group(toks, j, n)
+            continue
+        if tok == '=':
+            after_init = True
+        elif tok == ',':
+            after_init = False
+        if after_init and tok != '=':
+            if tok in '([{':
+                j = skip_group(toks, j, n)
+                continue
+            j += 1
+            continue
+        if tok in class_keys:
+            class_key = tok
+            k = j + 1
+            while k < n and toks[k] in ('class', 'struct'):   # enum class
+                k += 1
+            while k < n and (toks[k] in attr_keywords or toks[k] == '['):
+                k = skip_group(toks, k + 1 if toks[k] != '[' else k, n)
+            if k < n and is_ident(toks[k]):
+                if k + 1 >= n or toks[k + 1] in ('{', ';', ':', '<', 'final'):
+                    decl.names.add(toks[k])
+                k += 1
+            if k < n and toks[k] in ('<', ':', 'final'):
+                # Template arguments of a specialization, base classes
+                while k < n and toks[k] not in ('{', ';'):
+                    k = skip_group(toks, k, n) if toks[k] in '([' else k + 1
+            if k < n and toks[k] == '{' and class_key != 'enum':
+                k = skip_group(toks, k, n)
+            j = k
+            continue
+        elif tok == 'operator':
+            k = j + 1
+            op = []
+            while k < n and toks[k] != '(':
+                op.append(toks[k])
+                k += 1
+            if k + 1 < n and toks[k + 1] == ')' and not op:
+                op = ['()']
+            decl.names.add('operator' + ''.join(op))
+            if j > i + 1 and toks[j - 1] == '::' and is_ident(toks[j - 2]):
+                decl.owner = toks[j - 2]
+            j = k
+            continue
+        elif tok == '{' and class_key == 'enum':
+            # Enumerators
+            end = skip_group(toks, j, n)
+            for k in range(j + 1, end - 1):
+                if is_ident(toks[k]) and toks[k + 1] in (',', '=', '}') and \
+                        toks[k - 1] in ('{', ','):
+                    decl.names.add(toks[k])
+            j = end
+            continue
+        elif tok == '<' and j > i and is_ident(toks[j - 1]):
+            j = skip_group(toks, j, n)
+            continue
+        elif is_ident(tok) and (nxt in (';', ',', '=', '[', '(', '{', ':') or
+                                nxt in attr_keywords):
+            if j > i and toks[j - 1] == '::':
+                if j > i + 1 and is_ident(toks[j - 2]):
+                    decl.owner = toks[j - 2]
+            elif nxt != ':' or class_key is None:
+                decl.names.add(tok)
+                is_var = is_var or nxt != '('
+        elif tok in var_specifiers:
+            specifiers.add(tok)
+        if tok in '([{':
+            j = skip_group(toks, j, n)
+            continue
+        j += 1
+    if decl.owner is not None:
+        decl.names = set([nm for nm in decl.names if nm.startswith('operator')])
+    if not decl.names and decl.owner is None:
+        decl.root = True
+    # Definitions of variables can have dynamic initialization (e.g.,
+    # static ios_base::Init __ioinit), keep them
+    if is_var and not is_template and not specifiers:
+        decl.root = True
+
+def flatten(items, decls, blocks):
+    for item in items:
+        if isinstance(item, Block):
+            blocks.append(item)
+            flatten(item.children, decls, blocks)
+        else:
+            decls.append(item)
+
+def mark_live(src, decls, blocks):
+    toks = src.toks
+    by_name = {}
+    by_owner = {}
+    work = []
+    namespaces = {}
+    for block in blocks:
+        if block.name is not None:
+            namespaces.setdefault(block.name, []).append(block)
+    for decl in decls:
+        analyze(toks, decl)
+        for name in decl.names:
+            by_name.setdefault(name, []).append(decl)
+        if decl.owner is not None:
+            by_owner.setdefault(decl.owner, []).append(decl)
+        if decl.root or src.in_main(decl.start, decl.stop):
+            decl.live = True
+            work.append(decl)
+    seen = set()
+
+    def use(name):
+        if name in seen:
+            return
+        seen.add(name)
+        for block in namespaces.get(name, []):
+            block.used = True
+        for d in by_name.get(name, []) + by_owner.get(name, []):
+            if not d.live:
+                d.live = True
+                work.append(d)
+
+    for name in implicit_names:
+        use(name)
+    while work:
+        decl = work.pop()
+        if decl.owner is not None:
+            use(decl.owner)
+        for i in range(decl.start, decl.stop):
+            tok = toks[i]
+            if is_ident(tok):
+                use(tok)
+                if tok in ('new', 'delete'):
+                    use('operator' + tok)
+                    use('operator' + tok + '[]')
+            elif not tok[0].isdigit() and tok[0] not in '"\'':
+                use('operator' + tok)
+
+def render(src, items):
+    """Returns the source without dead declarations"""
+    text = src.text
+    out = []
+    pos = 0
+
+    def remove(start, stop):
+        # Remove whole lines, if the declaration occupies them
+        s = src.pos[start]
+        e = src.end(stop - 1)
+        ls = s
+        while ls > 0 and text[ls - 1] in ' \t':
+            ls -= 1
+        if ls == 0 or text[ls - 1] == '\n':
+            s = ls
+        le = e
+        while le < len(text) and text[le] in ' \t':
+            le += 1
+        if le < len(text) and text[le] == '\n' and s == ls:
+            e = le + 1
+        # Keep directives
+        for line in text[s:e].split('\n'):
+            if line.lstrip().startswith('#'):
+                out.append(line + '\n')
+        return e
+
+    def walk(items):
+        for item in items:
+            if isinstance(item, Block):
+                if item.live:
+                    for r in walk(item.children):
+                        yield r
+                else:
+                    yield (item.start, item.stop)
+            elif not item.live:
+                yield (item.start, item.stop)
+
+    for (start, stop) in walk(items):
+        s = src.pos[start]
+        if s < pos:
+            continue
+        # Text before the removed range (up to the beginning of the line, if
+        # the range starts a line)
+        ls = s
+        while ls > pos and text[ls - 1] in ' \t':
+            ls -= 1
+        out.append(text[pos:ls] if ls == pos or text[ls - 1] == '\n'
+                   else text[pos:s])
+        pos = remove(start, stop)
+    out.append(text[pos:])
+    return ''.join(out)
+
+def strip_dead_decls(text):
+    """Returns (text without dead declarations, number of removed
+    declarations)"""
+    src = Source(text)
+    items = []
+    parse(src.toks, 0, len(src.toks), items)
+    decls = []
+    blocks = []
+    flatten(items, decls, blocks)
+    if not src.has_markers:
+        sys.stderr.write('dead_decls: no line markers found, all declarations '
+                         'are considered used\n')
+    mark_live(src, decls, blocks)
+    removed = len([d for d in decls if not d.live])
+    if not removed:
+        return (text, 0)
+    return (render(src, items), removed)
+
+def strip_dead_decls_fixpoint(text, iterate=False, report=None):
+    """Removes dead declarations, repeatedly if iterate is True, until
+    nothing changes. report is called with (pass number, removed declarations,
+    size before, size after)"""
+    pass_num = 0
+    while True:
+        pass_num += 1
+        (new_text, removed) = strip_dead_decls(text)
+        if report is not None:
+            report(pass_num, removed, text, new_text)
+        if not iterate or not removed or new_text == text:
+            return new_text
+        text = new_text
+
+def report_size(pass_num, removed, old, new):
+    old_lines = old.count('\n')
+    new_lines = new.count('\n')
+    sys.stderr.write('dead_decls: pass {}: removed {} declarations, lines: '
+                     '{} -> {} ({:.1f}%), bytes: {} -> {} ({:.1f}%)\n'.format(
+                        pass_num, removed, old_lines, new_lines,
+                        100.0 * new_lines / max(old_lines, 1),
+                        len(old), len(new), 100.0 * len(new) / max(len(old), 1)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove declarations not '
+                                     'used by the main file from preprocessed '
+                                     'C/C++ source')
+    parser.add_argument('input', metavar='INPUT', type=argparse.FileType('r'),
+                        help='input file name')
+    parser.add_argument('-o', '--output',
+                        metavar='OUTPUT', type=argparse.FileType('w'),
+                        default=sys.stdout,
+                        help='output file name (stdout, if omitted)')
+    parser.add_argument('-f', '--fixpoint', action='store_true',
+                        help='repeat until nothing changes')
+    args = parser.parse_args()
+    text = strip_dead_decls_fixpoint(args.input.read(), args.fixpoint,
+                                     report_size)
+    args.output.write(text)
+
+if __name__ == '__main__':
+    main()
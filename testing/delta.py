@@ -0,0 +1,775 @@
+#!/usr/bin/env python
+
+# Parallel implementation of the delta debugging algorithm (ddmin), compatible
+# with fortran_delta.pl: the same complement loop and the same (Fortran-aware)
+# granularity increase.
+#
+# Differences from fortran_delta.pl:
+# * candidates of the complement loop are tested speculatively in parallel,
+#   assuming that they fail (which is the common case). When a candidate
+#   passes, the results for the subsequent ones are discarded, so the
+#   sequence of reductions is the same as in the sequential algorithm
+# * each test runs in its own temporary directory
+# * test results are cached on disk, the key is a hash of the rendered input
+#   (and the test itself), so the cache survives interruptions. Timed out
+#   runs are not cached
+# * the state is checkpointed after each successful reduction. Restarting
+#   delta.py with the same input and work directory resumes the reduction
+
+from __future__ import print_function
+
+import os, os.path
+import argparse
+import bisect
+import collections
+import hashlib
+import json
+import multiprocessing
+import random
+import re
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+class DeltaError(Exception): pass
+
+quiet = False
+
+def output(msg):
+    if not quiet:
+        print(msg)
+        sys.stdout.flush()
+
+def read_input_chunks(path):
+    with open(path, 'rb') as f:
+        return f.readlines()
+
+def render(chunks, markers):
+    return b''.join([b''.join(chunks[start:stop]) for (start, stop) in markers])
+
+def count_lines(chunks, markers):
+    return sum([stop - start for (start, stop) in markers])
+
+def hash_file(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class ScriptTest(object):
+    """Interestingness test implemented as an external program. It is run
+    in a directory containing only the candidate file and receives its name
+    as the only argument. Zero exit status means "interesting"."""
+
+    def __init__(self, path):
+        self._path = os.path.abspath(path)
+
+    @property
+    def identity(self):
+        """A string, which changes when the test changes (used as a part of
+        cache key)"""
+        return self._path + ':' + hash_file(self._path)
+
+    def run(self, work_dir, fname, register):
+        proc = subprocess.Popen([self._path, fname], cwd=work_dir,
+                                preexec_fn=os.setsid)
+        register(proc)
+        return proc.wait() == 0
+
+
+ansi_color_re = re.compile(br'\x1b\[[0-9;]*[mK]')
+
+class CompilerTest(object):
+    """Built-in interestingness test: runs the compiler on the candidate and
+    streams its stderr. As soon as the expected signature (e.g., "internal
+    compiler error: in foo, at bar.c:123") appears, the whole process group is
+    killed and the candidate is considered interesting. Runs which take longer
+    than timeout_factor times the runtime of the original input are killed
+    and considered uninteresting. The timeout depends on the machine load, so
+    such results are inconclusive (run returns None) and are not cached."""
+
+    def __init__(self, command, signature, timeout_factor, min_timeout):
+        self._cmd = shlex.split(command)
+        self._signature = signature.encode('utf-8')
+        self._timeout_factor = timeout_factor
+        self._min_timeout = min_timeout
+        self._lock = threading.Lock()
+        self.timeout = None
+        self.num_early = 0
+        self.num_timeouts = 0
+
+    @property
+    def identity(self):
+        return ' '.join(self._cmd) + '\0' + self._signature.decode('utf-8')
+
+    def calibrate(self, seconds):
+        """Sets the timeout according to the runtime of the original input"""
+        if self.timeout is None:
+            self.timeout = max(self._min_timeout, seconds * self._timeout_factor)
+            output('Test timeout: {:.1f} sec'.format(self.timeout))
+
+    @staticmethod
+    def _kill(proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def run(self, work_dir, fname, register):
+        with open(os.devnull, 'wb') as devnull:
+            proc = subprocess.Popen(self._cmd + [fname], cwd=work_dir,
+                                    stdin=devnull, stdout=devnull,
+                                    stderr=subprocess.PIPE,
+                                    preexec_fn=os.setsid)
+        register(proc)
+        timed_out = []
+        timer = None
+        if self.timeout is not None:
+            def on_timeout():
+                timed_out.append(True)
+                self._kill(proc)
+            timer = threading.Timer(self.timeout, on_timeout)
+            timer.start()
+        found = False
+        for line in iter(proc.stderr.readline, b''):
+            if self._signature in ansi_color_re.sub(b'', line):
+                found = True
+                self._kill(proc)
+                break
+        proc.stderr.close()
+        proc.wait()
+        if timer is not None:
+            timer.cancel()
+        with self._lock:
+            if found and proc.returncode < 0:
+                self.num_early += 1
+            if timed_out and not found:
+                self.num_timeouts += 1
+        if timed_out and not found:
+            return None
+        return found
+
+
+class TestCache(object):
+    """Append-only on-disk cache of test results"""
+
+    def __init__(self, path):
+        self._path = path
+        self._results = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2 and parts[1] in ['0', '1']:
+                        self._results[parts[0]] = parts[1] == '1'
+        self._file = open(path, 'a')
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        return self._results.get(key)
+
+    def put(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._file.write('{} {}\n'.format(key, int(result)))
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class TestRunner(object):
+    """Runs tests in parallel, each one in an isolated temporary directory"""
+
+    def __init__(self, test, work_dir, suffix, jobs):
+        self._test = test
+        self._identity = test.identity.encode('utf-8')
+        self._arena = os.path.join(work_dir, 'arena')
+        if not os.path.isdir(self._arena):
+            os.makedirs(self._arena)
+        self._suffix = suffix
+        self._jobs = jobs
+        self._pool = ThreadPool(jobs)
+        self._cache = TestCache(os.path.join(work_dir, 'cache'))
+        self._times_path = os.path.join(work_dir, 'times')
+        self._calibrate(self._times_path)
+        self._times = open(self._times_path, 'a')
+        self._lock = threading.Lock()
+        self._procs = {}
+        self._active = set()
+        self._cancelled = set()
+        self._next_id = 0
+        self.num_tests = 0
+        self.num_cached = 0
+        self.num_cancelled = 0
+        self.test_time = 0.0
+
+    def _calibrate(self, times_path):
+        # The first record in the log of test times is the original input
+        if not hasattr(self._test, 'calibrate') or not os.path.exists(times_path):
+            return
+        with open(times_path, 'r') as f:
+            parts = f.readline().split()
+        if len(parts) == 3 and parts[1] == '1':
+            self._test.calibrate(float(parts[2]))
+
+    @property
+    def jobs(self):
+        return self._jobs
+
+    def key(self, content):
+        return hashlib.sha1(self._identity + b'\0' + content).hexdigest()
+
+    def cached(self, content):
+        result = self._cache.get(self.key(content))
+        if result is not None:
+            self.num_cached += 1
+        return result
+
+    def _run(self, task_id, key, content):
+        with self._lock:
+            if task_id in self._cancelled:
+                self._cancelled.discard(task_id)
+                self._active.discard(task_id)
+                return None
+        test_dir = tempfile.mkdtemp(dir=self._arena)
+        fname = 'input' + self._suffix
+        with open(os.path.join(test_dir, fname), 'wb') as f:
+            f.write(content)
+
+        def register(proc):
+            with self._lock:
+                self._procs[task_id] = proc
+                cancelled = task_id in self._cancelled
+            if cancelled:
+                self._kill(proc)
+
+        start = time.time()
+        try:
+            result = self._test.run(test_dir, fname, register)
+        finally:
+            shutil.rmtree(test_dir, ignore_errors=True)
+            with self._lock:
+                self._procs.pop(task_id, None)
+                self._active.discard(task_id)
+                cancelled = task_id in self._cancelled
+                self._cancelled.discard(task_id)
+        if cancelled:
+            return None
+        # None means an inconclusive (e.g., timed out) uninteresting run
+        inconclusive = result is None
+        result = bool(result)
+        elapsed = time.time() - start
+        with self._lock:
+            self.test_time += elapsed
+            self._times.write('{} {} {:.3f}\n'.format(key, int(result), elapsed))
+            self._times.flush()
+        if result and hasattr(self._test, 'calibrate'):
+            self._test.calibrate(elapsed)
+        if not inconclusive:
+            self._cache.put(key, result)
+        return result
+
+    @staticmethod
+    def _kill(proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def submit(self, content):
+        """Starts the test asynchronously. Returns a (task_id, AsyncResult)
+        pair. Result of a cancelled test is None"""
+        with self._lock:
+            task_id = self._next_id
+            self._next_id += 1
+            self._active.add(task_id)
+        self.num_tests += 1
+        return (task_id, self._pool.apply_async(self._run,
+                                    (task_id, self.key(content), content)))
+
+    def cancel(self, task_ids):
+        with self._lock:
+            for task_id in task_ids:
+                if task_id not in self._active:
+                    continue
+                self._cancelled.add(task_id)
+                self.num_cancelled += 1
+                proc = self._procs.get(task_id)
+                if proc is not None:
+                    self._kill(proc)
+
+    def run(self, content):
+        result = self.cached(content)
+        if result is not None:
+            return result
+        return self.submit(content)[1].get()
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self._cache.close()
+        self._times.close()
+
+
+# Likely boundaries of Fortran program units and statements. For each kind
+# the first regex matches both the beginning and the end, the second one
+# matches the end (which should stay in the first chunk)
+boundary_res = [(re.compile(br'[ |^]module ', re.I), re.compile(br'end\smodule', re.I)),
+                (re.compile(br'[ |^]subroutine ', re.I), re.compile(br'end\ssubroutine', re.I)),
+                (re.compile(br'if', re.I), re.compile(br'end\sif', re.I)),
+                (re.compile(br'do', re.I), re.compile(br'end\sdo', re.I))]
+
+def split_lines(chunks, markers):
+    """Same as increase_granularity in fortran_delta.pl: split each marker
+    at a random point, adjusted to a likely module/subroutine/if/do boundary.
+    Returns None if no markers could be split"""
+    new_markers = []
+    split_one = False
+    for (start, stop) in markers:
+        interval = stop - start
+        if interval > 2:
+            half = int(start + random.random() * interval)
+            if half == start:
+                half += 1
+        else:
+            half = (start + stop) // 2
+        found = -1
+        for (any_re, end_re) in boundary_res:
+            if found >= 0 or random.random() <= 0.1:
+                continue
+            for i in range(half, start, -1):
+                if any_re.search(chunks[i]):
+                    if end_re.search(chunks[i]):
+                        if i + 1 < stop:
+                            found = i + 1
+                            break
+                    else:
+                        found = i
+                        break
+        if found > 0 and random.random() > 0.1:
+            half = found
+        if half == start or half == stop:
+            new_markers.append((start, stop))
+        else:
+            split_one = True
+            new_markers.append((start, half))
+            new_markers.append((half, stop))
+    return new_markers if split_one else None
+
+
+# Hierarchical mode: the input is split along the nesting structure (braces
+# for C/C++, program units and block constructs for Fortran, BEGIN...END).
+# Level k allows cuts only at line boundaries, where nesting depth is at most
+# k and the previous line ends a statement. Levels are reduced top-down, so
+# whole functions and namespaces are removed first, and only then their
+# contents. Line granularity is used as the last level.
+
+c_token_re = re.compile(br'/\*|\*/|//|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|[{}]')
+
+def nesting_c(chunks):
+    """Returns a list of (depth at start of line, line ends a statement)
+    pairs for C/C++ source"""
+    res = []
+    depth = 0
+    in_comment = False
+    for line in chunks:
+        start_depth = depth
+        stripped = line.strip()
+        if not in_comment and stripped.startswith(b'#'):
+            res.append((depth, True))
+            continue
+        last = None
+        pos = 0
+        while True:
+            if in_comment:
+                end = line.find(b'*/', pos)
+                if end < 0:
+                    break
+                in_comment = False
+                pos = end + 2
+                continue
+            m = c_token_re.search(line, pos)
+            if m is None:
+                if line[pos:].strip():
+                    last = line[pos:].strip()[-1:]
+                break
+            if line[pos:m.start()].strip():
+                last = line[pos:m.start()].strip()[-1:]
+            tok = m.group(0)
+            pos = m.end()
+            if tok == b'//':
+                break
+            elif tok == b'/*':
+                in_comment = True
+            elif tok == b'{':
+                depth += 1
+                last = tok
+            elif tok == b'}':
+                depth = max(depth - 1, 0)
+                last = tok
+            elif tok != b'*/':
+                last = tok[-1:]
+        res.append((start_depth,
+                    not in_comment and (last is None or last in b';{}')))
+    return res
+
+# Parenthesized expression (up to three levels of parentheses): single-line
+# "where (mask) x = f(y)" must not match as the header of a block
+_parens = br'\((?:[^()]|\((?:[^()]|\([^()]*\))*\))*\)'
+kw_open_re = re.compile(br'^(?:\d+\s+)?(?:[a-z_]\w*\s*:\s*)?(?:'
+                        br'(?:(?!end)[\w\s*(),=]*\s)?(?:subroutine|function)\b|'
+                        br'(?:program|submodule|interface|abstract\s+interface|'
+                        br'block|associate|critical|enum|begin)\b|'
+                        br'module\s+(?!procedure\b)\w+\s*$|'
+                        br'type\s*(?:,[^:]*)?(?:::)?\s*\w+\s*$|'
+                        br'do\b(?!\s*\d)|select\s*(?:case|type)\b|'
+                        br'if\s*\(.*\)\s*then\s*$|'
+                        br'(?:where|forall)\s*' + _parens + br'\s*$)')
+kw_close_re = re.compile(br'^(?:\d+\s+)?end(?:\s*\w+)?\s*(?:\w+)?\s*;?\s*$')
+kw_middle_re = re.compile(br'^(?:\d+\s+)?(?:else|case|contains|type\s+is|class\s+is)\b')
+kw_comment_re = re.compile(br'!.*$')
+
+def nesting_keywords(chunks):
+    """Same as nesting_c, for Fortran (and other languages with BEGIN...END
+    style blocks)"""
+    res = []
+    depth = 0
+    for line in chunks:
+        text = kw_comment_re.sub(b'', line).strip().lower()
+        start_depth = depth
+        if kw_close_re.match(text):
+            depth = max(depth - 1, 0)
+        elif kw_middle_re.match(text):
+            start_depth = max(depth - 1, 0)
+        elif kw_open_re.match(text):
+            depth += 1
+        res.append((start_depth, not text.endswith(b'&')))
+    return res
+
+lang_by_suffix = { '.c': 'c', '.i': 'c', '.h': 'c', '.cc': 'c', '.cp': 'c',
+                   '.cxx': 'c', '.cpp': 'c', '.c++': 'c', '.ii': 'c',
+                   '.hh': 'c', '.hpp': 'c', '.C': 'c',
+                   '.f': 'fortran', '.for': 'fortran', '.f90': 'fortran',
+                   '.f95': 'fortran', '.f03': 'fortran', '.f08': 'fortran' }
+
+def get_lang(suffix):
+    return lang_by_suffix.get(suffix, lang_by_suffix.get(suffix.lower()))
+
+
+class HierarchicalSplit(object):
+    """Granularity increase which follows the nesting levels. Callable like
+    split_lines"""
+
+    def __init__(self, chunks, lang):
+        nesting = nesting_c(chunks) if lang == 'c' else nesting_keywords(chunks)
+        max_depth = max([d for (d, _) in nesting] + [0])
+        self._cuts = []
+        for level in range(max_depth + 1):
+            self._cuts.append([i for i in range(1, len(chunks))
+                               if nesting[i][0] <= level and nesting[i - 1][1]])
+        self.state = 0  # current level, len(self._cuts) means "lines"
+
+    @property
+    def num_levels(self):
+        return len(self._cuts)
+
+    @staticmethod
+    def _split_at(markers, cuts):
+        new_markers = []
+        split_one = False
+        for (start, stop) in markers:
+            lo = bisect.bisect_right(cuts, start)
+            hi = bisect.bisect_left(cuts, stop)
+            if lo >= hi:
+                new_markers.append((start, stop))
+                continue
+            mid = (start + stop) // 2
+            half = min(cuts[lo:hi], key=lambda c: abs(c - mid))
+            split_one = True
+            new_markers.append((start, half))
+            new_markers.append((half, stop))
+        return new_markers if split_one else None
+
+    def __call__(self, chunks, markers):
+        while self.state < len(self._cuts):
+            new_markers = self._split_at(markers, self._cuts[self.state])
+            if new_markers is not None:
+                return new_markers
+            self.state += 1
+            if self.state < len(self._cuts):
+                output('Nesting level {}'.format(self.state))
+            else:
+                output('Line granularity')
+        return split_lines(chunks, markers)
+
+
+class Reducer(object):
+    def __init__(self, chunks, runner, work_dir, suffix, split=split_lines):
+        self._chunks = chunks
+        self._runner = runner
+        self._work_dir = work_dir
+        self._suffix = suffix
+        self._split = split
+        self._input_hash = hashlib.sha1(b''.join(chunks)).hexdigest()
+        self._checkpoint = os.path.join(work_dir, 'checkpoint.json')
+        self._log = open(os.path.join(work_dir, 'log'), 'a')
+        self._start_time = time.time()
+        self.markers = [(0, len(chunks))]
+        # Number of tests which the sequential algorithm would run
+        self.num_tests = 0
+
+    def _log_msg(self, msg):
+        self._log.write('{:<39} {:.0f} sec\t{}\n'.format(msg,
+                            time.time() - self._start_time, time.ctime()))
+        self._log.flush()
+
+    @property
+    def best_path(self):
+        return os.path.join(self._work_dir, 'best' + self._suffix)
+
+    def _save(self):
+        with open(self.best_path + '.tmp', 'wb') as f:
+            f.write(render(self._chunks, self.markers))
+        os.rename(self.best_path + '.tmp', self.best_path)
+        state = { 'input_hash': self._input_hash, 'markers': self.markers,
+                  'split_state': getattr(self._split, 'state', None) }
+        with open(self._checkpoint + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.rename(self._checkpoint + '.tmp', self._checkpoint)
+
+    def resume(self):
+        """Restores the markers from the checkpoint, if it matches the input"""
+        if not os.path.exists(self._checkpoint):
+            return False
+        with open(self._checkpoint, 'r') as f:
+            state = json.load(f)
+        if state.get('input_hash') != self._input_hash:
+            output('Checkpoint does not match the input, ignoring it')
+            return False
+        self.markers = [tuple(m) for m in state['markers']]
+        if state.get('split_state') is not None:
+            self._split.state = state['split_state']
+        output('Resuming from checkpoint, lines: {}'.format(
+                    count_lines(self._chunks, self.markers)))
+        return True
+
+    def _test(self, markers):
+        self.num_tests += 1
+        return self._runner.run(render(self._chunks, markers))
+
+    def _success(self, markers):
+        self.markers = markers
+        lines = count_lines(self._chunks, markers)
+        output('\tSUCCESS, lines: {} ****************'.format(lines))
+        self._log_msg('lines: {}'.format(lines))
+        self._save()
+
+    @staticmethod
+    def _check_stop():
+        if os.path.exists('DELTA-STOP'):
+            raise DeltaError('Stopping because DELTA-STOP file exists')
+
+    def _complement_pass(self):
+        """One pass of the complement loop. Candidates are tested in the same
+        order as in fortran_delta.pl (in reverse), up to runner.jobs of them
+        are run speculatively, assuming that the previous ones fail. Returns
+        True, if any markers were removed"""
+        markers = self.markers
+        excluded = set()
+        order = list(reversed(range(len(markers))))
+        pending = collections.deque()
+        pos = 0
+        while pos < len(order) or pending:
+            # Fill the window
+            while pos < len(order) and len(pending) < self._runner.jobs:
+                self._check_stop()
+                idx = order[pos]
+                pos += 1
+                cand = [m for (i, m) in enumerate(markers)
+                        if i != idx and i not in excluded]
+                content = render(self._chunks, cand)
+                result = self._runner.cached(content)
+                if result is not None:
+                    pending.append((idx, cand, None, result))
+                else:
+                    (task_id, async_res) = self._runner.submit(content)
+                    pending.append((idx, cand, task_id, async_res))
+                if result:
+                    break
+            (idx, cand, task_id, res) = pending.popleft()
+            result = res if task_id is None else res.get()
+            self.num_tests += 1
+            if result:
+                excluded.add(idx)
+                self._success(cand)
+                # The rest of the window was computed without this exclusion
+                self._runner.cancel([p[2] for p in pending if p[2] is not None])
+                pos -= len(pending)
+                pending.clear()
+        return bool(excluded)
+
+    def reduce(self):
+        if not self._chunks:
+            raise DeltaError('The input must consist of at least one chunk.')
+        if not self._test(self.markers):
+            raise DeltaError('FAIL: The initial input does not pass the test.')
+        self._save()
+        self._log_msg('delta start')
+        while True:
+            output('Markers: {}, lines: {}'.format(len(self.markers),
+                        count_lines(self._chunks, self.markers)))
+            while self._complement_pass():
+                pass
+            new_markers = self._split(self._chunks, self.markers)
+            if new_markers is None:
+                break
+            output('Increase granularity')
+            self.markers = new_markers
+            self._save()
+        self._log_msg('delta done')
+
+
+def reduce_file(args, chunks, work_dir, hierarchical):
+    """Runs the reduction, returns the reducer and the test runner"""
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    if args.compile is not None:
+        test = CompilerTest(args.compile, args.ice, args.timeout_factor,
+                            args.min_timeout)
+    else:
+        test = ScriptTest(args.test)
+    runner = TestRunner(test, work_dir, args.suffix, max(args.jobs, 1))
+    split = split_lines
+    if hierarchical:
+        split = HierarchicalSplit(chunks, args.lang)
+        output('Nesting levels: {}'.format(split.num_levels))
+    reducer = Reducer(chunks, runner, work_dir, args.suffix, split)
+    if not args.restart:
+        reducer.resume()
+    start = time.time()
+    try:
+        reducer.reduce()
+    finally:
+        runner.close()
+    output('Could not increase granularity; we are done.')
+    output('Tests: {} (sequential), {} run, {} cached, {} cancelled; '
+           'time: {:.1f} sec'.format(reducer.num_tests, runner.num_tests,
+                                     runner.num_cached, runner.num_cancelled,
+                                     time.time() - start))
+    output('Test time: {:.1f} sec total, {:.3f} sec per test'.format(
+                runner.test_time,
+                runner.test_time / max(runner.num_tests - runner.num_cancelled, 1)))
+    if isinstance(test, CompilerTest):
+        output('Aborted on signature match: {}, timed out: {}'.format(
+                    test.num_early, test.num_timeouts))
+    return reducer
+
+
+def main():
+    global quiet
+    parser = argparse.ArgumentParser(description='Parallel delta debugging '
+                                     '(ddmin) with persistent test cache')
+    parser.add_argument('input', metavar='INPUT', help='input file name')
+    test_group = parser.add_mutually_exclusive_group(required=True)
+    test_group.add_argument('-t', '--test',
+                        help='interestingness test. It is run in a directory '
+                        'containing only the candidate file and gets its name '
+                        'as the argument. Must return 0 for interesting inputs')
+    test_group.add_argument('-c', '--compile', metavar='CMD',
+                        help='use built-in test: run compiler command CMD '
+                        '(e.g., "gcc -O3 -c") on the candidate and look for '
+                        'the --ice signature in its stderr')
+    parser.add_argument('-e', '--ice', metavar='SIGNATURE',
+                        help='diagnostic which makes the candidate interesting '
+                        '(e.g., "internal compiler error: in foo, at '
+                        'bar.c:123"). The compiler is killed as soon as it '
+                        'is printed')
+    parser.add_argument('--timeout-factor', type=float, default=3.0,
+                        dest='timeout_factor',
+                        help='kill the compiler after this many times the '
+                        'runtime of the original input (default: '
+                        '%(default)s)')
+    parser.add_argument('--min-timeout', type=float, default=1.0,
+                        dest='min_timeout',
+                        help='minimal timeout in seconds (default: '
+                        '%(default)s)')
+    parser.add_argument('-s', '--suffix', default=None,
+                        help='candidate file name suffix (default: same as '
+                        'input)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of tests to run in parallel '
+                        '(default: %(default)s)')
+    parser.add_argument('-w', '--work-dir', dest='work_dir',
+                        help='directory for the test cache, checkpoints and '
+                        'log (default: INPUT.delta)')
+    parser.add_argument('-o', '--output',
+                        help='copy the minimal successful input to OUTPUT')
+    parser.add_argument('-H', '--hierarchical', action='store_true',
+                        help='reduce along the nesting levels (top-down), '
+                        'before falling back to lines')
+    parser.add_argument('--lang', choices=['c', 'fortran'],
+                        help='language for the hierarchical mode: "c" (braces, '
+                        'also C++) or "fortran" (program units, block '
+                        'constructs and BEGIN...END). Default: guess from '
+                        'suffix')
+    parser.add_argument('--compare-flat', action='store_true',
+                        dest='compare_flat',
+                        help='after the hierarchical reduction, reduce the '
+                        'input in line mode (in a separate work directory) '
+                        'and compare the number of tests')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore the checkpoint (the test cache is still '
+                        'used)')
+    parser.add_argument('--seed', type=int,
+                        help='random seed for granularity increase')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='say nothing')
+    args = parser.parse_args()
+    if (args.compile is None) != (args.ice is None):
+        parser.error('--compile and --ice must be used together')
+    quiet = args.quiet
+    if args.suffix is None:
+        args.suffix = os.path.splitext(args.input)[1]
+    if args.work_dir is None:
+        args.work_dir = args.input + '.delta'
+    if args.compare_flat:
+        args.hierarchical = True
+    if args.hierarchical and args.lang is None:
+        args.lang = get_lang(args.suffix)
+        if args.lang is None:
+            parser.error('cannot guess language from suffix "{}", use '
+                         '--lang'.format(args.suffix))
+    random.seed(args.seed)
+
+    chunks = read_input_chunks(args.input)
+    try:
+        reducer = reduce_file(args, chunks, args.work_dir, args.hierarchical)
+        output('Minimal input: ' + reducer.best_path)
+        if args.output:
+            shutil.copyfile(reducer.best_path, args.output)
+        if args.compare_flat:
+            output('Reducing in line mode for comparison')
+            flat = reduce_file(args, chunks,
+                               os.path.join(args.work_dir, 'flat'), False)
+            output('Tests: hierarchical {}, line mode {} ({:.1f}x); lines: '
+                   'hierarchical {}, line mode {}'.format(
+                        reducer.num_tests, flat.num_tests,
+                        float(flat.num_tests) / max(reducer.num_tests, 1),
+                        count_lines(chunks, reducer.markers),
+                        count_lines(chunks, flat.markers)))
+    except DeltaError as ex:
+        sys.stderr.write(str(ex) + '\n')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
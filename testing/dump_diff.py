@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+# Compare GCC dumps (-fdump-tree-all, -fdump-ipa-all, -fdump-rtl-all) produced
+# by two compilers. Dump files are paired by pass name (pass numbers differ
+# between GCC versions), normalized with strip_num.py rules and hashed in
+# parallel. Passes with equal hashes are skipped, diff is run only for the
+# ones that differ. Hashes are cached in each dump directory (keyed by file
+# name, size and modification time), so repeated comparisons against the same
+# baseline only need to hash the new dumps.
+
+from __future__ import print_function
+
+import os, os.path
+import sys
+import argparse
+import hashlib
+import json
+import multiprocessing
+import re
+import shutil
+import subprocess
+import tempfile
+
+from strip_num import strip_blocks
+
+CACHE_NAME = '.dump_diff_cache'
+
+# <source>.<number><kind>.<pass>, e.g., test.c.214t.optimized
+dump_re = re.compile(r'^(.*)\.(\d+)([tirl])\.(.+)$')
+
+def pass_key(fname):
+    """Returns (key, order) for dump file name: key identifies the pass
+    across GCC versions, order is the pass number. Returns None for files,
+    which are not dumps"""
+    m = dump_re.match(fname)
+    if m is None or fname.endswith('.idx'):  # index made by dump_index.py
+        return None
+    return ('{}.{}.{}'.format(m.group(1), m.group(3), m.group(4)),
+            int(m.group(2)))
+
+def hash_dump(job):
+    (idx, path) = job
+    h = hashlib.sha1()
+    for block in strip_blocks(path):
+        h.update(block)
+    return (idx, path, h.hexdigest())
+
+class DumpDir(object):
+    def __init__(self, path):
+        self.path = path
+        self.files = {}     # pass key -> (order, file name)
+        for fname in os.listdir(path):
+            key = pass_key(fname)
+            if key is not None and os.path.isfile(os.path.join(path, fname)):
+                self.files[key[0]] = (key[1], fname)
+        self._cache_path = os.path.join(path, CACHE_NAME)
+        self._cache = {}
+        if os.path.exists(self._cache_path):
+            try:
+                with open(self._cache_path, 'r') as f:
+                    self._cache = json.load(f)
+            except ValueError:
+                pass
+        self.hashes = {}
+
+    def _stamp(self, fname):
+        st = os.stat(os.path.join(self.path, fname))
+        return [st.st_size, st.st_mtime]
+
+    def uncached(self, keys):
+        """Returns paths of files, which need hashing"""
+        res = []
+        for key in keys:
+            fname = self.files[key][1]
+            entry = self._cache.get(fname)
+            if entry is not None and entry[:2] == self._stamp(fname):
+                self.hashes[key] = entry[2]
+            else:
+                res.append(os.path.join(self.path, fname))
+        return res
+
+    def set_hash(self, path, digest):
+        fname = os.path.basename(path)
+        self.hashes[pass_key(fname)[0]] = digest
+        self._cache[fname] = self._stamp(fname) + [digest]
+
+    def save_cache(self):
+        try:
+            with open(self._cache_path + '.tmp', 'w') as f:
+                json.dump(self._cache, f)
+            os.rename(self._cache_path + '.tmp', self._cache_path)
+        except (IOError, OSError):
+            pass    # read-only directory
+
+def write_normalized(src, dest):
+    with open(dest, 'wb') as out:
+        for block in strip_blocks(src):
+            out.write(block)
+
+def run_diff(path_a, path_b, diff_args):
+    """Runs diff on normalized copies of dumps, returns its output"""
+    tmp_dir = tempfile.mkdtemp(prefix='dump_diff')
+    try:
+        norm_a = os.path.join(tmp_dir, 'a')
+        norm_b = os.path.join(tmp_dir, 'b')
+        write_normalized(path_a, norm_a)
+        write_normalized(path_b, norm_b)
+        proc = subprocess.Popen(['diff'] + diff_args + [norm_a, norm_b],
+                                stdout=subprocess.PIPE)
+        out = proc.communicate()[0]
+    finally:
+        shutil.rmtree(tmp_dir)
+    return out.decode('utf-8', 'replace')
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare normalized GCC '
+                                     'dumps in two directories')
+    parser.add_argument('dir_a', metavar='DIR_A', help='baseline dumps')
+    parser.add_argument('dir_b', metavar='DIR_B', help='new dumps')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of worker processes (default: '
+                        '%(default)s)')
+    parser.add_argument('-a', '--all-diffs', action='store_true',
+                        dest='all_diffs',
+                        help='show diffs for all passes that differ (by '
+                        'default only the first one is shown)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only report the first pass that differs')
+    parser.add_argument('--diff-args', default='-u', dest='diff_args',
+                        help='arguments for diff (default: %(default)s)')
+    args = parser.parse_args()
+
+    dirs = [DumpDir(args.dir_a), DumpDir(args.dir_b)]
+    common = set(dirs[0].files) & set(dirs[1].files)
+    jobs = [(idx, path) for idx in [0, 1] for path in dirs[idx].uncached(common)]
+    if jobs:
+        pool = multiprocessing.Pool(max(args.jobs, 1))
+        try:
+            for (idx, path, digest) in pool.imap_unordered(hash_dump, jobs):
+                dirs[idx].set_hash(path, digest)
+        finally:
+            pool.terminate()
+            pool.join()
+        for d in dirs:
+            d.save_cache()
+
+    # Order passes as in the baseline
+    keys = sorted(set(dirs[0].files) | set(dirs[1].files),
+                  key=lambda k: (dirs[0].files.get(k, dirs[1].files.get(k))[0], k))
+    differ = []
+    for key in keys:
+        if key not in common:
+            status = 'only in ' + ('A' if key in dirs[0].files else 'B')
+        elif dirs[0].hashes[key] == dirs[1].hashes[key]:
+            status = 'same'
+        else:
+            status = 'DIFFERS'
+            differ.append(key)
+        if not args.quiet:
+            print('{:<10} {}'.format(status, key))
+
+    print('Hashed {} file(s), {} cached; {} of {} common passes differ'.format(
+            len(jobs), 2 * len(common) - len(jobs), len(differ), len(common)))
+    if not differ:
+        return
+    print('First pass that differs: ' + differ[0])
+    if args.quiet:
+        sys.exit(1)
+    for key in differ if args.all_diffs else differ[:1]:
+        paths = [os.path.join(d.path, d.files[key][1]) for d in dirs]
+        print('=== {} ({} vs {})'.format(key, paths[0], paths[1]))
+        sys.stdout.write(run_diff(paths[0], paths[1], args.diff_args.split()))
+    sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+# Per-function index of large GCC dump files. The index is built in a single
+# pass over the (memory-mapped) dump and stored next to it (DUMP.idx). For
+# each ";; Function foo (...)" section it records the byte range and a hash
+# of the section contents normalized with strip_num.py rules. Sections are
+# keyed on the assembler name, so overloads and clones (which share the
+# name) are told apart. Extraction of a function and per-function comparison
+# of two dumps only touch the relevant parts of the dumps.
+
+from __future__ import print_function
+
+import os, os.path
+import sys
+import argparse
+import difflib
+import hashlib
+import json
+import mmap
+import re
+from collections import OrderedDict
+
+from strip_num import strip_bytes_re, strip_num
+
+INDEX_VERSION = 2
+
+header_re = re.compile(br'^;; Function ([^\n]*)', re.M)
+# "foo (_Z3fooi, funcdef_no=...)" or (older GCC) "int foo(int) (_Z3fooi, ...)"
+_name_re = re.compile(r'(.*?) \((\S+?)[,)]')
+
+def parse_header(text):
+    """Returns (name, assembler name) of a ";; Function" header (without
+    the prefix)"""
+    m = _name_re.match(text)
+    if m is None:
+        name = text.split(' ', 1)[0]
+        return (name, name)
+    return (m.group(1), m.group(2))
+
+class DumpIndex(object):
+    def __init__(self, path):
+        self.path = path
+        self.functions = []   # list of [name, asm name, start, stop, hash]
+        self._by_name = {}
+        self._by_key = OrderedDict()
+
+    @property
+    def index_path(self):
+        return self.path + '.idx'
+
+    def _stamp(self):
+        st = os.stat(self.path)
+        return [st.st_size, st.st_mtime]
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, 'r') as f:
+                data = json.load(f)
+        except ValueError:
+            return False
+        if data.get('version') != INDEX_VERSION or \
+                data.get('stamp') != self._stamp():
+            return False
+        self.functions = data['functions']
+        return True
+
+    def build(self):
+        """Scans the dump, computes normalized hashes of functions"""
+        self.functions = []
+        size = os.path.getsize(self.path)
+        if size:
+            with open(self.path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    starts = [(m.start(), parse_header(
+                                    m.group(1).decode('utf-8', 'replace')))
+                              for m in header_re.finditer(mm)]
+                    for (i, (start, (name, asm_name))) in enumerate(starts):
+                        stop = starts[i + 1][0] if i + 1 < len(starts) else size
+                        # Skip the header line: it contains UIDs
+                        body_start = mm.find(b'\n', start, stop)
+                        body_start = stop if body_start < 0 else body_start + 1
+                        body = strip_bytes_re.sub(br'\1[..]', mm[body_start:stop])
+                        self.functions.append([name, asm_name, start, stop,
+                                               hashlib.sha1(body).hexdigest()])
+                finally:
+                    mm.close()
+        data = { 'version': INDEX_VERSION, 'stamp': self._stamp(),
+                 'functions': self.functions }
+        try:
+            with open(self.index_path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.rename(self.index_path + '.tmp', self.index_path)
+        except (IOError, OSError):
+            pass    # read-only directory, keep the index in memory
+
+    def load(self):
+        """Loads the index, rebuilds it if it is missing or stale"""
+        if not self._load():
+            self.build()
+        self._by_name = {}
+        self._by_key = OrderedDict()
+        for func in self.functions:
+            self._by_name.setdefault(strip_num(func[0]), []).append(func)
+            self._by_key.setdefault(self.key(func), []).append(func)
+        return self
+
+    @staticmethod
+    def key(func):
+        """Assembler name of a section with clone numbers stripped"""
+        return strip_num(func[1])
+
+    def find(self, name):
+        """Returns the list of sections for function name or assembler
+        name (clone numbers are ignored)"""
+        name = strip_num(name)
+        return self._by_key.get(name) or self._by_name.get(name, [])
+
+    def keys(self):
+        """Returns the list of distinct keys in order of appearance"""
+        return list(self._by_key)
+
+    def sections(self, key):
+        return self._by_key.get(key, [])
+
+    def read(self, func):
+        (_, _, start, stop, _) = func
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return mm[start:stop]
+            finally:
+                mm.close()
+
+    def read_normalized(self, func):
+        return strip_bytes_re.sub(br'\1[..]', self.read(func))
+
+def label(func):
+    """Name of a section shown to the user"""
+    (name, asm_name) = func[:2]
+    return name if name == asm_name else '{} ({})'.format(name, asm_name)
+
+def pair_sections(idx_a, idx_b, keys):
+    """Returns (pairs, only in A, only in B) for sections with the given
+    keys. Sections with the same key (e.g., several dumps of a function in
+    one file) are paired in order of appearance"""
+    pairs = []
+    only_a = []
+    only_b = []
+    for key in keys:
+        funcs_a = idx_a.sections(key)
+        funcs_b = idx_b.sections(key)
+        pairs += zip(funcs_a, funcs_b)
+        only_a += funcs_a[len(funcs_b):]
+        only_b += funcs_b[len(funcs_a):]
+    return (pairs, only_a, only_b)
+
+def diff_function(idx_a, idx_b, func_a, func_b):
+    lines_a = idx_a.read_normalized(func_a).decode('utf-8', 'replace').splitlines(True)
+    lines_b = idx_b.read_normalized(func_b).decode('utf-8', 'replace').splitlines(True)
+    return ''.join(difflib.unified_diff(lines_a, lines_b,
+                                        idx_a.path + ':' + label(func_a),
+                                        idx_b.path + ':' + label(func_b)))
+
+def cmd_index(args):
+    for path in args.dumps:
+        idx = DumpIndex(path)
+        idx.build()
+        print('{}: {} functions'.format(path, len(idx.functions)))
+
+def cmd_list(args):
+    idx = DumpIndex(args.dump).load()
+    for (name, asm_name, start, stop, digest) in idx.functions:
+        print('{:>12} {:>10} {} {} ({})'.format(start, stop - start,
+                                               digest[:12], name, asm_name))
+
+def cmd_extract(args):
+    idx = DumpIndex(args.dump).load()
+    funcs = idx.find(args.function)
+    if not funcs:
+        sys.stderr.write('Function {} not found\n'.format(args.function))
+        sys.exit(1)
+    out = sys.stdout.buffer if hasattr(sys.stdout, 'buffer') else sys.stdout
+    for func in funcs if args.all else funcs[:1]:
+        data = idx.read(func)
+        out.write(strip_bytes_re.sub(br'\1[..]', data) if args.normalize
+                  else data)
+
+def cmd_diff(args):
+    idx_a = DumpIndex(args.dump_a).load()
+    idx_b = DumpIndex(args.dump_b).load()
+    if args.function:
+        funcs_a = idx_a.find(args.function)
+        funcs_b = idx_b.find(args.function)
+        if not funcs_a or not funcs_b:
+            sys.stderr.write('Function {} not found\n'.format(args.function))
+            sys.exit(2)
+        keys = []
+        for func in funcs_a + funcs_b:
+            if DumpIndex.key(func) not in keys:
+                keys.append(DumpIndex.key(func))
+        (pairs, only_a, only_b) = pair_sections(idx_a, idx_b, keys)
+        text = ''.join(diff_function(idx_a, idx_b, func_a, func_b)
+                       for (func_a, func_b) in pairs)
+        sys.stdout.write(text)
+        for func in only_a:
+            print('only in A: ' + label(func))
+        for func in only_b:
+            print('only in B: ' + label(func))
+        sys.exit(1 if text or only_a or only_b else 0)
+    keys = idx_a.keys() + [key for key in idx_b.keys()
+                           if not idx_a.sections(key)]
+    (pairs, only_a, only_b) = pair_sections(idx_a, idx_b, keys)
+    differ = 0
+    for (func_a, func_b) in pairs:
+        if func_a[4] != func_b[4]:
+            differ += 1
+            print('DIFFERS:   ' + label(func_a))
+            if args.show:
+                sys.stdout.write(diff_function(idx_a, idx_b, func_a, func_b))
+    for func in only_a:
+        print('only in A: ' + label(func))
+    for func in only_b:
+        print('only in B: ' + label(func))
+    sys.exit(1 if differ or only_a or only_b else 0)
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-function index of '
+                                     'GCC dump files')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    p = sub.add_parser('index', help='(re)build index of dump files')
+    p.add_argument('dumps', metavar='DUMP', nargs='+')
+    p.set_defaults(func=cmd_index)
+    p = sub.add_parser('list', help='list functions in a dump')
+    p.add_argument('dump', metavar='DUMP')
+    p.set_defaults(func=cmd_list)
+    p = sub.add_parser('extract', help='print dump of a single function')
+    p.add_argument('dump', metavar='DUMP')
+    p.add_argument('function', metavar='FUNCTION')
+    p.add_argument('-n', '--normalize', action='store_true',
+                   help='strip numbers (see strip_num.py)')
+    p.add_argument('-a', '--all', action='store_true',
+                   help='print all sections for FUNCTION (e.g., clones)')
+    p.set_defaults(func=cmd_extract)
+    p = sub.add_parser('diff', help='compare functions in two dumps')
+    p.add_argument('dump_a', metavar='DUMP_A')
+    p.add_argument('dump_b', metavar='DUMP_B')
+    p.add_argument('function', metavar='FUNCTION', nargs='?',
+                   help='show diff for FUNCTION (by default list all '
+                   'functions that differ)')
+    p.add_argument('-s', '--show', action='store_true',
+                   help='show diffs for all functions that differ')
+    p.set_defaults(func=cmd_diff)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
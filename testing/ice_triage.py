@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# Compile a corpus of testcases in parallel, extract signatures of internal
+# compiler errors and cluster the testcases by signature. For each cluster
+# the smallest testcase is selected as a representative, so that only one
+# testcase per distinct bug needs to be reduced.
+#
+# Signature is the ICE message (without the testcase location) and the top
+# frames of the backtrace (function names only). Colors are stripped,
+# addresses and clone numbers are normalized in the same way as strip_num.py
+# does.
+
+from __future__ import print_function
+
+import os, os.path
+import sys
+import argparse
+import json
+import multiprocessing
+import re
+import shlex
+import shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Local
+from gcc.common import collect_sources, strip_ansi_colors
+from gcc.env import Environment
+from gcc.invoke import GCCInvoker
+from strip_num import strip_num
+
+ice_re = re.compile(r'internal compiler error:\s*(.*)$')
+frame_re = re.compile(r'^0x[0-9a-f]+\s+(.*?)\s*$')
+addr_re = re.compile(r'0x[0-9a-f]+')
+# Frames of the diagnostic machinery, which are the same for all ICEs
+skip_frames = ['crash_signal', 'internal_error', 'fancy_abort',
+               'diagnostic_report_diagnostic', 'diagnostic_impl',
+               'diagnostic_action_after_output']
+
+def normalize(line):
+    return ' '.join(strip_num(addr_re.sub('0x[..]', line)).split())
+
+def get_signature(stderr, num_frames):
+    """Returns the normalized signature of the ICE reported in stderr (or
+    None, if it does not contain an ICE)"""
+    message = None
+    frames = []
+    for line in strip_ansi_colors(stderr).splitlines():
+        if message is None:
+            m = ice_re.search(line)
+            if m:
+                message = normalize(m.group(1))
+            continue
+        m = frame_re.match(line)
+        if m:
+            func = normalize(m.group(1))
+            if func.split('(')[0] not in skip_frames \
+                    and not func.startswith('diagnostic_'):
+                frames.append(func)
+            if len(frames) >= num_frames:
+                break
+    if message is None:
+        return None
+    return ' | '.join([message] + frames)
+
+_compiler = None
+
+def init_worker(compiler_path):
+    global _compiler
+    _compiler = GCCInvoker(compiler_path)
+
+def triage_file(job):
+    (path, flags, timeout, num_frames) = job
+    res = _compiler.compile(path, flags + ['-o', os.devnull], timeout)
+    sig = get_signature(res.stderr, num_frames) if res.is_ice else None
+    if res.timed_out:
+        status = 'timeout'
+    elif sig is not None:
+        status = 'ice'
+    else:
+        status = 'ok' if res.ok else 'error'
+    return (path, status, sig, os.path.getsize(path), res.elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Cluster testcases by ICE '
+                                     'signature')
+    parser.add_argument('inputs', metavar='FILE', nargs='+',
+                        help='testcases or directories containing them')
+    parser.add_argument('-c', '--compiler', required=True,
+                        help='compiler driver (gcc, g++ or gfortran)')
+    parser.add_argument('-f', '--flags', default='-c',
+                        help='compiler flags (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of parallel jobs (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='kill the compiler after TIMEOUT seconds '
+                        '(default: %(default)s)')
+    parser.add_argument('--frames', type=int, default=3,
+                        help='number of backtrace frames in signature '
+                        '(default: %(default)s)')
+    parser.add_argument('-o', '--output',
+                        help='write clusters to OUTPUT (JSON)')
+    parser.add_argument('--reps', metavar='DIR',
+                        help='copy representatives of clusters to DIR')
+    args = parser.parse_args()
+
+    env = Environment()
+    con = env
+    files = collect_sources(args.inputs)
+    if not files:
+        parser.error('no testcases found')
+    flags = shlex.split(args.flags)
+    con.info('Compiling {} testcases with {}'.format(len(files), args.compiler))
+    jobs = [(path, flags, args.timeout, args.frames) for path in files]
+    pool = multiprocessing.Pool(args.jobs, init_worker, (args.compiler,))
+    clusters = {}
+    stats = {'ok': 0, 'error': 0, 'timeout': 0, 'ice': 0}
+    try:
+        for (path, status, sig, size, elapsed) in \
+                pool.imap_unordered(triage_file, jobs, chunksize=4):
+            stats[status] += 1
+            if sig is not None:
+                clusters.setdefault(sig, []).append((size, path))
+    finally:
+        pool.terminate()
+        pool.join()
+
+    con.info('Compiled OK: {ok}, errors: {error}, timeouts: {timeout}, '
+             'ICEs: {ice}'.format(**stats))
+    result = []
+    for (sig, members) in sorted(clusters.items(),
+                                 key=lambda c: (-len(c[1]), c[0])):
+        members.sort()
+        result.append({ 'signature': sig,
+                        'count': len(members),
+                        'representative': members[0][1],
+                        'files': [p for (_, p) in members] })
+    con.ok('Distinct ICEs: {}'.format(len(result)))
+    for (i, cl) in enumerate(result):
+        con.info('{:3}. [{} file(s)] {}'.format(i + 1, cl['count'],
+                                               cl['signature']))
+        con.info('     smallest: ' + cl['representative'])
+
+    if args.reps:
+        if not os.path.isdir(args.reps):
+            os.makedirs(args.reps)
+        for (i, cl) in enumerate(result):
+            ext = os.path.splitext(cl['representative'])[1]
+            shutil.copyfile(cl['representative'],
+                            os.path.join(args.reps, 'ice{:03}{}'.format(i + 1, ext)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
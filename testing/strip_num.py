@@ -1,19 +1,156 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python
 
+# Replace numbers, which are likely to change between compilations (addresses,
+# SSA name versions, clone numbers), in GCC dumps with [..]
+#
+# Large inputs (-fdump-tree-all -fdump-ipa-all) are processed in blocks of
+# whole lines using mmap, and multiple files are processed by a pool of
+# worker processes.
+
+from __future__ import print_function
+
+import os, os.path
 import sys
+import argparse
+import mmap
+import multiprocessing
 import re
+import shutil
+import tempfile
+import time
+
+# All rules in a single pass:
+# * hexadecimal numbers after @0x (addresses)
+# * numbers after / (SSA name versions) and after .constprop., .part.,
+#   .isra., .D. (clones, decl UIDs)
+# The prefix is captured by the first group. Starting the regex with a
+# character set lets the regex engine skip the rest of the text quickly.
+_strip_re_str = (r'([@/.](?:(?<=@)0x(?=[0-9a-f])|(?<=/)(?=\d)|'
+                 r'(?<=\.)(?:constprop|part|isra|D)\.(?=\d)))'
+                 r'(?:(?<=x)[0-9a-f]+|\d+)')
+strip_re = re.compile(_strip_re_str)
+strip_bytes_re = re.compile(_strip_re_str.encode('ascii'))
+
+BLOCK_SIZE = 16 * 1024 * 1024
+
+def strip_num(line):
+    """Replace addresses, SSA name versions and clone numbers in line
+    with [..]"""
+    return strip_re.sub(r'\1[..]', line)
+
+def strip_blocks(path, block_size=BLOCK_SIZE):
+    """Generator: yields stripped contents of file path in blocks (each
+    block consists of whole lines)"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < size:
+                end = min(start + block_size, size)
+                if end < size:
+                    # Extend or shrink the block to the end of line
+                    nl = mm.rfind(b'\n', start, end)
+                    if nl < 0:
+                        nl = mm.find(b'\n', end)
+                    end = nl + 1 if nl >= 0 else size
+                yield strip_bytes_re.sub(br'\1[..]', mm[start:end])
+                start = end
+        finally:
+            mm.close()
+
+def strip_file(job):
+    """Strips file src, writes the result to dest (src can be the same as
+    dest). Returns size of src"""
+    (src, dest) = job
+    size = os.path.getsize(src)
+    dest_dir = os.path.dirname(os.path.abspath(dest))
+    if not os.path.isdir(dest_dir):
+        try:
+            os.makedirs(dest_dir)
+        except OSError:
+            if not os.path.isdir(dest_dir):
+                raise
+    (fd, tmp_path) = tempfile.mkstemp(dir=dest_dir, prefix='.strip_num')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for block in strip_blocks(src):
+                out.write(block)
+        shutil.copymode(src, tmp_path)
+        os.rename(tmp_path, dest)
+    except:
+        os.unlink(tmp_path)
+        raise
+    return size
+
+def collect_files(inputs, out_dir):
+    """Returns a list of (source, destination) pairs. Directories are
+    scanned recursively, their structure is mirrored in out_dir"""
+    jobs = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for (dirpath, dirnames, fnames) in os.walk(path):
+                dirnames.sort()
+                for fname in sorted(fnames):
+                    src = os.path.join(dirpath, fname)
+                    rel = os.path.relpath(src, path)
+                    dest = os.path.join(out_dir, rel) if out_dir else src
+                    jobs.append((src, dest))
+        else:
+            dest = os.path.join(out_dir, os.path.basename(path)) \
+                        if out_dir else path
+            jobs.append((path, dest))
+    return jobs
 
 def main():
-    if len(sys.argv) != 2:
-        sys.stderr.write('Usage: strip_num.py FILE')
-        sys.exit(1)
-    hex_re = re.compile(r'(?<=@0x)[0-9a-f]+')
-    num_re = re.compile(r'(/|\.(?:constprop|part|isra|D)\.)\d+')
-    with open(sys.argv[1], 'rb') as f:
-        for line in f:
-            line = hex_re.sub('[..]', line)
-            line = num_re.sub(r'\1[..]', line)
-            sys.stdout.write(line)
+    parser = argparse.ArgumentParser(description='Strip numbers from GCC '
+                                     'dumps')
+    parser.add_argument('inputs', metavar='FILE', nargs='+',
+                        help='dump files or directories')
+    out_group = parser.add_mutually_exclusive_group()
+    out_group.add_argument('-i', '--in-place', action='store_true',
+                           dest='in_place', help='modify files in place')
+    out_group.add_argument('-o', '--output-dir', dest='out_dir',
+                           help='write results to OUTPUT_DIR (directory '
+                           'structure of inputs is mirrored)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of worker processes (default: '
+                        '%(default)s)')
+    parser.add_argument('-s', '--stats', action='store_true',
+                        help='report throughput')
+    args = parser.parse_args()
+    start = time.time()
+    if not args.in_place and args.out_dir is None:
+        # Write everything to stdout, in order
+        if any(os.path.isdir(p) for p in args.inputs):
+            parser.error('directories require --in-place or --output-dir')
+        out = sys.stdout.buffer if hasattr(sys.stdout, 'buffer') else sys.stdout
+        total = 0
+        for path in args.inputs:
+            for block in strip_blocks(path):
+                out.write(block)
+            total += os.path.getsize(path)
+        out.flush()
+        num_files = len(args.inputs)
+    else:
+        jobs = collect_files(args.inputs, args.out_dir)
+        num_files = len(jobs)
+        if args.jobs > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(args.jobs)
+            try:
+                total = sum(pool.imap_unordered(strip_file, jobs))
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            total = sum([strip_file(job) for job in jobs])
+    if args.stats:
+        elapsed = max(time.time() - start, 1e-6)
+        sys.stderr.write('{} file(s), {:.1f} MB in {:.2f} sec: {:.1f} MB/s\n'.format(
+                            num_files, total / 1e6, elapsed, total / 1e6 / elapsed))
 
 if __name__ == '__main__':
     main()
@@ -1,9 +1,18 @@
 #!/usr/bin/env python2.7
 
+from __future__ import print_function, division
+
 import os, os.path
 import argparse
+import io
+import multiprocessing
+import shutil
 import sys
 import re
+import tempfile
+import time
+
+from dead_decls import strip_dead_decls_fixpoint, report_size
 
 # Strip linemarkers, pragmas and definitions of CPU intrinsics with declarations.
 
@@ -17,11 +26,17 @@ import re
 # * remove blank lines
 # * replace definitions of CPU intrinsics with declarations
 # * replace __is_trivially_xable(...) with "1" - to make the source parsable by GCC 4.9
+# * remove declarations, which are not used by the testcase itself (see
+#   dead_decls.py)
+#
+# Multiple files (or directories) can be processed in parallel, in place or
+# into another directory.
 
 include_re = re.compile(r'^#\s+\d+\s+".*"[ 0-9]+$')
 intrin_include_re = re.compile(r'^#\s+\d+\s+".*/include/[a-z0-9]+'
                                 '(?:intrin|3dnow)\.h"[ 0-9]*$')
 enum_re = re.compile(r'^\s*(?:typedef\s+)?enum\s+[a-zA-Z0-9_]*\s*$')
+preprocessed_exts = ['.i', '.ii', '.mi', '.mii']
 trivially_re = re.compile(r'__is_trivially_(?:copyable|assignable|constructible)\s*\([^)]*\)')
 
 def make_strip_re(args):
@@ -47,6 +62,8 @@ def make_strip_re(args):
 def strip_trivially(line):
     return trivially_re.sub('1', line)
 
+# Reference line-by-line implementation (used by --benchmark)
+
 def strip_other(args, src):
     """Strip all stuff specified in args, except intrinsics"""
     line_re = make_strip_re(args)
@@ -88,6 +105,225 @@ def strip_intrin(args, src):
             include = bool(m)
 
 
+# Single-pass engine. The input is processed in blocks of whole lines. Line
+# markers and pragmas are removed from a block by a single regex substitution
+# (blank lines - by another one). When intrinsics are stripped, only line
+# markers are examined to find the parts of the block which come from
+# intrinsic headers, and only these parts are processed line by line.
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# A directive (after a newline)
+directive_re = re.compile(r'\n(#[^\n]*\n?)')
+line_split_re = re.compile(r'[^\n]*\n|[^\n]+$')
+# A newline followed by one or more blank lines
+blank_lines_re = re.compile(r'\n\s*\n')
+block_trivially_re = re.compile(r'__is_trivially_(?:copyable|assignable|constructible)'
+                                r'\s*\([^)\n]*\)')
+
+def make_block_strip_re(args):
+    """Returns a regular expression, which matches a newline followed by a
+    line marker or a pragma (depending on args)"""
+    re_list = []
+    if args.line_markers:
+        re_list.append(r'line')
+        re_list.append(r'\d+[^\S\n]*"')
+    if args.pragmas:
+        re_list.append(r'pragma')
+    if not re_list:
+        return None
+    return re.compile(r'\n[^\S\n]*#[^\S\n]*(?:' + '|'.join(re_list) +
+                      r')[^\n]*(?=\n)')
+
+class Stripper(object):
+    """Applies all rules (except dead declarations) to consecutive blocks of
+    the input"""
+
+    def __init__(self, args):
+        self.strip_re = make_block_strip_re(args)
+        self.line_re = make_strip_re(args)
+        self.blank = args.blank
+        self.intrin = args.intrin
+        self.triv_copy = args.triv_copy
+        # State of strip_intrin, preserved between blocks
+        self.include = False
+        self.after_enum = False
+        self.brace_balance = 0
+
+    def _intrin_lines(self, text, out):
+        for line in line_split_re.findall(text):
+            if self.brace_balance > 0:
+                self.brace_balance += line.count('{') - line.count('}')
+            else:
+                if '{' in line and not self.after_enum:
+                    self.brace_balance = line.count('{') - line.count('}')
+                    out.append(';\n')
+                else:
+                    out.append(line)
+                self.after_enum = bool(enum_re.match(line))
+
+    def _strip_intrin(self, block):
+        out = []
+        pos = 0
+        for m in directive_re.finditer('\n' + block):
+            line = m.group(1)
+            # Offsets in block
+            start = m.start(1) - 1
+            if self.include:
+                if not include_re.match(line):
+                    continue
+                self._intrin_lines(block[pos:start], out)
+            else:
+                if not intrin_include_re.match(line):
+                    continue
+                self.brace_balance = 0
+                out.append(block[pos:start])
+            out.append(line)
+            pos = m.end(1) - 1
+            self.include = bool(intrin_include_re.match(line))
+        if self.include:
+            self._intrin_lines(block[pos:], out)
+        else:
+            if pos < len(block):
+                self.brace_balance = 0
+            out.append(block[pos:])
+        return ''.join(out)
+
+    def _strip_lines(self, block):
+        # The regexes match a newline followed by lines to remove, so the
+        # first line needs a newline before it, and the last one after it
+        text = '\n' + block
+        last = block[block.rfind('\n') + 1:]
+        if last:
+            text += '\n'
+        if self.strip_re is not None:
+            text = self.strip_re.sub('', text)
+        if self.blank:
+            text = blank_lines_re.sub('\n', text)
+        if last and not self.line_re.match(last):
+            text = text[:-1]
+        return text[1:]
+
+    def process(self, block):
+        if self.intrin:
+            block = self._strip_intrin(block)
+        if self.line_re is not None:
+            block = self._strip_lines(block)
+        if self.triv_copy:
+            block = block_trivially_re.sub('1', block)
+        return block
+
+def open_text(path, mode='r'):
+    # latin-1 round-trips arbitrary bytes, newline='' preserves line endings
+    return io.open(path, mode, encoding='latin-1', newline='')
+
+def read_blocks(f, block_size=BLOCK_SIZE):
+    """Generator: yields blocks of whole lines read from f"""
+    while True:
+        block = f.read(block_size)
+        if not block:
+            return
+        if not block.endswith('\n'):
+            block += f.readline()
+        yield block
+
+def strip_stream(args, f, out):
+    """Strips input stream f, writes the result to out. Returns the number of
+    input lines"""
+    if args.dead_decls:
+        # Needs line markers, so it goes first
+        text = f.read()
+        num_lines = text.count('\n')
+        report = report_size if not args.quiet else None
+        blocks = [strip_dead_decls_fixpoint(text, args.fixpoint, report)]
+    else:
+        num_lines = 0
+        blocks = read_blocks(f)
+    stripper = Stripper(args)
+    for block in blocks:
+        if not args.dead_decls:
+            num_lines += block.count('\n')
+        out.write(stripper.process(block))
+    return num_lines
+
+def strip_file(job):
+    """Strips file src, writes the result to dest atomically (src can be the
+    same as dest). Returns the number of lines in src"""
+    (args, src, dest) = job
+    dest_dir = os.path.dirname(os.path.abspath(dest))
+    if not os.path.isdir(dest_dir):
+        try:
+            os.makedirs(dest_dir)
+        except OSError:
+            if not os.path.isdir(dest_dir):
+                raise
+    (fd, tmp_path) = tempfile.mkstemp(dir=dest_dir, prefix='.strip_testcase')
+    os.close(fd)
+    try:
+        with open_text(src) as f:
+            with open_text(tmp_path, 'w') as out:
+                num_lines = strip_stream(args, f, out)
+        shutil.copymode(src, tmp_path)
+        os.rename(tmp_path, dest)
+    except:
+        os.unlink(tmp_path)
+        raise
+    return num_lines
+
+def collect_files(inputs, out_dir):
+    """Returns a list of (source, destination) pairs. Directories are
+    scanned recursively for preprocessed sources, their structure is
+    mirrored in out_dir"""
+    jobs = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for (dirpath, dirnames, fnames) in os.walk(path):
+                dirnames.sort()
+                for fname in sorted(fnames):
+                    if os.path.splitext(fname)[1] not in preprocessed_exts:
+                        continue
+                    src = os.path.join(dirpath, fname)
+                    rel = os.path.relpath(src, path)
+                    dest = os.path.join(out_dir, rel) if out_dir else src
+                    jobs.append((src, dest))
+        else:
+            dest = os.path.join(out_dir, os.path.basename(path)) \
+                        if out_dir else path
+            jobs.append((path, dest))
+    return jobs
+
+class NullOutput(object):
+    def write(self, data):
+        pass
+
+def benchmark(args, paths):
+    """Compares throughput of the reference implementation and the
+    single-pass engine (in memory, without I/O)"""
+    total_lines = 0
+    times = [0.0, 0.0]
+    for path in paths:
+        with open_text(path) as f:
+            text = f.read()
+        total_lines += text.count('\n')
+        start = time.time()
+        src = io.StringIO(text)
+        generator = strip_intrin(args, src) if args.intrin else src
+        ref = ''.join(strip_other(args, generator))
+        times[0] += time.time() - start
+        start = time.time()
+        out = io.StringIO()
+        stripper = Stripper(args)
+        for block in read_blocks(io.StringIO(text)):
+            out.write(stripper.process(block))
+        times[1] += time.time() - start
+        if out.getvalue() != ref:
+            sys.stderr.write('{}: results differ\n'.format(path))
+    for (name, elapsed) in zip(['line-by-line', 'single-pass'], times):
+        elapsed = max(elapsed, 1e-6)
+        print('{:<14} {:>9} lines in {:7.2f} sec: {:>10.0f} lines/s'.format(
+                name, total_lines, elapsed, total_lines / elapsed))
+    print('Speedup: {:.2f}x'.format(times[0] / max(times[1], 1e-6)))
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-b', '--blank', action='store_true',
@@ -103,25 +339,76 @@ def main():
     parser.add_argument('-t', '--triv-copy', action='store_true',
                         help='replace __is_trivially_copyable/assignable/... '
                         'with 1 (for GCC 4.9 compat.)')
-    parser.add_argument('input', metavar='INPUT', type=argparse.FileType('r'),
-                        help='input file name')
-    parser.add_argument('-o', '--output',
-                        metavar='OUTPUT', type=argparse.FileType('w'),
-                        default=sys.stdout,
-                        help='output file name (stdout, if omitted)')
+    parser.add_argument('-d', '--dead-decls', action='store_true',
+                        dest='dead_decls',
+                        help='remove declarations, which are not used by '
+                        'the main file (requires line markers)')
+    parser.add_argument('-f', '--fixpoint', action='store_true',
+                        help='with -d: repeat until nothing changes')
+    parser.add_argument('inputs', metavar='INPUT', nargs='+',
+                        help='input files or directories (all .i/.ii files '
+                        'in them are processed)')
+    out_group = parser.add_mutually_exclusive_group()
+    out_group.add_argument('-o', '--output', metavar='OUTPUT',
+                           help='output file name (stdout, if omitted; only '
+                           'for a single input file)')
+    out_group.add_argument('--in-place', action='store_true', dest='in_place',
+                           help='modify files in place')
+    out_group.add_argument('--output-dir', dest='out_dir',
+                           help='write results to OUT_DIR (directory '
+                           'structure of inputs is mirrored)')
+    out_group.add_argument('--benchmark', action='store_true',
+                           help='compare throughput of the single-pass '
+                           'engine and the line-by-line implementation '
+                           '(nothing is written)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of worker processes (default: '
+                        '%(default)s)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not report statistics')
     args = parser.parse_args()
     if args.all:
         args.blank = True
         args.line_markers = True
         args.pragmas = True
-        args.intin = True
+        args.intrin = True
     if not args.blank and not args.line_markers \
             and not args.pragmas and not args.triv_copy \
-            and not args.intrin:
+            and not args.intrin and not args.dead_decls:
         parser.error('no actions specified')
-    generator = strip_intrin(args, args.input) if args.intrin else args.input
-    for line in strip_other(args, generator):
-        args.output.write(line)
+    start = time.time()
+    if args.benchmark:
+        benchmark(args, [src for (src, _) in collect_files(args.inputs, None)])
+        return
+    if not args.in_place and args.out_dir is None:
+        if len(args.inputs) != 1 or os.path.isdir(args.inputs[0]):
+            parser.error('multiple inputs require --in-place or --output-dir')
+        path = args.inputs[0]
+        f = io.open(sys.stdin.fileno(), encoding='latin-1', newline='',
+                    closefd=False) if path == '-' else open_text(path)
+        out = io.open(sys.stdout.fileno(), 'w', encoding='latin-1',
+                      newline='', closefd=False) if args.output is None \
+                else open_text(args.output, 'w')
+        with f:
+            with out:
+                strip_stream(args, f, out)
+        return
+    jobs = [(args, src, dest)
+            for (src, dest) in collect_files(args.inputs, args.out_dir)]
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        try:
+            total = sum(pool.imap_unordered(strip_file, jobs))
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        total = sum([strip_file(job) for job in jobs])
+    if not args.quiet:
+        elapsed = max(time.time() - start, 1e-6)
+        sys.stderr.write('{} file(s), {} lines in {:.2f} sec: {:.0f} lines/s\n'.format(
+                            len(jobs), total, elapsed, total / elapsed))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+# Collect -ftime-report statistics for a corpus of testcases compiled by one or
+# more installed compilers, aggregate them and find passes, which became
+# slower (or faster) between two compilers.
+
+from __future__ import print_function, division
+
+# System
+import sys
+import argparse
+import multiprocessing
+import os, os.path
+import shlex
+
+# Local
+from gcc.common import collect_sources
+from gcc.env import Environment
+from gcc.invoke import (resolve_compilers, init_report_worker,
+                        compile_report)
+from gcc.timereport import (METRICS, TimeReportStore, parse_time_report,
+                            compare_stores)
+
+env = Environment()
+con = env
+
+# Default minimal absolute change for reporting: 0.02 sec or 256 kB of GGC
+# memory
+default_min_change = { 'usr': 0.02, 'sys': 0.02, 'wall': 0.02, 'ggc': 256 }
+
+def get_min_change(args):
+    if args.min_change is not None:
+        return args.min_change
+    return default_min_change[args.metric]
+
+def format_value(metric, value):
+    if metric == 'ggc':
+        return '{:.0f}k'.format(value)
+    return '{:.2f}'.format(value)
+
+def print_comparison(args, old, new):
+    (significant, changes, num_files) = compare_stores(
+            old, new, args.metric, args.threshold, args.sigma,
+            get_min_change(args))
+    print('{} -> {}: {} common file(s), metric: {}'.format(
+            old.label, new.label, num_files, args.metric))
+    shown = changes if args.all else significant
+    if not shown:
+        con.ok('No significant changes')
+        return False
+    print('{:<40} {:>10} {:>10} {:>10} {:>8} {:>8}'.format(
+            'Time variable', 'old', 'new', 'delta', '%', 'noise'))
+    for ch in shown:
+        print('{:<40} {:>10} {:>10} {:>10} {:>+7.1f}% {:>8}{}'.format(
+                ch.name[:40], format_value(args.metric, ch.old),
+                format_value(args.metric, ch.new),
+                format_value(args.metric, ch.delta), ch.percent,
+                format_value(args.metric, ch.noise),
+                ' *' if args.all and ch in significant else ''))
+    return bool(significant)
+
+def cmd_collect(args):
+    try:
+        from config import cfg
+        install_dir = cfg.install_dir
+    except ImportError:
+        install_dir = None
+    compilers = resolve_compilers(env, args.compilers, install_dir)
+    paths = [path for (path, _, _) in compilers]
+    files = collect_sources(args.inputs)
+    if not files:
+        env.fatal_error('No testcases found')
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    flags = shlex.split(args.flags)
+    stores = [TimeReportStore(label, path, compiler.full_version_str, flags)
+              for (path, compiler, label) in compilers]
+    # Repetitions are the outermost loop and compilers the innermost one, so
+    # that slow drift of machine state affects all compilers equally
+    jobs = [(idx, fname, flags, args.timeout)
+            for rep in range(args.repeat)
+            for fname in files
+            for idx in range(len(paths))]
+    con.info('Compiling {} file(s) {} time(s) with {} compiler(s), {} '
+             'job(s)'.format(len(files), args.repeat, len(paths), args.jobs))
+    pool = multiprocessing.Pool(args.jobs, init_report_worker,
+                                (paths, '-ftime-report', parse_time_report))
+    try:
+        for (idx, fname, report, error) in \
+                pool.imap_unordered(compile_report, jobs):
+            if report is not None:
+                stores[idx].add(fname, report)
+            else:
+                stores[idx].add_failure(fname, error)
+    finally:
+        pool.terminate()
+        pool.join()
+    for store in stores:
+        for fname in store.failed:
+            store.files.pop(fname, None)
+        if store.failed:
+            con.warn('{}: {} file(s) failed to compile'.format(
+                        store.label, len(store.failed)))
+        path = os.path.join(args.output_dir, store.label + '.json')
+        store.save(path)
+        con.ok('Saved {}'.format(path))
+    for store in stores[1:]:
+        print_comparison(args, stores[0], store)
+
+def cmd_show(args):
+    store = TimeReportStore.load(args.store)
+    agg = store.aggregate(args.metric)
+    print('{} ({}), {} file(s), {} repetition(s), metric: {}'.format(
+            store.label, store.compiler, len(store.files),
+            store.repetitions, args.metric))
+    total = agg.get('TOTAL', (0.0, 0.0))[0]
+    rows = sorted([(v, n, name) for (name, (v, n)) in agg.items()
+                   if name != 'TOTAL' and not name.startswith('phase ')],
+                  reverse=True)
+    for (value, noise, name) in rows[:args.top]:
+        print('{:<40} {:>10} {:>5.1f}% +-{}'.format(
+                name[:40], format_value(args.metric, value),
+                100.0 * value / total if total else 0.0,
+                format_value(args.metric, noise)))
+    print('{:<40} {:>10}'.format('TOTAL', format_value(args.metric, total)))
+
+def cmd_compare(args):
+    old = TimeReportStore.load(args.old)
+    new = TimeReportStore.load(args.new)
+    if old.flags != new.flags:
+        con.warn('Flags differ: "{}" vs "{}"'.format(' '.join(old.flags),
+                                                   ' '.join(new.flags)))
+    sys.exit(1 if print_comparison(args, old, new) else 0)
+
+def add_compare_args(parser):
+    parser.add_argument('-m', '--metric', choices=METRICS, default='usr',
+                        help='metric to compare (default: %(default)s)')
+    parser.add_argument('--threshold', type=float, default=5.0,
+                        help='minimal relative change, percent (default: '
+                        '%(default)s)')
+    parser.add_argument('--sigma', type=float, default=3.0,
+                        help='minimal change relative to noise (standard '
+                        'deviation) (default: %(default)s)')
+    parser.add_argument('--min-change', type=float, dest='min_change',
+                        help='minimal absolute change (default: 0.02 sec, '
+                        '256 kB for GGC memory)')
+    parser.add_argument('-a', '--all', action='store_true',
+                        help='show all time variables (significant changes '
+                        'are marked with *)')
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect and compare '
+                                     '-ftime-report statistics')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    p = sub.add_parser('collect', help='compile a corpus with -ftime-report')
+    p.add_argument('inputs', metavar='FILE', nargs='+',
+                   help='testcases or directories containing them')
+    p.add_argument('-c', '--compiler', dest='compilers', action='append',
+                   required=True,
+                   help='compiler: path to the driver, installation prefix or '
+                   'name of installation directory (e.g. gcc-6-latest); can '
+                   'be specified multiple times')
+    p.add_argument('-f', '--flags', default='-c -O2',
+                   help='compiler flags (default: %(default)s)')
+    p.add_argument('-r', '--repeat', type=int, default=3,
+                   help='number of repetitions (default: %(default)s)')
+    p.add_argument('-j', '--jobs', type=int,
+                   default=multiprocessing.cpu_count(),
+                   help='number of parallel jobs (default: %(default)s)')
+    p.add_argument('--timeout', type=float, default=300,
+                   help='kill the compiler after TIMEOUT seconds '
+                   '(default: %(default)s)')
+    p.add_argument('-o', '--output-dir', dest='output_dir',
+                   default='time_reports',
+                   help='directory for results (default: %(default)s)')
+    add_compare_args(p)
+    p.set_defaults(func=cmd_collect)
+    p = sub.add_parser('show', help='show aggregated statistics')
+    p.add_argument('store', metavar='STORE', help='result of collect (JSON)')
+    p.add_argument('-m', '--metric', choices=METRICS, default='usr',
+                   help='metric (default: %(default)s)')
+    p.add_argument('-n', '--top', type=int, default=30,
+                   help='number of time variables to show (default: '
+                   '%(default)s)')
+    p.set_defaults(func=cmd_show)
+    p = sub.add_parser('compare', help='compare results for two compilers')
+    p.add_argument('old', metavar='OLD', help='baseline (JSON)')
+    p.add_argument('new', metavar='NEW', help='new results (JSON)')
+    add_compare_args(p)
+    p.set_defaults(func=cmd_compare)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()